@@ -0,0 +1,164 @@
+import json
+import threading
+import time
+
+
+class ModelBackend:
+    """Interface between the agent loop and whatever produces model responses.
+
+    generate_content returns a types.GenerateContentResponse;
+    generate_content_stream is an async generator of response chunks."""
+
+    def generate_content(self, *, model, contents, config=None):
+        raise NotImplementedError
+
+    async def generate_content_stream(self, *, model, contents, config=None):
+        # Backends without native streaming deliver the whole turn as one chunk.
+        # asyncio is imported where it is used: it is slow to import and only
+        # the streaming loop needs it.
+        import asyncio
+
+        yield await asyncio.to_thread(
+            self.generate_content, model=model, contents=contents, config=config
+        )
+
+
+class GenAIBackend(ModelBackend):
+    """Live Gemini backend built on a shared genai.Client."""
+
+    def __init__(self, client=None, api_key=None):
+        if client is None:
+            from google import genai
+
+            client = genai.Client(api_key=api_key)
+        self.client = client
+
+    def generate_content(self, *, model, contents, config=None):
+        return self.client.models.generate_content(
+            model=model, contents=contents, config=config
+        )
+
+    async def generate_content_stream(self, *, model, contents, config=None):
+        stream = await self.client.aio.models.generate_content_stream(
+            model=model, contents=contents, config=config
+        )
+        async for chunk in stream:
+            yield chunk
+
+
+def dump_model(model_object):
+    return model_object.model_dump(mode="json", exclude_none=True)
+
+
+class RecordingBackend(ModelBackend):
+    """Passes calls through to another backend and appends each request and
+    response to a cassette file (one JSON interaction per line)."""
+
+    def __init__(self, backend, path):
+        self.backend = backend
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _record(self, model, contents, chunks):
+        interaction = {
+            "request": {
+                "model": model,
+                "contents": [dump_model(content) for content in contents],
+            },
+            "response": [dump_model(chunk) for chunk in chunks],
+        }
+        with self._lock, open(self.path, "a") as f:
+            f.write(json.dumps(interaction) + "\n")
+
+    def generate_content(self, *, model, contents, config=None):
+        response = self.backend.generate_content(
+            model=model, contents=contents, config=config
+        )
+        self._record(model, contents, [response])
+        return response
+
+    async def generate_content_stream(self, *, model, contents, config=None):
+        chunks = []
+        async for chunk in self.backend.generate_content_stream(
+            model=model, contents=contents, config=config
+        ):
+            chunks.append(chunk)
+            yield chunk
+        self._record(model, contents, chunks)
+
+
+def load_responses(dumped_chunks):
+    """Rebuild response chunks saved with dump_model."""
+    from google.genai import types
+
+    return [
+        types.GenerateContentResponse.model_validate_json(json.dumps(chunk))
+        for chunk in dumped_chunks
+    ]
+
+
+def merge_chunks(chunks):
+    """Turn the chunks of a streamed turn into one response: the last chunk
+    (which carries usage metadata) with the parts of every chunk."""
+    from google.genai import types
+
+    if len(chunks) == 1:
+        return chunks[0]
+    parts = []
+    for chunk in chunks:
+        if chunk.candidates and chunk.candidates[0].content:
+            parts.extend(chunk.candidates[0].content.parts or [])
+    response = chunks[-1]
+    response.candidates = [
+        types.Candidate(content=types.Content(role="model", parts=parts))
+    ]
+    return response
+
+
+def load_cassette(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+class ReplayBackend(ModelBackend):
+    """Serves recorded responses in order without touching the network.
+
+    latency seconds of fake delay are added before every response. A
+    streamed interaction is replayed chunk by chunk; a non-streamed call on a
+    streamed recording gets the last chunk (which carries usage metadata)
+    merged with the earlier parts."""
+
+    def __init__(self, path, latency=0.0):
+        self.path = path
+        self.latency = latency
+        self.interactions = load_cassette(path)
+        self.position = 0
+        self._lock = threading.Lock()
+
+    def rewind(self):
+        self.position = 0
+
+    def _next_chunks(self):
+        with self._lock:
+            if self.position >= len(self.interactions):
+                raise RuntimeError(
+                    f"Cassette {self.path} exhausted after {self.position} interactions"
+                )
+            interaction = self.interactions[self.position]
+            self.position += 1
+        return load_responses(interaction["response"])
+
+    def generate_content(self, *, model, contents, config=None):
+        chunks = self._next_chunks()
+        if self.latency:
+            time.sleep(self.latency)
+        return merge_chunks(chunks)
+
+    async def generate_content_stream(self, *, model, contents, config=None):
+        import asyncio
+
+        chunks = self._next_chunks()
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        for chunk in chunks:
+            yield chunk
@@ -0,0 +1,85 @@
+"""Offline benchmark of the agent loop.
+
+Replays a recorded session against ./calculator and reports, per iteration,
+the time spent in the loop itself (total minus model and tool time), the
+tool time, and how much traced memory grows across repeated sessions.
+
+    uv run benchmarks/bench_agent_loop.py --rounds 20 --max-overhead-ms 5
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import statistics
+import sys
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+from google.genai import types
+from backends import ReplayBackend
+from main import run_agent
+
+DEFAULT_CASSETTE = os.path.join(ROOT, "benchmarks", "cassettes", "calculator_session.jsonl")
+
+
+def replay_session(backend, max_workers):
+    first_request = backend.interactions[0]["request"]["contents"]
+    messages = [types.Content.model_validate(content) for content in first_request[:1]]
+    backend.rewind()
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = run_agent(backend, messages, max_workers=max_workers, show_spinner=False)
+    return result["iterations"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a recorded agent session and time the loop")
+    parser.add_argument("--cassette", default=DEFAULT_CASSETTE)
+    parser.add_argument("--rounds", type=int, default=20, help="Number of replayed sessions")
+    parser.add_argument("--latency", type=float, default=0.0, help="Fake model latency in seconds")
+    parser.add_argument("--max-workers", type=int, default=4)
+    parser.add_argument(
+        "--max-overhead-ms",
+        type=float,
+        help="Exit non-zero if the median per-iteration loop overhead exceeds this",
+    )
+    args = parser.parse_args()
+
+    backend = ReplayBackend(args.cassette, latency=args.latency)
+    replay_session(backend, args.max_workers)  # warm up imports and caches
+
+    tracemalloc.start()
+    memory = []
+    rounds = []
+    for _ in range(args.rounds):
+        rounds.append(replay_session(backend, args.max_workers))
+        memory.append(tracemalloc.get_traced_memory()[0])
+    tracemalloc.stop()
+
+    print(f"{'iter':>4} {'overhead ms':>12} {'tools ms':>10} {'model ms':>10}")
+    overheads = []
+    for index in range(len(rounds[0])):
+        samples = [r[index] for r in rounds if index < len(r)]
+        overhead = statistics.median(
+            (s["total"] - s["model"] - s["tools"]) * 1000 for s in samples
+        )
+        tools = statistics.median(s["tools"] * 1000 for s in samples)
+        model = statistics.median(s["model"] * 1000 for s in samples)
+        overheads.append(overhead)
+        print(f"{index + 1:>4} {overhead:>12.3f} {tools:>10.3f} {model:>10.3f}")
+
+    median_overhead = statistics.median(overheads)
+    growth = (memory[-1] - memory[0]) / max(1, len(memory) - 1)
+    print(f"median loop overhead: {median_overhead:.3f} ms/iteration")
+    print(f"memory growth: {growth / 1024:.1f} KiB/session")
+
+    if args.max_overhead_ms is not None and median_overhead > args.max_overhead_ms:
+        print(f"FAIL: overhead above {args.max_overhead_ms} ms")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
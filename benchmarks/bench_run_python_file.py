@@ -0,0 +1,62 @@
+"""Cold versus warm latency of run_python_file.
+
+Runs the same calculator scripts through a fresh `python3` per call and
+through the warm worker pool, and prints the median and p95 of each.
+
+    uv run benchmarks/bench_run_python_file.py --runs 30
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+from functions import warm_pool
+from functions.config import WORKING_DIRECTORY
+from functions.run_python_file import run_python_file
+
+SCRIPTS = [
+    ("main.py", ["3 + 5"]),
+    ("tests.py", []),
+]
+
+
+def measure(runs):
+    samples = {}
+    for file_path, args in SCRIPTS:
+        timings = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            run_python_file(WORKING_DIRECTORY, file_path, args)
+            timings.append((time.perf_counter() - start) * 1000)
+        samples[file_path] = timings
+    return samples
+
+
+def report(label, samples):
+    for file_path, timings in samples.items():
+        p95 = statistics.quantiles(timings, n=20)[-1]
+        print(f"{label:>5} {file_path:<10} median {statistics.median(timings):8.2f} ms   p95 {p95:8.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare cold and warm run_python_file latency")
+    parser.add_argument("--runs", type=int, default=30)
+    parser.add_argument("--workers", type=int, default=2)
+    args = parser.parse_args()
+
+    warm_pool.configure(0)
+    report("cold", measure(args.runs))
+
+    warm_pool.configure(args.workers, WORKING_DIRECTORY)
+    measure(1)  # let the workers finish their imports
+    report("warm", measure(args.runs))
+
+
+if __name__ == "__main__":
+    main()
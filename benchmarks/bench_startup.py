@@ -0,0 +1,101 @@
+"""Startup cost of the CLI.
+
+Times `import main` and `main.py --help` in fresh interpreters, and checks
+that neither imports the modules that are meant to load only once a model
+call is about to happen (the Gemini SDK, asyncio).
+
+    uv run benchmarks/bench_startup.py --runs 20 --max-import-ms 150
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules the startup path must not pull in
+DEFERRED = ["google.genai", "asyncio"]
+
+CASES = {
+    "python": [sys.executable, "-c", "pass"],
+    "import main": [sys.executable, "-c", "import main"],
+    "--help": [sys.executable, "main.py", "--help"],
+}
+
+
+def measure(command, runs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, cwd=ROOT, stdout=subprocess.DEVNULL, check=True)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def loaded_deferred_modules():
+    code = f"import main, sys; print(' '.join(m for m in {DEFERRED!r} if m in sys.modules))"
+    output = subprocess.run(
+        [sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True
+    )
+    return output.stdout.split()
+
+
+def slowest_imports(count):
+    # -X importtime lines: "import time: self | cumulative | name"
+    output = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    rows = []
+    for line in output.stderr.splitlines():
+        fields = line.split("|")
+        if len(fields) == 3 and fields[0].strip().split()[-1].isdigit():
+            rows.append((int(fields[1]), fields[2].rstrip()))
+    return sorted(rows, reverse=True)[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure CLI startup time")
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument(
+        "--max-import-ms",
+        type=float,
+        help="Fail if the median `import main`, minus bare interpreter startup, is above this",
+    )
+    parser.add_argument("--top", type=int, default=10, help="Number of slowest imports to list")
+    args = parser.parse_args()
+
+    medians = {}
+    for label, command in CASES.items():
+        timings = measure(command, args.runs)
+        medians[label] = statistics.median(timings)
+        p95 = statistics.quantiles(timings, n=20)[-1] if len(timings) > 1 else timings[0]
+        print(f"{label:<12} median {medians[label]:8.2f} ms   p95 {p95:8.2f} ms")
+
+    import_ms = medians["import main"] - medians["python"]
+    print(f"import main costs {import_ms:.2f} ms over a bare interpreter")
+
+    print("Slowest imports (cumulative us):")
+    for cumulative, name in slowest_imports(args.top):
+        print(f"{cumulative:>10} {name}")
+
+    failed = False
+    loaded = loaded_deferred_modules()
+    if loaded:
+        print(f"FAIL: import main loads {', '.join(loaded)}")
+        failed = True
+    if args.max_import_ms is not None and import_ms > args.max_import_ms:
+        print(f"FAIL: import main above {args.max_import_ms} ms")
+        failed = True
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
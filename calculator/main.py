@@ -1,8 +1,48 @@
 # main.py
 
+import os
 import sys
 from pkg.calculator import Calculator
-from pkg.render import format_json_output
+from pkg.render import format_json_output, format_json_lines
+
+EMPTY_EXPRESSION = "Expression is empty or contains only whitespace."
+READ_SIZE = 1 << 16
+
+
+def evaluate_lines(calculator, lines):
+    # (expression, result, error) for each line; errors are reported per
+    # line so one bad expression does not end the stream
+    for line in lines:
+        expression = line.decode(errors="replace").strip()
+        if not expression:
+            yield expression, None, EMPTY_EXPRESSION
+            continue
+        try:
+            yield expression, calculator.evaluate(expression), None
+        except Exception as e:
+            yield expression, None, str(e)
+
+
+def stream(calculator, input_fd, output):
+    """Evaluate one expression per input line and write one NDJSON result
+    per line to output, a binary file.
+
+    Input is read in blocks of whatever is available, and the results of a
+    whole block are written and flushed together: piped files are processed
+    in large batches, while an interactive caller that sends one line and
+    waits still gets its answer straight away."""
+    pending = b""
+    while True:
+        block = os.read(input_fd, READ_SIZE)
+        if not block:
+            break
+        lines = (pending + block).split(b"\n")
+        pending = lines.pop()
+        output.write("".join(format_json_lines(evaluate_lines(calculator, lines))).encode())
+        output.flush()
+    if pending.strip():
+        output.write("".join(format_json_lines(evaluate_lines(calculator, [pending]))).encode())
+        output.flush()
 
 
 def main():
@@ -10,9 +50,14 @@ def main():
     if len(sys.argv) <= 1:
         print("Calculator App")
         print('Usage: python main.py "<expression>"')
+        print("       python main.py --stream  (one expression per stdin line, NDJSON out)")
         print('Example: python main.py "3 + 5"')
         return
 
+    if sys.argv[1:] == ["--stream"]:
+        stream(calculator, sys.stdin.fileno(), sys.stdout.buffer)
+        return
+
     expression = " ".join(sys.argv[1:])
     try:
         result = calculator.evaluate(expression)
@@ -20,7 +65,7 @@ def main():
             to_print = format_json_output(expression, result)
             print(to_print)
         else:
-            print("Error: Expression is empty or contains only whitespace.")
+            print(f"Error: {EMPTY_EXPRESSION}")
     except Exception as e:
         print(f"Error: {e}")
 
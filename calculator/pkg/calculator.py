@@ -1,61 +1,438 @@
 # calculator.py
 
+import math
+import numbers
+import operator
+import re
+import string
+from array import array
+from collections import OrderedDict
+from itertools import repeat
+
+TOKEN = re.compile(
+    r"\s*(?:(?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)|(?P<name>[A-Za-z_]\w*)|(?P<symbol>\S))"
+)
+# The same tokens as plain strings, for the single-pass evaluator
+RAW_TOKEN = re.compile(r"(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?|[A-Za-z_]\w*|\S")
+NUMBER_START = frozenset("0123456789.")
+NAME_START = frozenset(string.ascii_letters + "_")
+
+# Opcodes of a compiled expression; each instruction is (opcode, argument)
+CONST = 0  # push argument
+LOAD = 1  # push the variable named argument
+NEG = 2  # negate the top of the stack
+BINARY = 3  # pop b, then replace a with argument(a, b)
+
+UNARY_MINUS = "neg"
+
+# Operators written inline when lowering to Python; any other operator
+# function is called by name
+INFIX = {operator.add: "+", operator.sub: "-", operator.mul: "*", operator.truediv: "/"}
+
+# Deepest subexpression written inline when lowering; deeper ones are first
+# assigned to a temporary, keeping clear of the parser's nesting limit
+MAX_INLINE_DEPTH = 50
+
+
+def _lower(code, names=None, replace=None):
+    # Translates RPN code into the body of a Python function of v, the
+    # variables mapping, so evaluation runs as native bytecode. With names,
+    # the function instead takes one positional argument per name, in that
+    # order. replace maps operator functions to substitutes. Constants and
+    # operator functions are passed in as names rather than spelled out, so
+    # the source only ever contains names, v[...] lookups with repr'd keys,
+    # parentheses and the four infix operators. Subexpressions nested deeper
+    # than MAX_INLINE_DEPTH are assigned to temporaries t0, t1, ... so long
+    # chains of operations still compile.
+    if len(code) == 1 and code[0][0] == CONST:
+        # Fully folded: skip eval, by far the most expensive part of compiling
+        value = code[0][1]
+        return lambda *args: value
+    replace = replace or {}
+    namespace = {}
+    temporaries = []
+    # Each entry is (source, nesting depth)
+    stack = []
+
+    def push(source, depth):
+        if depth > MAX_INLINE_DEPTH:
+            name = f"t{len(temporaries)}"
+            temporaries.append(f"    {name} = {source}\n")
+            source, depth = name, 0
+        stack.append((source, depth))
+
+    for opcode, argument in code:
+        if opcode == CONST:
+            name = f"c{len(namespace)}"
+            namespace[name] = argument
+            push(name, 0)
+        elif opcode == LOAD:
+            push(f"v[{argument!r}]" if names is None else f"a{names.index(argument)}", 0)
+        elif opcode == NEG:
+            a, depth = stack.pop()
+            push(f"(-{a})", depth + 1)
+        else:
+            b, b_depth = stack.pop()
+            a, a_depth = stack.pop()
+            depth = max(a_depth, b_depth) + 1
+            argument = replace.get(argument, argument)
+            if argument in INFIX:
+                push(f"({a} {INFIX[argument]} {b})", depth)
+            else:
+                name = f"f{len(namespace)}"
+                namespace[name] = argument
+                push(f"{name}({a}, {b})", depth)
+    parameters = "v" if names is None else ", ".join(f"a{index}" for index in range(len(names)))
+    if not temporaries:
+        return eval(f"lambda {parameters}: {stack[0][0]}", namespace)
+    exec(f"def function({parameters}):\n{''.join(temporaries)}    return {stack[0][0]}\n", namespace)
+    return namespace["function"]
+
+
+def _divide(a, b):
+    # IEEE 754 division, as NumPy does it: x/0 is a signed infinity and 0/0
+    # is nan, instead of raising ZeroDivisionError.
+    try:
+        return a / b
+    except ZeroDivisionError:
+        if a == 0 or a != a:
+            return math.nan
+        return math.copysign(math.inf, a) * math.copysign(1.0, b)
+
+
+def _is_scalar(value):
+    return isinstance(value, numbers.Number)
+
+
+_numpy = None
+
+
+def _import_numpy():
+    # NumPy is optional and slow to import, so only evaluate_batch loads it
+    global _numpy
+    if _numpy is None:
+        try:
+            import numpy
+        except ImportError:
+            numpy = False
+        _numpy = numpy
+    return _numpy or None
+
+
+class Expression:
+    """An expression compiled to reverse Polish notation.
+
+    code is a tuple of (opcode, argument) instructions; variables is the set
+    of names the expression reads. For evaluation the code is also lowered
+    once to a Python function, so nothing is tokenized, parsed or
+    interpreted per call. Calculator.evaluate only compiles text it sees a
+    second time; one-off expressions are evaluated in a single pass."""
+
+    __slots__ = ("source", "code", "variables", "function", "_row_function", "_array_function")
+
+    def __init__(self, source, code):
+        self.source = source
+        self.code = code
+        self.variables = frozenset(argument for opcode, argument in code if opcode == LOAD)
+        self.function = _lower(code)
+        self._row_function = None
+        self._array_function = None
+
+    def map_rows(self, columns, rows):
+        """Iterate over the results for rows rows of columns, a mapping of
+        sequences or scalars, dividing by zero as IEEE 754 does."""
+        names = sorted(self.variables)
+        if self._row_function is None:
+            self._row_function = _lower(self.code, names, {operator.truediv: _divide})
+        if not names:
+            return repeat(self._row_function(), rows)
+        return map(
+            self._row_function,
+            *(repeat(columns[name], rows) if _is_scalar(columns[name]) else columns[name] for name in names),
+        )
+
+    def map_arrays(self, columns, numpy):
+        """Evaluate once over columns, a mapping of NumPy arrays or scalars.
+        Division goes through numpy.divide, so it follows IEEE 754 even
+        when both operands are Python scalars or constants."""
+        if self._array_function is None:
+            self._array_function = _lower(self.code, replace={operator.truediv: numpy.divide})
+        return self._array_function(columns)
+
+    def evaluate(self, variables=None):
+        try:
+            return self.function(variables)
+        except (KeyError, TypeError) as e:
+            missing = sorted(self.variables - set(variables or ()))
+            if missing:
+                raise ValueError(f"unbound variable: {missing[0]}") from e
+            raise
+
+
 class Calculator:
-    def __init__(self):
+    def __init__(self, cache_size=1024):
         self.operators = {
-            "+": lambda a, b: a + b,
-            "-": lambda a, b: a - b,
-            "*": lambda a, b: a * b,
-            "/": lambda a, b: a / b,
+            "+": operator.add,
+            "-": operator.sub,
+            "*": operator.mul,
+            "/": operator.truediv,
         }
         self.precedence = {
             "+": 1,
             "-": 1,
             "*": 2,
             "/": 2,
+            UNARY_MINUS: 3,
         }
+        # expression text -> Expression, least recently used first
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        # Text evaluated once but not compiled, oldest first
+        self._seen = {}
 
-    def evaluate(self, expression):
+    def evaluate(self, expression, variables=None):
         if not expression or expression.isspace():
             return None
-        tokens = expression.strip().split()
-        return self._evaluate_infix(tokens)
+        if expression not in self._cache and expression not in self._seen:
+            # Compiling costs several evaluations and only pays off for text
+            # that comes back, such as a formula applied to many inputs
+            self._seen[expression] = None
+            if len(self._seen) > self.cache_size:
+                del self._seen[next(iter(self._seen))]
+            try:
+                return self._evaluate_once(expression, variables)
+            except (ValueError, LookupError, TypeError, ArithmeticError):
+                # Malformed input, unbound variables and arithmetic errors
+                # are reported by the compiled path, in its order
+                pass
+        self._seen.pop(expression, None)
+        return self.compile(expression).evaluate(variables)
 
-    def _evaluate_infix(self, tokens):
+    def _evaluate_once(self, expression, variables):
+        # Shunting-yard that applies each operator as it is popped. It only
+        # has to get well-formed input right: anything else raises, and
+        # evaluate falls back to compiling.
+        functions = self.operators
+        precedence = self.precedence
         values = []
         operators = []
 
-        for token in tokens:
-            if token in self.operators:
-                while (
-                    operators
-                    and operators[-1] in self.operators
-                    and self.precedence[operators[-1]] >= self.precedence[token]
-                ):
-                    self._apply_operator(operators, values)
+        def apply(operator_):
+            if operator_ == UNARY_MINUS:
+                values[-1] = -values[-1]
+            else:
+                b = values.pop()
+                values[-1] = functions[operator_](values[-1], b)
+
+        expect_operand = True
+        for token in self._quick_tokens(expression):
+            if expect_operand:
+                if type(token) is float:
+                    values.append(token)
+                    expect_operand = False
+                elif token[0] in NAME_START:
+                    values.append(variables[token])
+                    expect_operand = False
+                elif token == "(":
+                    operators.append(token)
+                elif token == "-":
+                    operators.append(UNARY_MINUS)
+                else:
+                    raise ValueError(token)
+            elif token == ")":
+                while operators[-1] != "(":
+                    apply(operators.pop())
+                operators.pop()
+            elif token in functions:
+                rank = precedence[token]
+                while operators and operators[-1] != "(" and precedence[operators[-1]] >= rank:
+                    apply(operators.pop())
                 operators.append(token)
+                expect_operand = True
             else:
+                raise ValueError(token)
+        if expect_operand or "(" in operators:
+            raise ValueError(expression)
+        while operators:
+            apply(operators.pop())
+        return values[0]
+
+    def _quick_tokens(self, expression):
+        # Numbers as floats and everything else as strings. Splitting on
+        # whitespace is much cheaper than the tokenizer and is enough for
+        # spaced-out input; any other piece sends the whole text through
+        # RAW_TOKEN.
+        tokens = []
+        for token in expression.split():
+            if token[0] in NUMBER_START:
+                if "_" in token or not token.isascii():
+                    break
                 try:
-                    values.append(float(token))
+                    tokens.append(float(token))
                 except ValueError:
-                    raise ValueError(f"invalid token: {token}")
+                    break
+            elif len(token) == 1 or (token.isascii() and token.isidentifier()):
+                tokens.append(token)
+            else:
+                break
+        else:
+            return tokens
+        return [float(token) if token[0] in NUMBER_START else token for token in RAW_TOKEN.findall(expression)]
 
-        while operators:
-            self._apply_operator(operators, values)
+    def evaluate_batch(self, expression, out=None, chunk_size=None, **columns):
+        """Evaluate expression once per row of the columns bound to its
+        variables.
+
+        Columns are NumPy arrays (memory-mapped ones included), array.array
+        or memoryview buffers, or any sequence of numbers; scalars are
+        broadcast to every row. With NumPy installed the expression runs as
+        vectorized array operations and a NumPy array is returned; without
+        it the rows go through a compiled function and an array('d') comes
+        back. Division by zero never raises: each affected row gets inf,
+        -inf or nan.
+
+        With chunk_size, rows are evaluated chunk_size at a time, so the
+        temporaries stay bounded however long the columns are. out, a
+        writable float64 buffer with one slot per row (a NumPy memmap, an
+        array('d') or a memoryview), receives the results and is returned."""
+        compiled = self.compile(expression)
+        missing = sorted(compiled.variables - set(columns))
+        if missing:
+            raise ValueError(f"unbound variable: {missing[0]}")
+        lengths = {len(column) for column in columns.values() if not _is_scalar(column)}
+        if len(lengths) != 1:
+            raise ValueError("columns must be scalars or sequences of one common length")
+        rows = lengths.pop()
+
+        numpy = _import_numpy()
+        if numpy is not None:
+            if out is None:
+                out = numpy.empty(rows)
+            target = numpy.asarray(out)
+        else:
+            if out is None:
+                out = array("d", bytes(8 * rows))
+            target = out
+        if len(target) != rows:
+            raise ValueError(f"out has {len(target)} slots for {rows} rows")
+
+        step = chunk_size or rows or 1
+        for start in range(0, rows, step):
+            stop = min(start + step, rows)
+            chunk = {
+                name: column if _is_scalar(column) else column[start:stop]
+                for name, column in columns.items()
+            }
+            if numpy is not None:
+                # Converted a chunk at a time, so other dtypes cost no
+                # full-length float64 copy
+                chunk = {
+                    name: column if _is_scalar(column) else numpy.asarray(column, dtype=numpy.float64)
+                    for name, column in chunk.items()
+                }
+                with numpy.errstate(divide="ignore", invalid="ignore"):
+                    target[start:stop] = compiled.map_arrays(chunk, numpy)
+            else:
+                target[start:stop] = array("d", compiled.map_rows(chunk, stop - start))
+        return out
+
+    def compile(self, expression):
+        """Return the compiled form of expression, from the LRU cache when
+        the same text was compiled before."""
+        compiled = self._cache.get(expression)
+        if compiled is not None:
+            self._cache.move_to_end(expression)
+            return compiled
+        compiled = Expression(expression, tuple(self._to_rpn(self._tokenize(expression))))
+        self._cache[expression] = compiled
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return compiled
 
-        if len(values) != 1:
+    def _tokenize(self, expression):
+        # Every non-space character is part of some token (unknown ones as
+        # symbols), so findall never silently skips input.
+        tokens = [
+            ("number", float(number)) if number else ("name", name) if name else ("symbol", symbol)
+            for number, name, symbol in TOKEN.findall(expression)
+        ]
+        if not tokens:
             raise ValueError("invalid expression")
+        return tokens
 
-        return values[0]
+    def _to_rpn(self, tokens):
+        # Shunting-yard. expect_operand tells a unary minus from a binary one
+        # and catches operators with a missing operand.
+        output = []
+        operators = []
+        expect_operand = True
 
-    def _apply_operator(self, operators, values):
-        if not operators:
-            return
+        for kind, value in tokens:
+            if kind != "symbol":
+                if not expect_operand:
+                    raise ValueError("invalid expression")
+                output.append((CONST, value) if kind == "number" else (LOAD, value))
+                expect_operand = False
+            elif value == "(":
+                if not expect_operand:
+                    raise ValueError("invalid expression")
+                operators.append(value)
+            elif value == ")":
+                if expect_operand:
+                    self._missing_operand(operators)
+                while operators and operators[-1] != "(":
+                    self._emit(operators.pop(), output)
+                if not operators:
+                    raise ValueError("mismatched parentheses")
+                operators.pop()
+            elif value in self.operators:
+                if expect_operand:
+                    if value == "-":
+                        operators.append(UNARY_MINUS)
+                        continue
+                    raise ValueError(f"not enough operands for operator {value}")
+                while (
+                    operators
+                    and operators[-1] != "("
+                    and self.precedence[operators[-1]] >= self.precedence[value]
+                ):
+                    self._emit(operators.pop(), output)
+                operators.append(value)
+                expect_operand = True
+            else:
+                raise ValueError(f"invalid token: {value}")
+
+        if expect_operand:
+            self._missing_operand(operators)
+        while operators:
+            operator_ = operators.pop()
+            if operator_ == "(":
+                raise ValueError("mismatched parentheses")
+            self._emit(operator_, output)
+        return output
 
-        operator = operators.pop()
-        if len(values) < 2:
-            raise ValueError(f"not enough operands for operator {operator}")
+    def _missing_operand(self, operators):
+        if operators and operators[-1] in self.operators:
+            raise ValueError(f"not enough operands for operator {operators[-1]}")
+        raise ValueError("invalid expression")
 
-        b = values.pop()
-        a = values.pop()
-        values.append(self.operators[operator](a, b))
+    def _emit(self, operator_, output):
+        # Appends operator_ to the RPN output, folding it into a constant
+        # when its operands are constants. A fold that would raise (division
+        # by zero) is left for evaluation, so the error surfaces there.
+        if operator_ == UNARY_MINUS:
+            if output and output[-1][0] == CONST:
+                output[-1] = (CONST, -output[-1][1])
+            else:
+                output.append((NEG, None))
+            return
+        function = self.operators[operator_]
+        if len(output) >= 2 and output[-1][0] == CONST and output[-2][0] == CONST:
+            try:
+                folded = function(output[-2][1], output[-1][1])
+            except ArithmeticError:
+                pass
+            else:
+                output[-2:] = [(CONST, folded)]
+                return
+        output.append((BINARY, function))
@@ -1,16 +1,34 @@
 # render.py
 
 import json
+from typing import Iterable, Iterator, Optional
 
+_compact = json.JSONEncoder(separators=(",", ":"))
 
-def format_json_output(expression: str, result: float, indent: int = 2) -> str:
+
+def _json_number(result: float):
     if isinstance(result, float) and result.is_integer():
-        result_to_dump = int(result)
-    else:
-        result_to_dump = result
+        return int(result)
+    return result
+
 
+def format_json_output(expression: str, result: float, indent: int = 2) -> str:
     output_data = {
         "expression": expression,
-        "result": result_to_dump,
+        "result": _json_number(result),
     }
     return json.dumps(output_data, indent=indent)
+
+
+def format_json_lines(
+    results: Iterable[tuple[str, Optional[float], Optional[str]]],
+) -> Iterator[str]:
+    """Render (expression, result, error) triples as compact NDJSON lines,
+    each ending in a newline. A triple with an error gets an "error" field
+    instead of "result"."""
+    encode = _compact.encode
+    for expression, result, error in results:
+        if error is None:
+            yield encode({"expression": expression, "result": _json_number(result)}) + "\n"
+        else:
+            yield encode({"expression": expression, "error": error}) + "\n"
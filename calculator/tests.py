@@ -1,7 +1,11 @@
 # tests.py
 
+import math
+import tracemalloc
 import unittest
-from pkg.calculator import Calculator
+from array import array
+from pkg.calculator import Calculator, _import_numpy
+from pkg.render import format_json_lines
 
 
 class TestCalculator(unittest.TestCase):
@@ -44,6 +48,157 @@ class TestCalculator(unittest.TestCase):
         with self.assertRaises(ValueError):
             self.calculator.evaluate("+ 3")
 
+    def test_parentheses(self):
+        result = self.calculator.evaluate("(2 + 3) * 4")
+        self.assertEqual(result, 20)
+
+    def test_unary_minus(self):
+        self.assertEqual(self.calculator.evaluate("-3 + 5"), 2)
+        self.assertEqual(self.calculator.evaluate("2 * -(1 + 2)"), -6)
+        self.assertEqual(self.calculator.evaluate("4 - -1"), 5)
+
+    def test_no_spaces(self):
+        result = self.calculator.evaluate("3+5*2")
+        self.assertEqual(result, 13)
+
+    def test_mismatched_parentheses(self):
+        for expression in ["(3 + 5", "3 + 5)", "()"]:
+            with self.assertRaises(ValueError):
+                self.calculator.evaluate(expression)
+
+    def test_division_by_zero(self):
+        with self.assertRaises(ZeroDivisionError):
+            self.calculator.evaluate("1 / (2 - 2)")
+
+    def test_variables(self):
+        result = self.calculator.evaluate("price * (1 + rate)", {"price": 100, "rate": 0.5})
+        self.assertEqual(result, 150)
+
+    def test_unbound_variable(self):
+        with self.assertRaises(ValueError):
+            self.calculator.evaluate("x + y", {"x": 1})
+
+    def test_constant_folding(self):
+        compiled = self.calculator.compile("2 * 3 + x")
+        self.assertEqual(compiled.evaluate({"x": 1}), 7)
+        self.assertEqual(len(compiled.code), 3)
+        self.assertEqual(compiled.variables, {"x"})
+
+    def test_long_chain(self):
+        self.assertEqual(self.calculator.evaluate("+".join(["x"] * 250), {"x": 2}), 500)
+        self.assertEqual(self.calculator.evaluate("(" * 150 + "x" + ")" * 150 + " * 2", {"x": 3}), 6)
+        chain = "1/0" + " + 1" * 250
+        with self.assertRaises(ZeroDivisionError):
+            self.calculator.evaluate(chain)
+        self.assertEqual(list(self.calculator.evaluate_batch(chain, y=[1, 2])), [math.inf, math.inf])
+
+    def test_first_evaluation_matches_compiled(self):
+        cases = [
+            ("3 + 5 * 2", None),
+            ("-(2 + 3) * -x", {"x": 4}),
+            ("2*(3+x)/y", {"x": 1, "y": 8}),
+            ("1 / 0 + x", None),
+            ("x + 1 / 0", None),
+            ("x + y", {"x": 1}),
+            ("2 3", None),
+            ("(1 + 2", None),
+            ("1 + 2)", None),
+            ("1 ^ 2", None),
+            ("1_0 + 1", None),
+            ("é + 1", {"é": 1}),
+        ]
+        for expression, variables in cases:
+            outcomes = []
+            for evaluate in (Calculator().evaluate, lambda *args: Calculator().compile(args[0]).evaluate(args[1])):
+                try:
+                    outcomes.append(evaluate(expression, variables))
+                except Exception as e:
+                    outcomes.append((type(e), str(e)))
+            self.assertEqual(outcomes[0], outcomes[1], expression)
+
+    def test_evaluate_compiles_repeated_text_only(self):
+        self.assertEqual(self.calculator.evaluate("x * 2", {"x": 3}), 6)
+        self.assertNotIn("x * 2", self.calculator._cache)
+        self.assertEqual(self.calculator.evaluate("x * 2", {"x": 4}), 8)
+        self.assertIn("x * 2", self.calculator._cache)
+
+    def test_compile_cache(self):
+        calculator = Calculator(cache_size=2)
+        first = calculator.compile("a + 1")
+        self.assertIs(calculator.compile("a + 1"), first)
+        calculator.compile("a + 2")
+        calculator.compile("a + 1")
+        calculator.compile("a + 3")
+        self.assertIs(calculator.compile("a + 1"), first)
+        self.assertNotIn("a + 2", calculator._cache)
+
+    def test_evaluate_batch(self):
+        result = self.calculator.evaluate_batch("x * 2 + y", x=[1, 2, 3], y=array("d", [1, 1, 1]))
+        self.assertEqual(list(result), [3, 5, 7])
+
+    def test_evaluate_batch_scalar_column(self):
+        result = self.calculator.evaluate_batch("x * k", x=memoryview(array("d", [1, 2])), k=10)
+        self.assertEqual(list(result), [10, 20])
+
+    def test_evaluate_batch_division_by_zero(self):
+        result = list(self.calculator.evaluate_batch("x / y", x=[1, -1, 0, 4], y=[0, 0, 0, 2]))
+        self.assertEqual(result[0], math.inf)
+        self.assertEqual(result[1], -math.inf)
+        self.assertTrue(math.isnan(result[2]))
+        self.assertEqual(result[3], 2)
+
+    @unittest.skipUnless(_import_numpy(), "NumPy is not installed")
+    def test_evaluate_batch_numpy_scalar_division_by_zero(self):
+        for expression, columns in (("y + 1/x", {"x": 0, "y": [1.0, 2.0]}), ("y * (1/0)", {"y": [1.0, 2.0]})):
+            result = self.calculator.evaluate_batch(expression, **columns)
+            self.assertEqual(type(result).__module__, "numpy")
+            self.assertEqual(list(result), [math.inf, math.inf])
+
+    def test_evaluate_batch_int_column(self):
+        x = array("i", range(10))
+        result = self.calculator.evaluate_batch("x / 2", chunk_size=3, x=x)
+        self.assertEqual(list(result), [value / 2 for value in range(10)])
+
+    @unittest.skipUnless(_import_numpy(), "NumPy is not installed")
+    def test_evaluate_batch_numpy_int_column_is_converted_per_chunk(self):
+        numpy = _import_numpy()
+        x = numpy.arange(1_000_000, dtype=numpy.int32)
+        out = numpy.empty(len(x))
+        tracemalloc.start()
+        try:
+            self.calculator.evaluate_batch("x * 2", out=out, chunk_size=1000, x=x)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        self.assertEqual(out[-1], 1_999_998)
+        self.assertLess(peak, 1_000_000)
+
+    def test_evaluate_batch_chunked(self):
+        x = array("d", range(10))
+        out = array("d", bytes(8 * len(x)))
+        result = self.calculator.evaluate_batch("x - 1", out=out, chunk_size=3, x=x)
+        self.assertIs(result, out)
+        self.assertEqual(list(out), [value - 1 for value in range(10)])
+
+    def test_evaluate_batch_errors(self):
+        with self.assertRaises(ValueError):
+            self.calculator.evaluate_batch("x + y", x=[1, 2])
+        with self.assertRaises(ValueError):
+            self.calculator.evaluate_batch("x + y", x=[1, 2], y=[1])
+
+
+class TestRender(unittest.TestCase):
+    def test_format_json_lines(self):
+        lines = list(format_json_lines([("3 + 5", 8.0, None), ("7 / 2", 3.5, None), ("(2", None, "mismatched parentheses")]))
+        self.assertEqual(
+            lines,
+            [
+                '{"expression":"3 + 5","result":8}\n',
+                '{"expression":"7 / 2","result":3.5}\n',
+                '{"expression":"(2","error":"mismatched parentheses"}\n',
+            ],
+        )
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,167 @@
+import json
+import os
+from functions.cache import file_cache, UNCHANGED_SUFFIX
+from functions.config import WORKING_DIRECTORY
+
+# Rough conversion used for budgeting; Gemini averages about four characters
+# per token for English text and code.
+CHARS_PER_TOKEN = 4
+PART_OVERHEAD_TOKENS = 4
+
+# Tools whose results go stale once a later call writes the same file_path
+READ_TOOLS = {"get_file_content"}
+WRITE_TOOLS = {"write_file", "edit_file"}
+# Tools whose results go stale once the same call is repeated
+REPEATABLE_TOOLS = {"get_files_info", "get_file_content", "run_python_file", "run_tests"}
+# Tools that answer repeated calls with a short "unchanged" reply, keyed by
+# the argument naming the path they cached
+CACHED_TOOLS = {"get_file_content": ("file_path", ""), "get_files_info": ("directory", ".")}
+
+
+def estimate_part_tokens(part):
+    if part.text is not None:
+        size = len(part.text)
+    elif part.function_call is not None:
+        size = len(part.function_call.name or "") + len(
+            json.dumps(part.function_call.args or {}, default=str)
+        )
+    elif part.function_response is not None:
+        size = len(part.function_response.name or "") + len(
+            json.dumps(part.function_response.response or {}, default=str)
+        )
+    else:
+        size = len(part.model_dump_json(exclude_none=True))
+    return size // CHARS_PER_TOKEN + PART_OVERHEAD_TOKENS
+
+
+def estimate_tokens(content):
+    """Estimate how many prompt tokens a types.Content costs."""
+    return sum(estimate_part_tokens(part) for part in content.parts or [])
+
+
+def _call_key(function_call):
+    return (function_call.name, json.dumps(function_call.args or {}, sort_keys=True, default=str))
+
+
+def _pair_tool_responses(messages):
+    # Returns [(message_index, part_index, function_call)] for every function
+    # response, matched to the call it answers.
+    pending = []
+    pairs = []
+    for message_index, content in enumerate(messages):
+        for part_index, part in enumerate(content.parts or []):
+            if part.function_call is not None:
+                pending.append(part.function_call)
+            elif part.function_response is not None:
+                name = part.function_response.name
+                for position, call in enumerate(pending):
+                    if call.name == name:
+                        pairs.append((message_index, part_index, pending.pop(position)))
+                        break
+    return pairs
+
+
+def _replace_responses(content, message_index, replacements):
+    from google.genai import types
+
+    parts = list(content.parts)
+    for part_index, part in enumerate(parts):
+        replacement = replacements.get((message_index, part_index))
+        if replacement is None:
+            continue
+        key = "error" if "error" in (part.function_response.response or {}) else "result"
+        parts[part_index] = types.Part.from_function_response(
+            name=part.function_response.name,
+            response={key: replacement},
+        )
+    return types.Content(role=content.role, parts=parts)
+
+
+class ContextManager:
+    """Builds a token-budgeted view of the conversation for each model call.
+
+    The full messages list is left untouched. In the view, tool responses
+    that a later call made stale (a file read followed by a write to the same
+    path, or a call that was simply repeated) are elided, and if the estimate
+    is still above token_budget the oldest remaining tool responses are cut
+    down to a short head. The last keep_recent messages are always sent
+    verbatim.
+
+    Whenever a cached tool's result is dropped from the view, the tool cache
+    entry is invalidated too, so a re-read returns the full content instead
+    of an "unchanged" reply pointing at text the model can no longer see."""
+
+    def __init__(self, token_budget=None, keep_recent=6, shortened_chars=200, working_directory=WORKING_DIRECTORY):
+        self.token_budget = token_budget
+        self.keep_recent = keep_recent
+        self.shortened_chars = shortened_chars
+        self.working_directory = working_directory
+        self.history = []
+
+    def compact(self, messages):
+        """Return (view, tokens_saved) for messages."""
+        replacements = {}
+        protected_from = max(0, len(messages) - self.keep_recent)
+        all_pairs = _pair_tool_responses(messages)
+        pairs = [pair for pair in all_pairs if pair[0] < protected_from]
+
+        for message_index, part_index, call in pairs:
+            reason = self._superseded_by(call, message_index, all_pairs, messages)
+            if reason:
+                replacements[(message_index, part_index)] = f"[Elided: {reason}]"
+
+        original = sum(estimate_tokens(content) for content in messages)
+        view = list(messages)
+        for message_index in {message_index for message_index, _ in replacements}:
+            view[message_index] = _replace_responses(messages[message_index], message_index, replacements)
+        total = sum(estimate_tokens(content) for content in view)
+
+        if self.token_budget is not None and total > self.token_budget:
+            # Oldest first: cut tool responses down until the view fits
+            for message_index, part_index, call in pairs:
+                if total <= self.token_budget:
+                    break
+                if (message_index, part_index) in replacements:
+                    continue
+                part = messages[message_index].parts[part_index]
+                text = json.dumps(part.function_response.response or {}, default=str)
+                if len(text) <= self.shortened_chars:
+                    continue
+                replacements[(message_index, part_index)] = (
+                    text[: self.shortened_chars]
+                    + f"[... {len(text) - self.shortened_chars} characters elided to fit the context budget]"
+                )
+                self._forget_cached(call)
+                total -= estimate_tokens(view[message_index])
+                view[message_index] = _replace_responses(messages[message_index], message_index, replacements)
+                total += estimate_tokens(view[message_index])
+
+        saved = original - total
+        self.history.append(saved)
+        return view, saved
+
+    def _forget_cached(self, call):
+        if call.name in CACHED_TOOLS:
+            arg, default = CACHED_TOOLS[call.name]
+            path = (call.args or {}).get(arg) or default
+            file_cache.invalidate(os.path.join(self.working_directory, path))
+
+    def _superseded_by(self, call, message_index, all_pairs, messages):
+        path = (call.args or {}).get("file_path")
+        for later_index, later_part_index, later_call in all_pairs:
+            if later_index <= message_index:
+                continue
+            if (
+                call.name in READ_TOOLS
+                and later_call.name in WRITE_TOOLS
+                and path is not None
+                and (later_call.args or {}).get("file_path") == path
+            ):
+                return f"superseded by a later {later_call.name} to {path}"
+            if call.name in REPEATABLE_TOOLS and _call_key(later_call) == _call_key(call):
+                later_response = messages[later_index].parts[later_part_index].function_response
+                if UNCHANGED_SUFFIX in str(later_response.response):
+                    # The later call only points back at this result
+                    continue
+                return f"superseded by a later identical {call.name} call"
+        return None
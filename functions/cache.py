@@ -0,0 +1,70 @@
+import os
+import threading
+from collections import OrderedDict
+from functions.config import FILE_CACHE_ENTRIES
+
+UNCHANGED_SUFFIX = "is unchanged since your previous read; its content was not re-sent."
+
+
+def stat_signature(path):
+    st = os.stat(path)
+    return (st.st_mtime_ns, st.st_size)
+
+
+class FileCache:
+    """Session-scoped LRU cache of tool results.
+
+    Keys are (kind, resolved path, args); each value is stored with the
+    (mtime_ns, size) signature of the path it was produced from, so callers
+    can tell whether it is still current."""
+
+    def __init__(self, max_entries=FILE_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def lookup(self, kind, path, args=()):
+        """Return (signature, value) for the key, or None."""
+        key = (kind, path, args)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def store(self, kind, path, signature, value, args=()):
+        key = (kind, path, args)
+        with self._lock:
+            self._entries[key] = (signature, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, path):
+        """Forget a path that was written, plus listings of its ancestors."""
+        path = os.path.abspath(path)
+        ancestors = set()
+        parent = os.path.dirname(path)
+        while parent not in ancestors:
+            ancestors.add(parent)
+            parent = os.path.dirname(parent)
+        with self._lock:
+            for key in list(self._entries):
+                if key[1] == path or key[1] in ancestors:
+                    del self._entries[key]
+
+    def invalidate_tree(self, root):
+        """Forget everything under root, e.g. after running a script there."""
+        root = os.path.abspath(root)
+        prefix = root.rstrip(os.sep) + os.sep
+        with self._lock:
+            for key in list(self._entries):
+                if key[1] == root or key[1].startswith(prefix):
+                    del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+file_cache = FileCache()
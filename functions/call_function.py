@@ -0,0 +1,189 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+# Importing a tool module registers its tools
+import functions.get_files_info
+import functions.get_file_content
+import functions.run_python_file
+import functions.write_file
+import functions.search_code
+import functions.edit_file
+import functions.get_changes_since
+import functions.run_tests
+from functions.config import WORKING_DIRECTORY, MAX_WORKERS
+from functions.registry import TOOLS, available_functions
+
+# Fixed dispatch table, built once when the tools are registered
+function_map = {name: tool.function for name, tool in TOOLS.items()}
+
+
+def call_function(function_call_part, verbose=False, working_directory=WORKING_DIRECTORY, quiet=False, tracer=None):
+    if tracer is None:
+        return _call_function(function_call_part, verbose, working_directory, quiet)
+    with tracer.span("tool", function_call_part.name) as span:
+        content = _call_function(function_call_part, verbose, working_directory, quiet)
+        response = content.parts[0].function_response.response
+        span["result_chars"] = len(str(response.get("result", response.get("error", ""))))
+        span["error"] = "error" in response or str(response.get("result", "")).startswith("Error")
+        return content
+
+
+def _call_function(function_call_part, verbose, working_directory, quiet):
+    # The SDK is already loaded by the model call that produced this part
+    from google.genai import types
+
+    function_name = function_call_part.name
+    function_args = dict(function_call_part.args)
+
+    # Print function call info
+    if verbose:
+        print(f"Calling function: {function_name}({function_args})")
+    elif not quiet:
+        print(f" - Calling function: {function_name}")
+
+    # Check if function name is valid
+    if function_name not in function_map:
+        return types.Content(
+            role="tool",
+            parts=[
+                types.Part.from_function_response(
+                    name=function_name,
+                    response={"error": f"Unknown function: {function_name}"},
+                )
+            ],
+        )
+
+    # Add working_directory to the arguments
+    function_args["working_directory"] = working_directory
+
+    # Call the function
+    try:
+        function_result = function_map[function_name](**function_args)
+        return types.Content(
+            role="tool",
+            parts=[
+                types.Part.from_function_response(
+                    name=function_name,
+                    response={"result": function_result},
+                )
+            ],
+        )
+    except Exception as e:
+        return types.Content(
+            role="tool",
+            parts=[
+                types.Part.from_function_response(
+                    name=function_name,
+                    response={"error": f"Error executing function: {str(e)}"},
+                )
+            ],
+        )
+
+
+def serial_key(function_call_part):
+    # Calls sharing a key are chained and run in call order; None means the
+    # call may run alongside anything else. The key is the path alone, so
+    # every tool writing one file (write_file, edit_file) shares a chain.
+    tool = TOOLS.get(function_call_part.name)
+    if tool is None or tool.parallel_safe:
+        return None
+    file_path = (function_call_part.args or {}).get("file_path", "")
+    return os.path.normpath(str(file_path))
+
+
+def call_functions(function_call_parts, verbose=False, max_workers=MAX_WORKERS, working_directory=WORKING_DIRECTORY, quiet=False, tracer=None):
+    """Run every function call from one model turn, returning the tool
+    responses in the same order as the calls."""
+    if max_workers <= 1 or len(function_call_parts) <= 1:
+        return [
+            call_function(part, verbose, working_directory, quiet, tracer)
+            for part in function_call_parts
+        ]
+
+    chains = {}
+    tasks = []
+    for index, part in enumerate(function_call_parts):
+        key = serial_key(part)
+        if key is None:
+            tasks.append([index])
+        elif key in chains:
+            chains[key].append(index)
+        else:
+            chains[key] = [index]
+            tasks.append(chains[key])
+
+    results = [None] * len(function_call_parts)
+
+    def run_chain(indices):
+        for index in indices:
+            results[index] = call_function(
+                function_call_parts[index], verbose, working_directory, quiet, tracer
+            )
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(tasks))) as executor:
+        for future in [executor.submit(run_chain, task) for task in tasks]:
+            future.result()
+    return results
+
+
+class AsyncCallScheduler:
+    """Starts function calls as soon as they arrive from a streamed turn.
+
+    Calls run in worker threads, at most max_workers at a time; calls sharing
+    a serial key wait for the previous one. results() returns the tool
+    responses in submission order; cancel() abandons the calls that have not
+    started and waits for those already running in a thread. asyncio is imported in each method rather
+    than at the top, keeping it off the startup path of the synchronous loop."""
+
+    def __init__(self, verbose=False, max_workers=MAX_WORKERS, working_directory=WORKING_DIRECTORY, quiet=False, tracer=None):
+        import asyncio
+
+        self.verbose = verbose
+        self.working_directory = working_directory
+        self.quiet = quiet
+        self.tracer = tracer
+        self.semaphore = asyncio.Semaphore(max(1, max_workers))
+        self.chains = {}
+        self.tasks = []
+        self.running = []
+
+    def submit(self, function_call_part):
+        import asyncio
+
+        key = serial_key(function_call_part)
+        previous = self.chains.get(key) if key is not None else None
+        task = asyncio.create_task(self._run(function_call_part, previous))
+        if key is not None:
+            self.chains[key] = task
+        self.tasks.append(task)
+        return task
+
+    async def _run(self, function_call_part, previous):
+        import asyncio
+
+        if previous is not None:
+            await asyncio.gather(previous, return_exceptions=True)
+        async with self.semaphore:
+            # A worker thread cannot be interrupted; shielding keeps its future
+            # around so cancel() can wait for it to finish
+            work = asyncio.ensure_future(asyncio.to_thread(
+                call_function,
+                function_call_part,
+                self.verbose,
+                self.working_directory,
+                self.quiet,
+                self.tracer,
+            ))
+            self.running.append(work)
+            return await asyncio.shield(work)
+
+    async def results(self):
+        import asyncio
+
+        return list(await asyncio.gather(*self.tasks))
+
+    async def cancel(self):
+        import asyncio
+
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, *self.running, return_exceptions=True)
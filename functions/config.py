@@ -1 +1,31 @@
 MAX_CHARS = 10000
+WORKING_DIRECTORY = "./calculator"
+MAX_WORKERS = 4
+FILE_CACHE_ENTRIES = 256
+PAGE_LINES = 200
+LINE_INDEX_STRIDE = 1000
+LIST_PAGE_SIZE = 1000
+SEARCH_MAX_RESULTS = 50
+SEARCH_MAX_FILE_BYTES = 1_000_000
+# Build artifacts that say nothing about the workspace's content
+MANIFEST_EXCLUDE = ("__pycache__", "*.pyc")
+RUN_TIMEOUT = 30
+TEST_WORKERS = 4
+TEST_FILE_PATTERNS = ("test*.py", "*_test.py")
+WARM_WORKERS = 0
+WARM_MODULES = (
+    "argparse",
+    "collections",
+    "dataclasses",
+    "functools",
+    "itertools",
+    "json",
+    "math",
+    "pathlib",
+    "re",
+    "traceback",
+    "typing",
+    "unittest",
+)
+MAX_OUTPUT_BYTES = 10000
+KILL_ON_OUTPUT_OVERFLOW = False
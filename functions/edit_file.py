@@ -0,0 +1,166 @@
+import os
+import re
+from functions.write_file import atomic_write
+from functions.registry import tool
+
+HUNK_HEADER = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+
+
+class EditError(Exception):
+    pass
+
+
+def _apply_search_replace(content, edits):
+    for number, edit in enumerate(edits, 1):
+        search = edit.get("search")
+        replace = edit.get("replace", "")
+        if not search:
+            raise EditError(f"edit {number} has an empty search text")
+        count = content.count(search)
+        if count == 0:
+            raise EditError(f"search text of edit {number} was not found")
+        if count > 1 and not edit.get("replace_all"):
+            raise EditError(
+                f"search text of edit {number} matches {count} times; include more surrounding lines or set replace_all"
+            )
+        content = content.replace(search, replace)
+    return content
+
+
+def _parse_hunks(diff):
+    # Returns [(old_start, old_lines, new_lines)], where the line lists keep
+    # their line endings.
+    hunks = []
+    current = None
+    # Tag of the previous diff line, which a "\ No newline" marker refers to
+    previous = None
+    for line in diff.splitlines(keepends=True):
+        if line.startswith(("--- ", "+++ ", "diff ", "index ")) and current is None:
+            continue
+        match = HUNK_HEADER.match(line)
+        if match:
+            current = (int(match.group(1)), [], [])
+            hunks.append(current)
+            previous = None
+            continue
+        if current is None:
+            continue
+        if line.startswith("\\"):
+            # "\ No newline at end of file" applies to the previous line only,
+            # on the side (or sides, for context) that line belongs to
+            sides = {" ": (current[1], current[2]), "-": (current[1],), "+": (current[2],)}
+            for lines in sides.get(previous, ()):
+                if lines and lines[-1].endswith("\n"):
+                    lines[-1] = lines[-1][:-1]
+            continue
+        if not line.endswith("\n"):
+            # The diff's own last line; only a marker removes the newline
+            line += "\n"
+        tag, text = line[:1], line[1:]
+        if text == "" and tag not in (" ", "-", "+"):
+            # Blank context line whose leading space was stripped
+            tag, text = " ", "\n"
+        if tag == " ":
+            current[1].append(text)
+            current[2].append(text)
+        elif tag == "-":
+            current[1].append(text)
+        elif tag == "+":
+            current[2].append(text)
+        else:
+            raise EditError(f"unexpected line in diff: {line.rstrip()!r}")
+        previous = tag
+    if not hunks:
+        raise EditError("diff contains no hunks")
+    return hunks
+
+
+def _apply_unified_diff(content, diff):
+    lines = content.splitlines(keepends=True)
+    offset = 0
+    for number, (old_start, old_lines, new_lines) in enumerate(_parse_hunks(diff), 1):
+        size = len(old_lines)
+        position = max(old_start - 1, 0) + offset
+        if lines[position : position + size] != old_lines:
+            # The line numbers may be stale; accept a unique exact match elsewhere
+            matches = [
+                start
+                for start in range(len(lines) - size + 1)
+                if lines[start : start + size] == old_lines
+            ]
+            if len(matches) != 1:
+                found = "was not found" if not matches else f"matches {len(matches)} places"
+                raise EditError(f"context of hunk {number} {found} in the file")
+            position = matches[0]
+        lines[position : position + size] = new_lines
+        offset += len(new_lines) - size
+    return "".join(lines)
+
+
+# Calls of any writing tool that target the same file_path run one at a
+# time, in call order.
+@tool(
+    "Edits part of an existing file, constrained to the working directory, without resending the whole file. Give either search/replace edits, each of whose search text must match exactly once, or a unified diff. Nothing is written unless every edit applies.",
+    params={
+        "file_path": "The path to the file to edit, relative to the working directory.",
+        "edits": {
+            "description": "Search/replace edits applied in order.",
+            "items": {
+                "type": "OBJECT",
+                "properties": {
+                    "search": {
+                        "type": "STRING",
+                        "description": "Exact text to find, including whitespace; include enough lines to be unique.",
+                    },
+                    "replace": {"type": "STRING", "description": "Text to put in its place."},
+                    "replace_all": {
+                        "type": "BOOLEAN",
+                        "description": "Replace every occurrence instead of requiring a unique match.",
+                    },
+                },
+                "required": ["search", "replace"],
+            },
+        },
+        "diff": "A unified diff (with @@ hunk headers) to apply to this file.",
+    },
+    parallel_safe=False,
+)
+def edit_file(
+    working_directory,
+    file_path: str,
+    edits: list[dict] | None = None,
+    diff: str | None = None,
+):
+    try:
+        working_directory_abs = os.path.abspath(working_directory)
+        target_path_abs = os.path.abspath(
+            os.path.join(working_directory_abs, file_path)
+        )
+
+        if not target_path_abs.startswith(working_directory_abs.rstrip(os.sep) + os.sep):
+            return f'Error: Cannot edit "{file_path}" as it is outside the permitted working directory'
+        if not os.path.isfile(target_path_abs):
+            return f'Error: "{file_path}" is not a file; use write_file to create it'
+        if (edits is None) == (diff is None):
+            return "Error: provide exactly one of edits or diff"
+
+        with open(target_path_abs, "r", newline="") as f:
+            original = f.read()
+
+        try:
+            if edits is not None:
+                updated = _apply_search_replace(original, [dict(edit) for edit in edits])
+                applied = f"{len(edits)} edit(s)"
+            else:
+                updated = _apply_unified_diff(original, diff)
+                applied = "diff"
+        except EditError as e:
+            return f'Error: could not edit "{file_path}": {e}. The file was not changed.'
+
+        if updated == original:
+            return f'No changes: "{file_path}" already matches the requested edit'
+        atomic_write(target_path_abs, updated, newline="")
+        return f'Successfully edited "{file_path}" ({applied} applied, {len(updated)} characters now)'
+    except Exception as e:
+        return f"Error: {e}"
+
@@ -0,0 +1,138 @@
+import hashlib
+import os
+import threading
+import time
+from functions.config import MAX_CHARS, MANIFEST_EXCLUDE
+from functions.get_files_info import walk_entries
+from functions.registry import tool
+
+# Checkpoint every session starts with, taken before the first model call
+START_CHECKPOINT = "start"
+# Files modified this close to the previous refresh are hashed again: on a
+# filesystem with coarse timestamps a same-size rewrite right after it would
+# otherwise keep the same (size, mtime_ns)
+RACY_NS = 2 * 10**9
+
+
+class WorkspaceManifest:
+    """(size, mtime_ns, sha256) of every file in one working directory,
+    honouring .gitignore and skipping MANIFEST_EXCLUDE.
+
+    refresh() re-stats the tree and only re-hashes files whose
+    (mtime_ns, size) changed, or that were modified around the previous
+    refresh, so keeping the manifest current costs about as much as listing
+    the directory. Checkpoints are named copies of the
+    path -> hash mapping that later states are compared against."""
+
+    def __init__(self, root):
+        self.root = root
+        self.files = {}
+        self.checkpoints = {}
+        self._refreshed_ns = 0
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        with self._lock:
+            racy_after = self._refreshed_ns - RACY_NS
+            self._refreshed_ns = time.time_ns()
+            seen = {}
+            options = (True, None, (), MANIFEST_EXCLUDE, True)
+            for rel_path, entry, is_dir in walk_entries(self.root, "", 0, options, []):
+                if is_dir or isinstance(entry, OSError):
+                    continue
+                try:
+                    st = entry.stat()
+                    known = self.files.get(rel_path)
+                    if (
+                        known is None
+                        or known[:2] != (st.st_size, st.st_mtime_ns)
+                        or st.st_mtime_ns >= racy_after
+                    ):
+                        with open(entry.path, "rb") as f:
+                            digest = hashlib.file_digest(f, "sha256").hexdigest()
+                        known = (st.st_size, st.st_mtime_ns, digest)
+                except OSError:
+                    continue
+                seen[rel_path] = known
+            self.files = seen
+            return seen
+
+    def digest(self):
+        """One hash of the whole tree's paths and contents."""
+        tree = hashlib.sha256()
+        for rel_path, (_, _, digest) in sorted(self.refresh().items()):
+            tree.update(f"{rel_path}\0{digest}\n".encode())
+        return tree.hexdigest()
+
+    def checkpoint(self, name, files=None):
+        files = self.refresh() if files is None else files
+        with self._lock:
+            self.checkpoints[name] = {rel_path: entry[2] for rel_path, entry in files.items()}
+
+    def changes_since(self, name, advance=False):
+        """Return (added, removed, modified, files): path lists relative to
+        the checkpoint name and the current manifest, or None if there is no
+        such checkpoint. With advance, the checkpoint then moves to the state
+        just compared, so nothing that changes in between is missed by the
+        next call."""
+        files = self.refresh()
+        with self._lock:
+            baseline = self.checkpoints.get(name)
+        if baseline is None:
+            return None
+        if advance:
+            self.checkpoint(name, files)
+        added = sorted(set(files) - set(baseline))
+        removed = sorted(set(baseline) - set(files))
+        modified = sorted(
+            rel_path
+            for rel_path in set(files) & set(baseline)
+            if files[rel_path][2] != baseline[rel_path]
+        )
+        return added, removed, modified, files
+
+
+_manifests = {}
+_manifests_lock = threading.Lock()
+
+
+def manifest_for(working_directory):
+    root = os.path.abspath(working_directory)
+    with _manifests_lock:
+        manifest = _manifests.get(root)
+        if manifest is None:
+            manifest = _manifests[root] = WorkspaceManifest(root)
+        return manifest
+
+
+def drop_manifest(working_directory):
+    """Forget the manifest of a working directory that is going away."""
+    with _manifests_lock:
+        _manifests.pop(os.path.abspath(working_directory), None)
+
+
+@tool(
+    "Lists the files added, removed or modified in the working directory since a named checkpoint, instead of listing and re-reading everything. The checkpoint \"start\" is taken when the session begins; naming a new checkpoint creates it.",
+    params={
+        "checkpoint": 'Name of the checkpoint to compare against, e.g. "start" or one created by an earlier call.',
+        "advance": "After reporting, move the checkpoint to the current state, so the next call only shows newer changes. Defaults to true; the \"start\" checkpoint never moves.",
+    },
+)
+def get_changes_since(working_directory, checkpoint: str, advance: bool = True):
+    try:
+        manifest = manifest_for(working_directory)
+        changes = manifest.changes_since(checkpoint, advance and checkpoint != START_CHECKPOINT)
+        if changes is None:
+            manifest.checkpoint(checkpoint)
+            return f'Created checkpoint "{checkpoint}"; call again to see changes since now'
+
+        added, removed, modified, files = changes
+        if not (added or removed or modified):
+            return f'No changes since checkpoint "{checkpoint}"'
+        lines = [f'Changes since checkpoint "{checkpoint}":']
+        lines += [f"added: {path} ({files[path][0]} bytes)" for path in added]
+        lines += [f"modified: {path} ({files[path][0]} bytes)" for path in modified]
+        lines += [f"removed: {path}" for path in removed]
+        return "\n".join(lines)[:MAX_CHARS]
+    except Exception as e:
+        return f"Error: {e}"
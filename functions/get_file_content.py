@@ -1,9 +1,135 @@
-from google.genai import types
+import mmap
+import os
+from array import array
+from functions.config import PAGE_LINES, LINE_INDEX_STRIDE
+from functions.cache import file_cache, stat_signature, UNCHANGED_SUFFIX
+from functions.registry import tool
 
+SKIP_BLOCK = 4096
 
-def get_file_content(working_directory, file_path):
-    import os
 
+def _skip_lines(buffer, position, lines):
+    # Offset just past the lines-th newline after position (or the end of the
+    # buffer). Whole blocks are skipped with a C-level count, so only the
+    # block holding the target newline is walked.
+    end = len(buffer)
+    while lines and position < end:
+        block = buffer[position : position + SKIP_BLOCK]
+        newlines = block.count(b"\n")
+        if newlines < lines:
+            lines -= newlines
+            position += len(block)
+            continue
+        offset = 0
+        for _ in range(lines):
+            offset = block.find(b"\n", offset) + 1
+        return position + offset
+    return min(position, end)
+
+
+def _line_index(target_abs, signature, mm):
+    # Sparse index: byte offset of every LINE_INDEX_STRIDE-th line start, plus
+    # the total line count. Built once per file version, then kept in the
+    # file cache.
+    cached = file_cache.lookup("line_index", target_abs)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+
+    size = len(mm)
+    checkpoints = array("q", [0])
+    while True:
+        position = _skip_lines(mm, checkpoints[-1], LINE_INDEX_STRIDE)
+        if position >= size:
+            break
+        checkpoints.append(position)
+
+    newlines = (len(checkpoints) - 1) * LINE_INDEX_STRIDE
+    for chunk_start in range(checkpoints[-1], size, 1 << 20):
+        newlines += mm[chunk_start : chunk_start + (1 << 20)].count(b"\n")
+    total_lines = newlines + (1 if mm[-1:] != b"\n" else 0)
+
+    index = (checkpoints, total_lines)
+    file_cache.store("line_index", target_abs, signature, index)
+    return index
+
+
+def _line_start(mm, checkpoints, line):
+    # Byte offset where 0-based line starts, seeking from the nearest checkpoint
+    checkpoint = min(line // LINE_INDEX_STRIDE, len(checkpoints) - 1)
+    return _skip_lines(mm, checkpoints[checkpoint], line - checkpoint * LINE_INDEX_STRIDE)
+
+
+def _read_page(target_abs, file_path, signature, offset, limit, unit, max_chars):
+    # Pages longer than max_chars are cut at a line (or UTF-8 character)
+    # boundary, and the header and next offset describe what was returned.
+    size = signature[1]
+    note = ""
+    with open(target_abs, "rb") as f:
+        if size == 0:
+            return f'[File "{file_path}": 0 bytes, 0 lines]\n'
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            checkpoints, total_lines = _line_index(target_abs, signature, mm)
+            if unit == "bytes":
+                limit = max_chars if limit is None else limit
+                start = min(offset, size)
+                end = min(start + limit, size)
+                if end - start > max_chars:
+                    # Each byte decodes to at most one character
+                    end = start + max_chars
+                    while end > start + 1 and mm[end] & 0xC0 == 0x80:
+                        end -= 1
+                    note = f"[Page cut to {end - start} bytes to fit {max_chars} characters]"
+                data = mm[start:end].decode("utf-8", errors="replace")
+                label = f"bytes {start}-{end} of {size}"
+                next_offset, total = end, size
+            else:
+                limit = PAGE_LINES if limit is None else limit
+                first = min(offset, total_lines)
+                last = min(first + limit, total_lines)
+                start = _line_start(mm, checkpoints, first)
+                end = _line_start(mm, checkpoints, last) if last < total_lines else size
+                data = mm[start:end].decode("utf-8", errors="replace")
+                if len(data) > max_chars:
+                    cut = data.rfind("\n", 0, max_chars) + 1
+                    if cut:
+                        last = first + data.count("\n", 0, cut)
+                        data = data[:cut]
+                        note = f"[Page cut to {last - first} lines to fit {max_chars} characters]"
+                    else:
+                        # A single line longer than a page
+                        last = first + 1
+                        data = data[:max_chars] + "\n"
+                        note = f'[Line {first + 1} truncated at {max_chars} characters; read it with unit="bytes"]'
+                label = f"lines {first + 1}-{last} of {total_lines}"
+                next_offset, total = last, total_lines
+
+    header = f'[File "{file_path}": {label}; {size} bytes, {total_lines} lines total]\n'
+    if note:
+        data += ("" if data.endswith("\n") else "\n") + note
+    if next_offset < total:
+        data += ("" if data.endswith("\n") else "\n") + f'[Next page: offset={next_offset}, unit="{unit}"]'
+    return header + data
+
+
+@tool(
+    "Reads and returns the contents of a file, constrained to the working directory. Without offset/limit the file is truncated at 10000 characters; pass them to page through large files.",
+    params={
+        "file_path": "The path to the file to read, relative to the working directory.",
+        "offset": "Number of lines (or bytes, see unit) to skip before the page starts. Defaults to 0.",
+        "limit": "Maximum number of lines (or bytes) in the page. Defaults to 200 lines or 10000 bytes.",
+        "unit": {
+            "description": 'Whether offset and limit count "lines" (default) or "bytes".',
+            "enum": ["lines", "bytes"],
+        },
+    },
+)
+def get_file_content(
+    working_directory,
+    file_path: str,
+    offset: int | None = None,
+    limit: int | None = None,
+    unit: str = "lines",
+):
     try:
         working_directory_abs = os.path.abspath(working_directory)
         target_abs = os.path.abspath(os.path.join(working_directory_abs, file_path))
@@ -21,31 +147,40 @@ def get_file_content(working_directory, file_path):
             # Fallback relative import for some execution contexts
             from .config import MAX_CHARS
 
-        # Read up to MAX_CHARS + 1 to detect truncation
-        with open(target_abs, "r") as f:
-            data = f.read(MAX_CHARS + 1)
+        if unit not in ("lines", "bytes"):
+            return f'Error: unit must be "lines" or "bytes", not "{unit}"'
+        # JSON numbers from the model may arrive as floats
+        offset = None if offset is None else int(offset)
+        limit = None if limit is None else int(limit)
+        if (offset is not None and offset < 0) or (limit is not None and limit <= 0):
+            return "Error: offset must be >= 0 and limit must be > 0"
+        paged = offset is not None or limit is not None
+        page_args = (offset or 0, limit, unit) if paged else ()
+
+        # Repeated reads of an untouched file are answered from the cache
+        signature = stat_signature(target_abs)
+        cached = file_cache.lookup("content", target_abs, page_args)
+        if cached is not None and cached[0] == signature:
+            return f'File "{file_path}" {UNCHANGED_SUFFIX}'
 
-        if len(data) > MAX_CHARS:
-            data = (
-                data[:MAX_CHARS]
-                + f'[...File "{file_path}" truncated at {MAX_CHARS} characters]'
-            )
+        if paged:
+            data = _read_page(target_abs, file_path, signature, offset or 0, limit, unit, MAX_CHARS)
+        else:
+            # Read up to MAX_CHARS + 1 to detect truncation
+            with open(target_abs, "r") as f:
+                data = f.read(MAX_CHARS + 1)
+
+            if len(data) > MAX_CHARS:
+                data = (
+                    data[:MAX_CHARS]
+                    + f'[...File "{file_path}" truncated at {MAX_CHARS} characters; '
+                    + f"it is {signature[1]} bytes in total, pass offset/limit to read further pages]"
+                )
+        file_cache.store("content", target_abs, signature, data, page_args)
+        if cached is not None and cached[1] == data:
+            # Touched but identical content
+            return f'File "{file_path}" {UNCHANGED_SUFFIX}'
         return data
     except Exception as e:
         return f"Error: {e}"
 
-
-schema_get_file_content = types.FunctionDeclaration(
-    name="get_file_content",
-    description="Reads and returns the contents of a file, constrained to the working directory.",
-    parameters=types.Schema(
-        type=types.Type.OBJECT,
-        properties={
-            "file_path": types.Schema(
-                type=types.Type.STRING,
-                description="The path to the file to read, relative to the working directory.",
-            ),
-        },
-        required=["file_path"],
-    ),
-)
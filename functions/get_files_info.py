@@ -1,8 +1,118 @@
 import os
-from google.genai import types
+from fnmatch import fnmatch
+from functions.cache import file_cache, stat_signature, UNCHANGED_SUFFIX
+from functions.config import LIST_PAGE_SIZE
+from functions.registry import tool
 
+ALWAYS_PRUNED = {".git"}
 
-def get_files_info(working_directory, directory="."):
+
+def _parse_gitignore(path, base):
+    # Rules are (base, pattern, negate, dir_only, anchored) tuples; base is
+    # the directory holding the .gitignore, relative to the listing root.
+    rules = []
+    try:
+        with open(path) as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return rules
+    for line in lines:
+        line = line.rstrip()
+        if not line or line.startswith("#"):
+            continue
+        negate = line.startswith("!")
+        if negate:
+            line = line[1:]
+        dir_only = line.endswith("/")
+        pattern = line.rstrip("/")
+        if pattern.startswith("**/"):
+            pattern = pattern[3:]
+        anchored = "/" in pattern
+        rules.append((base, pattern.lstrip("/"), negate, dir_only, anchored))
+    return rules
+
+
+def _ignored(rules, rel_path, name, is_dir):
+    # Later rules override earlier ones, as in git
+    ignored = False
+    for base, pattern, negate, dir_only, anchored in rules:
+        if dir_only and not is_dir:
+            continue
+        if base:
+            if not rel_path.startswith(base + "/"):
+                continue
+            candidate = rel_path[len(base) + 1 :]
+        else:
+            candidate = rel_path
+        if fnmatch(candidate if anchored else name, pattern):
+            ignored = not negate
+    return ignored
+
+
+def _matches_any(patterns, rel_path, name):
+    return any(fnmatch(rel_path, p) or fnmatch(name, p) for p in patterns)
+
+
+def walk_entries(root, rel, depth, options, rules):
+    # Yields (relative path, DirEntry, is_dir) in sorted, depth-first order,
+    # reusing the stat data os.scandir already fetched.
+    recursive, max_depth, include, exclude, respect_gitignore = options
+    directory = os.path.join(root, rel) if rel else root
+    if respect_gitignore:
+        rules = rules + _parse_gitignore(os.path.join(directory, ".gitignore"), rel)
+    with os.scandir(directory) as it:
+        entries = sorted(it, key=lambda entry: entry.name)
+
+    for entry in entries:
+        entry_rel = f"{rel}/{entry.name}" if rel else entry.name
+        try:
+            is_dir = entry.is_dir()
+        except OSError:
+            is_dir = False
+        if entry.name in ALWAYS_PRUNED and is_dir:
+            continue
+        if respect_gitignore and _ignored(rules, entry_rel, entry.name, is_dir):
+            continue
+        if exclude and _matches_any(exclude, entry_rel, entry.name):
+            continue
+        if not include or (not is_dir and _matches_any(include, entry_rel, entry.name)):
+            yield entry_rel, entry, is_dir
+        if (
+            is_dir
+            and recursive
+            and (max_depth is None or depth + 1 < max_depth)
+            and not entry.is_symlink()
+        ):
+            try:
+                yield from walk_entries(root, entry_rel, depth + 1, options, rules)
+            except OSError as e:
+                yield f"{entry_rel}/", e, False
+
+
+@tool(
+    "Lists files in the specified directory along with their sizes, constrained to the working directory. Set recursive to map a whole tree in one call; long listings are paginated.",
+    params={
+        "directory": "The directory to list files from, relative to the working directory. If not provided, lists files in the working directory itself.",
+        "recursive": "List subdirectories recursively, with paths relative to the listed directory. Defaults to false.",
+        "max_depth": "With recursive, the maximum depth to descend (1 lists only the directory itself).",
+        "include": "Glob patterns (e.g. '*.py'); only files whose path or name matches one are listed.",
+        "exclude": "Glob patterns for files and directories to skip; excluded directories are not descended into.",
+        "respect_gitignore": "Skip paths ignored by .gitignore files inside the listed directory. Defaults to true.",
+        "page_token": "Continuation token returned by a previous listing, to fetch the next page.",
+        "page_size": "Maximum number of entries per page. Defaults to 1000.",
+    },
+)
+def get_files_info(
+    working_directory,
+    directory: str = ".",
+    recursive: bool = False,
+    max_depth: int | None = None,
+    include: list[str] | None = None,
+    exclude: list[str] | None = None,
+    respect_gitignore: bool = True,
+    page_token: str | None = None,
+    page_size: int | None = None,
+):
     try:
         working_directory = os.path.abspath(working_directory)
         full_path = os.path.abspath(os.path.join(working_directory, directory))
@@ -12,32 +122,58 @@ def get_files_info(working_directory, directory="."):
         if os.path.isdir(full_path) == False:
             return f"Error: '{directory}' is not a directory"
 
+        # JSON numbers from the model may arrive as floats
+        max_depth = None if max_depth is None else int(max_depth)
+        page_size = LIST_PAGE_SIZE if page_size is None else int(page_size)
+        try:
+            start = int(page_token) if page_token else 0
+        except ValueError:
+            return f"Error: invalid page_token '{page_token}'"
+        if page_size <= 0 or start < 0:
+            return "Error: page_size must be > 0 and page_token must come from a previous listing"
+        options = (
+            bool(recursive),
+            max_depth,
+            tuple(include or ()),
+            tuple(exclude or ()),
+            bool(respect_gitignore),
+        )
+
+        # The directory's own stat misses files whose contents (and so the
+        # sizes shown) changed, so a single level is always re-listed and
+        # reported unchanged only when the text matches; recursive listings
+        # are not cached.
+        cache_args = None if recursive else options + (start, page_size)
+        if cache_args is not None:
+            signature = stat_signature(full_path)
+            cached = file_cache.lookup("listing", full_path, cache_args)
+
         items = []
-        for entry in os.listdir(full_path):
-            entry_path = os.path.join(full_path, entry)
+        next_token = None
+        for index, (rel, entry, is_dir) in enumerate(walk_entries(full_path, "", 0, options, [])):
+            if index < start:
+                continue
+            if len(items) == page_size:
+                next_token = str(index)
+                break
+            if isinstance(entry, OSError):
+                items.append(f"- {rel}: Error: {entry}")
+                continue
             try:
-                size = os.path.getsize(entry_path)
-                is_dir = os.path.isdir(entry_path)
-                items.append(f"- {entry}: file_size={size} bytes, is_dir={is_dir}")
+                size = entry.stat().st_size
+                items.append(f"- {rel}: file_size={size} bytes, is_dir={is_dir}")
             except Exception as e:
-                items.append(f"- {entry}: Error: {e}")
+                items.append(f"- {rel}: Error: {e}")
+        if next_token is not None:
+            items.append(f'[More entries: call again with page_token="{next_token}"]')
         print(f"Result for {directory} directory:")
-        return "\n".join(items)
+        listing = "\n".join(items)
+        if cache_args is not None:
+            file_cache.store("listing", full_path, signature, listing, cache_args)
+            if cached is not None and cached[1] == listing:
+                return f'Directory listing of "{directory}" {UNCHANGED_SUFFIX}'
+        return listing
 
     except Exception as e:
         return f"Error: {e}"
 
-
-schema_get_files_info = types.FunctionDeclaration(
-    name="get_files_info",
-    description="Lists files in the specified directory along with their sizes, constrained to the working directory.",
-    parameters=types.Schema(
-        type=types.Type.OBJECT,
-        properties={
-            "directory": types.Schema(
-                type=types.Type.STRING,
-                description="The directory to list files from, relative to the working directory. If not provided, lists files in the working directory itself.",
-            ),
-        },
-    ),
-)
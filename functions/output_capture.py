@@ -0,0 +1,96 @@
+import os
+import threading
+import time
+
+READ_CHUNK = 65536
+# Seconds the pipes get to close after the processes holding them are killed
+DRAIN_GRACE = 1.0
+
+
+class BoundedBuffer:
+    """Keeps the first and last limit/2 bytes written to it and counts the
+    bytes dropped in between, so memory stays flat however much is written."""
+
+    def __init__(self, limit):
+        self.head_limit = limit // 2
+        self.tail_limit = limit - self.head_limit
+        self.head = bytearray()
+        self.tail = bytearray()
+        self.total = 0
+
+    def write(self, data):
+        self.total += len(data)
+        room = self.head_limit - len(self.head)
+        if room > 0:
+            self.head += data[:room]
+            data = data[room:]
+        if data:
+            self.tail += data[-self.tail_limit :] if self.tail_limit else b""
+            excess = len(self.tail) - self.tail_limit
+            if excess > 0:
+                del self.tail[:excess]
+
+    @property
+    def dropped(self):
+        return self.total - len(self.head) - len(self.tail)
+
+    def text(self):
+        head = self.head.decode(errors="replace")
+        tail = self.tail.decode(errors="replace")
+        if self.dropped:
+            return f"{head}\n[... {self.dropped} bytes dropped ...]\n{tail}"
+        return head + tail
+
+
+class PipeCapture:
+    """Drains pipe file descriptors on background threads into
+    BoundedBuffers of limit bytes each. on_overflow is called once, from a
+    reader thread, the first time any stream goes over its limit."""
+
+    def __init__(self, fds, limit, on_overflow=None):
+        self.buffers = [BoundedBuffer(limit) for _ in fds]
+        self.limit = limit
+        self.on_overflow = on_overflow
+        self.overflowed = False
+        self._stopped = False
+        self._lock = threading.Lock()
+        self._threads = [
+            threading.Thread(target=self._drain, args=(fd, buffer), daemon=True)
+            for fd, buffer in zip(fds, self.buffers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def _drain(self, fd, buffer):
+        try:
+            while True:
+                data = os.read(fd, READ_CHUNK)
+                if not data or self._stopped:
+                    break
+                buffer.write(data)
+                if buffer.total > self.limit:
+                    with self._lock:
+                        first = not self.overflowed
+                        self.overflowed = True
+                    if first and self.on_overflow is not None:
+                        self.on_overflow()
+        finally:
+            os.close(fd)
+
+    def join(self, timeout=None):
+        """Wait up to timeout seconds in total; True once every pipe closed."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(None if deadline is None else max(0.0, deadline - time.monotonic()))
+        return not any(thread.is_alive() for thread in self._threads)
+
+    def finish(self, timeout, kill):
+        """Wait up to timeout seconds for the pipes to close. Whatever still
+        holds them then, typically a background process the script left
+        behind, is stopped with kill(); after DRAIN_GRACE more seconds the
+        readers give up and the buffers keep what they have."""
+        if self.join(timeout):
+            return
+        kill()
+        if not self.join(DRAIN_GRACE):
+            self._stopped = True
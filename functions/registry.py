@@ -0,0 +1,113 @@
+import typing
+from functools import cache
+from types import UnionType
+
+# Tool name -> Tool, filled in by the @tool decorator as the tool modules are
+# imported. Dispatch reads this table; nothing rebuilds it per call.
+TOOLS = {}
+
+# Parameters the agent injects itself and never shows to the model
+INJECTED_PARAMS = {"working_directory"}
+
+_TYPE_NAMES = {
+    str: "STRING",
+    int: "INTEGER",
+    float: "NUMBER",
+    bool: "BOOLEAN",
+    list: "ARRAY",
+    dict: "OBJECT",
+}
+
+
+class Tool:
+    """A registered tool: the function, what the model is told about it and
+    whether calls may run alongside others from the same turn."""
+
+    def __init__(self, function, description, params, parallel_safe):
+        self.name = function.__name__
+        self.function = function
+        self.description = description
+        self.params = params
+        self.parallel_safe = parallel_safe
+
+
+def tool(description, params=None, parallel_safe=True):
+    """Register the decorated function as a tool.
+
+    params maps parameter names to a description, or to a dict of extra
+    schema fields (description, enum, items). Types come from the
+    signature: the annotation if there is one, otherwise the default's type.
+    Parameters without a default are required."""
+
+    def register(function):
+        TOOLS[function.__name__] = Tool(function, description, params or {}, parallel_safe)
+        return function
+
+    return register
+
+
+def _type_name(annotation, default):
+    if annotation is not None:
+        origin = typing.get_origin(annotation)
+        if origin in (typing.Union, UnionType):
+            # Optional[X] / X | None describe X
+            annotation = next(arg for arg in typing.get_args(annotation) if arg is not type(None))
+            origin = typing.get_origin(annotation)
+        python_type = origin or annotation
+        item = typing.get_args(annotation)[0] if origin is list and typing.get_args(annotation) else None
+    else:
+        python_type = type(default)
+        item = None
+    if python_type not in _TYPE_NAMES:
+        raise TypeError(f"Cannot describe {python_type!r} in a tool schema")
+    return _TYPE_NAMES[python_type], item
+
+
+def parameters_schema(tool):
+    """The OBJECT schema of a tool's parameters, as a plain dict."""
+    import inspect
+
+    properties = {}
+    required = []
+    for name, parameter in inspect.signature(tool.function).parameters.items():
+        if name in INJECTED_PARAMS:
+            continue
+        if name not in tool.params:
+            # Undescribed parameters stay hidden from the model
+            continue
+        empty = inspect.Parameter.empty
+        annotation = None if parameter.annotation is empty else parameter.annotation
+        default = None if parameter.default is empty else parameter.default
+        type_name, item = _type_name(annotation, default)
+        spec = tool.params[name]
+        spec = {"description": spec} if isinstance(spec, str) else dict(spec)
+        schema = {"type": type_name, **spec}
+        if type_name == "ARRAY" and "items" not in schema:
+            schema["items"] = {"type": _TYPE_NAMES.get(item, "STRING")}
+        properties[name] = schema
+        if parameter.default is empty:
+            required.append(name)
+    schema = {"type": "OBJECT", "properties": properties}
+    if required:
+        schema["required"] = required
+    return schema
+
+
+@cache
+def declaration(name):
+    from google.genai import types
+
+    tool = TOOLS[name]
+    return types.FunctionDeclaration(
+        name=name,
+        description=tool.description,
+        parameters=types.Schema.model_validate(parameters_schema(tool)),
+    )
+
+
+@cache
+def available_functions():
+    """The types.Tool declaring every registered tool, built on first use."""
+    from google.genai import types
+
+    return types.Tool(function_declarations=[declaration(name) for name in TOOLS])
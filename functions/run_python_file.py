@@ -1,9 +1,82 @@
 import os
+import signal
 import subprocess
-from google.genai import types
+import time
+from functions.cache import file_cache
+from functions.search_code import notify_tree_changed
+from functions.config import RUN_TIMEOUT, MAX_OUTPUT_BYTES, KILL_ON_OUTPUT_OVERFLOW
+from functions.output_capture import PipeCapture
+from functions import warm_pool
+from functions.registry import tool
 
 
-def run_python_file(working_directory, file_path, args=[]):
+def _kill_group(process):
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+def _run_cold(cmd, cwd, timeout, output_limit, kill_on_overflow):
+    # Like subprocess.run(capture_output=True), but the pipes are drained
+    # incrementally into bounded buffers instead of being held in full.
+    stdout_r, stdout_w = os.pipe()
+    stderr_r, stderr_w = os.pipe()
+    try:
+        process = subprocess.Popen(
+            cmd,
+            cwd=cwd,
+            stdin=subprocess.DEVNULL,
+            stdout=stdout_w,
+            stderr=stderr_w,
+            start_new_session=True,
+        )
+    except BaseException:
+        os.close(stdout_r)
+        os.close(stderr_r)
+        raise
+    finally:
+        os.close(stdout_w)
+        os.close(stderr_w)
+    overflowed = []
+
+    def on_overflow():
+        overflowed.append(True)
+        _kill_group(process)
+
+    capture = PipeCapture(
+        [stdout_r, stderr_r],
+        output_limit,
+        on_overflow if kill_on_overflow else None,
+    )
+    deadline = time.monotonic() + timeout
+    try:
+        returncode = process.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        _kill_group(process)
+        process.wait()
+        raise
+    finally:
+        # Children left in the group may hold the pipes past the script's exit
+        capture.finish(max(0.0, deadline - time.monotonic()), lambda: _kill_group(process))
+    stdout, stderr = capture.buffers
+    return stdout, stderr, returncode, bool(overflowed)
+
+
+@tool(
+    "Executes a Python file with optional command-line arguments, constrained to the working directory.",
+    params={
+        "file_path": "The path to the Python file to execute, relative to the working directory.",
+        "args": "Optional command-line arguments to pass to the Python file.",
+        "kill_on_overflow": "Kill the process as soon as stdout or stderr exceeds the output limit, instead of letting it finish and keeping only the head and tail.",
+    },
+)
+def run_python_file(
+    working_directory,
+    file_path: str,
+    args: list[str] = [],
+    kill_on_overflow: bool = KILL_ON_OUTPUT_OVERFLOW,
+):
     try:
         working_directory_abs = os.path.abspath(working_directory)
         target_abs = os.path.abspath(os.path.join(working_directory, file_path))
@@ -24,30 +97,40 @@ def run_python_file(working_directory, file_path, args=[]):
         cmd = ["python3", file_path] + args
 
         try:
-            # Execute the Python file
-            completed_process = subprocess.run(
-                cmd,
-                cwd=working_directory_abs,
-                timeout=30,
-                capture_output=True,
-                text=True,
-            )
-
-            # Get stdout and stderr
-            stdout = completed_process.stdout or ""
-            stderr = completed_process.stderr or ""
+            pool = warm_pool.pool_for(working_directory_abs)
+            if pool is not None:
+                # Fork from a pre-warmed interpreter instead of starting one
+                stdout, stderr, returncode, killed = pool.run(
+                    file_path, args, RUN_TIMEOUT, MAX_OUTPUT_BYTES, kill_on_overflow
+                )
+            else:
+                # Execute the Python file
+                stdout, stderr, returncode, killed = _run_cold(
+                    cmd, working_directory_abs, RUN_TIMEOUT, MAX_OUTPUT_BYTES, kill_on_overflow
+                )
+
+            # The script may have changed anything in the working directory
+            file_cache.invalidate_tree(working_directory_abs)
+            notify_tree_changed(working_directory_abs)
 
             # Build output string
             output_string = []
-            if stdout.strip():
-                output_string.append(f"STDOUT: {stdout.strip()}")
-            if stderr.strip():
-                output_string.append(f"STDERR: {stderr.strip()}")
-
-            # Check for non-zero exit code
-            if completed_process.returncode != 0:
+            for label, stream in (("STDOUT", stdout), ("STDERR", stderr)):
+                text = stream.text().strip()
+                if text:
+                    output_string.append(f"{label}: {text}")
+                if stream.dropped:
+                    output_string.append(
+                        f"[{label} exceeded {MAX_OUTPUT_BYTES} bytes: kept the first and last {MAX_OUTPUT_BYTES // 2}, dropped {stream.dropped}]"
+                    )
+            # Check for early kill or non-zero exit code
+            if killed:
                 output_string.append(
-                    f"Process exited with code {completed_process.returncode}"
+                    f"Process killed after its output exceeded {MAX_OUTPUT_BYTES} bytes"
+                )
+            elif returncode != 0:
+                output_string.append(
+                    f"Process exited with code {returncode}"
                 )
 
             # Return formatted output or "No output produced."
@@ -57,30 +140,12 @@ def run_python_file(working_directory, file_path, args=[]):
                 return "No output produced."
 
         except subprocess.TimeoutExpired:
-            return "Error: executing Python file: Process timed out after 30 seconds"
+            file_cache.invalidate_tree(working_directory_abs)
+            notify_tree_changed(working_directory_abs)
+            return f"Error: executing Python file: Process timed out after {RUN_TIMEOUT} seconds"
         except Exception as e:
             return f"Error: executing Python file: {e}"
 
     except Exception as e:
         return f"Error: executing Python file: {e}"
 
-
-schema_run_python_file = types.FunctionDeclaration(
-    name="run_python_file",
-    description="Executes a Python file with optional command-line arguments, constrained to the working directory.",
-    parameters=types.Schema(
-        type=types.Type.OBJECT,
-        properties={
-            "file_path": types.Schema(
-                type=types.Type.STRING,
-                description="The path to the Python file to execute, relative to the working directory.",
-            ),
-            "args": types.Schema(
-                type=types.Type.ARRAY,
-                description="Optional command-line arguments to pass to the Python file.",
-                items=types.Schema(type=types.Type.STRING),
-            ),
-        },
-        required=["file_path"],
-    ),
-)
@@ -0,0 +1,102 @@
+import json
+import os
+import subprocess
+import threading
+from functions.cache import file_cache
+from functions.search_code import notify_tree_changed
+from functions.config import MAX_CHARS, RUN_TIMEOUT, TEST_WORKERS, TEST_FILE_PATTERNS
+from functions.registry import tool
+from functions.run_python_file import _kill_group
+
+RUNNER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tests_worker.py")
+
+# Working directory -> ids of the tests that failed or errored in its last run
+_last_failed = {}
+_last_failed_lock = threading.Lock()
+
+
+def drop_failures(working_directory):
+    """Forget the failed tests of a working directory that is going away."""
+    with _last_failed_lock:
+        _last_failed.pop(os.path.abspath(working_directory), None)
+
+
+def _run_runner(working_directory_abs, selectors):
+    cmd = ["python3", RUNNER_SCRIPT, "--workers", str(TEST_WORKERS)]
+    for pattern in TEST_FILE_PATTERNS:
+        cmd += ["--pattern", pattern]
+    process = subprocess.Popen(
+        cmd + ["--", *selectors],
+        cwd=working_directory_abs,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        start_new_session=True,
+    )
+    try:
+        stdout, stderr = process.communicate(timeout=RUN_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        _kill_group(process)
+        process.communicate()
+        raise
+    if process.returncode != 0:
+        message = stderr.decode(errors="replace").strip()[-MAX_CHARS // 2 :]
+        raise RuntimeError(f"test runner exited with code {process.returncode}: {message}")
+    return json.loads(stdout)
+
+
+def format_report(report):
+    records = sorted(report["records"])
+    counts = {"passed": 0, "failed": 0, "error": 0, "skipped": 0}
+    for _, outcome, _, _ in records:
+        counts[outcome] += 1
+    lines = [
+        f"Ran {len(records)} tests in {report['seconds']}s on {report['workers']} workers: "
+        f"{counts['passed']} passed, {counts['failed']} failed, "
+        f"{counts['error']} errors, {counts['skipped']} skipped"
+    ]
+    for test_id, outcome, _, details in records:
+        if outcome in ("failed", "error"):
+            lines.append(f"\n{outcome.upper()} {test_id}\n{details.strip()}")
+    return "\n".join(lines)[:MAX_CHARS]
+
+
+@tool(
+    "Discovers and runs the unittest and pytest-style tests in the working directory in parallel, returning pass/fail counts and the tracebacks of failing tests only.",
+    params={
+        "tests": 'Optional tests to run instead of all of them: files ("tests.py"), classes ("tests.py::TestCalculator") or single tests ("tests.py::TestCalculator::test_addition").',
+        "failed_only": "Rerun only the tests that failed or errored in the previous run.",
+    },
+)
+def run_tests(working_directory, tests: list[str] = [], failed_only: bool = False):
+    try:
+        working_directory_abs = os.path.abspath(working_directory)
+        for selector in tests:
+            target_abs = os.path.abspath(os.path.join(working_directory, selector.split("::")[0]))
+            if not target_abs.startswith(working_directory_abs):
+                return f'Error: Cannot run "{selector}" as it is outside the permitted working directory'
+
+        selectors = list(tests)
+        if failed_only:
+            with _last_failed_lock:
+                selectors = _last_failed.get(working_directory_abs, [])
+            if not selectors:
+                return "No failed tests to rerun"
+
+        try:
+            report = _run_runner(working_directory_abs, selectors)
+        except subprocess.TimeoutExpired:
+            return f"Error: running tests: Process timed out after {RUN_TIMEOUT} seconds"
+        finally:
+            # The tests may have changed anything in the working directory
+            file_cache.invalidate_tree(working_directory_abs)
+            notify_tree_changed(working_directory_abs)
+
+        failed = sorted(
+            test_id for test_id, outcome, _, _ in report["records"] if outcome in ("failed", "error")
+        )
+        with _last_failed_lock:
+            _last_failed[working_directory_abs] = failed
+        return format_report(report)
+    except Exception as e:
+        return f"Error: running tests: {e}"
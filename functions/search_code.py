@@ -0,0 +1,247 @@
+import os
+import re
+import re._parser as sre_parse
+import threading
+from functions.cache import stat_signature
+from functions.config import MAX_CHARS, SEARCH_MAX_RESULTS, SEARCH_MAX_FILE_BYTES
+from functions.get_files_info import walk_entries
+from functions.registry import tool
+
+SNIPPET_CHARS = 200
+
+
+def _trigrams(text):
+    text = text.lower()
+    return {text[i : i + 3] for i in range(len(text) - 2)}
+
+
+def _required_literals(pattern):
+    # Literal runs every match of pattern must contain, taken from the top
+    # level of the parsed regex. Anything we do not understand just ends a
+    # run, so the result is always safe to filter on.
+    runs = []
+    current = []
+    try:
+        parsed = sre_parse.parse(pattern)
+    except re.error:
+        return []
+    for op, value in parsed:
+        if op is sre_parse.LITERAL:
+            current.append(chr(value))
+        else:
+            runs.append("".join(current))
+            current = []
+    runs.append("".join(current))
+    return [run for run in runs if len(run) >= 3]
+
+
+class TrigramIndex:
+    """In-memory inverted trigram index over the text files of one working
+    directory.
+
+    The first search builds it; afterwards write_file updates single files
+    through update_file, and anything that may have touched the tree in
+    unknown ways (running a script) only marks it stale, so the next search
+    re-stats the tree and re-indexes the files whose (mtime_ns, size)
+    changed."""
+
+    def __init__(self, root):
+        self.root = root
+        self.files = {}
+        self.postings = {}
+        self.built = False
+        self.stale = False
+        self._lock = threading.RLock()
+
+    def _load(self, rel_path):
+        path = os.path.join(self.root, rel_path)
+        signature = stat_signature(path)
+        if signature[1] > SEARCH_MAX_FILE_BYTES:
+            return signature, None
+        with open(path, "rb") as f:
+            data = f.read()
+        if b"\0" in data[:8192]:
+            return signature, None
+        return signature, data.decode("utf-8", errors="replace")
+
+    def _add(self, rel_path):
+        self._remove(rel_path)
+        try:
+            signature, text = self._load(rel_path)
+        except OSError:
+            return
+        grams = _trigrams(text) if text is not None else set()
+        self.files[rel_path] = (signature, text, grams)
+        for gram in grams:
+            self.postings.setdefault(gram, set()).add(rel_path)
+
+    def _remove(self, rel_path):
+        entry = self.files.pop(rel_path, None)
+        if entry is None:
+            return
+        for gram in entry[2]:
+            paths = self.postings.get(gram)
+            if paths is not None:
+                paths.discard(rel_path)
+                if not paths:
+                    del self.postings[gram]
+
+    def refresh(self):
+        """Bring the index up to date, re-indexing only changed files."""
+        with self._lock:
+            if self.built and not self.stale:
+                return
+            seen = set()
+            options = (True, None, (), (), True)
+            for rel_path, entry, is_dir in walk_entries(self.root, "", 0, options, []):
+                if is_dir or isinstance(entry, OSError):
+                    continue
+                seen.add(rel_path)
+                indexed = self.files.get(rel_path)
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                if indexed is None or indexed[0] != (st.st_mtime_ns, st.st_size):
+                    self._add(rel_path)
+            for rel_path in set(self.files) - seen:
+                self._remove(rel_path)
+            self.built = True
+            self.stale = False
+
+    def update_file(self, path):
+        with self._lock:
+            if not self.built:
+                return
+            rel_path = os.path.relpath(path, self.root).replace(os.sep, "/")
+            if os.path.isfile(path):
+                self._add(rel_path)
+            else:
+                self._remove(rel_path)
+
+    def candidates(self, literals):
+        with self._lock:
+            if not literals:
+                return sorted(self.files)
+            result = None
+            for literal in literals:
+                for gram in _trigrams(literal):
+                    paths = self.postings.get(gram, set())
+                    result = set(paths) if result is None else result & paths
+                    if not result:
+                        return []
+            return sorted(result)
+
+    def text(self, rel_path):
+        with self._lock:
+            entry = self.files.get(rel_path)
+            return entry[1] if entry is not None else None
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def index_for(working_directory):
+    root = os.path.abspath(working_directory)
+    with _indexes_lock:
+        index = _indexes.get(root)
+        if index is None:
+            index = _indexes[root] = TrigramIndex(root)
+        return index
+
+
+def drop_index(working_directory):
+    """Forget the index of a working directory that is going away."""
+    with _indexes_lock:
+        _indexes.pop(os.path.abspath(working_directory), None)
+
+
+def notify_written(path):
+    """Called after a tool writes path; updates every index covering it."""
+    path = os.path.abspath(path)
+    with _indexes_lock:
+        indexes = list(_indexes.values())
+    for index in indexes:
+        if path.startswith(index.root.rstrip(os.sep) + os.sep):
+            index.update_file(path)
+
+
+def notify_tree_changed(root):
+    """Called when anything under root may have changed."""
+    root = os.path.abspath(root)
+    with _indexes_lock:
+        indexes = list(_indexes.values())
+    for index in indexes:
+        if index.root.startswith(root) or root.startswith(index.root):
+            index.stale = True
+
+
+@tool(
+    "Searches the text files of the working directory for a literal string or regex and returns matching lines as path:line: snippet. Much cheaper than listing and reading files to find code.",
+    params={
+        "query": "The text to search for, or a Python regular expression if regex is true.",
+        "regex": "Treat query as a regular expression. Defaults to false.",
+        "case_sensitive": "Match case exactly. Defaults to true.",
+        "path": "Limit the search to this directory, relative to the working directory.",
+        "max_results": "Maximum number of matching lines to return. Defaults to 50.",
+    },
+)
+def search_code(
+    working_directory,
+    query: str,
+    regex: bool = False,
+    case_sensitive: bool = True,
+    path: str = ".",
+    max_results: int = SEARCH_MAX_RESULTS,
+):
+    try:
+        working_directory_abs = os.path.abspath(working_directory)
+        search_abs = os.path.abspath(os.path.join(working_directory_abs, path))
+        if not (search_abs == working_directory_abs or search_abs.startswith(working_directory_abs.rstrip(os.sep) + os.sep)):
+            return f"Error: Cannot search '{path}' as it is outside the permitted working directory"
+        if not query:
+            return "Error: query must not be empty"
+
+        flags = 0 if case_sensitive else re.IGNORECASE
+        try:
+            pattern = re.compile(query if regex else re.escape(query), flags)
+        except re.error as e:
+            return f"Error: invalid regex: {e}"
+        literals = _required_literals(query) if regex else [query]
+        literals = [literal for literal in literals if len(literal) >= 3]
+
+        index = index_for(working_directory_abs)
+        index.refresh()
+
+        prefix = os.path.relpath(search_abs, working_directory_abs).replace(os.sep, "/")
+        prefix = "" if prefix == "." else prefix + "/"
+        max_results = int(max_results)
+
+        results = []
+        truncated = False
+        for rel_path in index.candidates(literals):
+            if not rel_path.startswith(prefix):
+                continue
+            text = index.text(rel_path)
+            if text is None:
+                continue
+            for line_number, line in enumerate(text.splitlines(), 1):
+                if pattern.search(line):
+                    if len(results) == max_results:
+                        truncated = True
+                        break
+                    snippet = line.strip()[:SNIPPET_CHARS]
+                    results.append(f"{rel_path}:{line_number}: {snippet}")
+            if truncated:
+                break
+
+        if not results:
+            return f'No matches for "{query}"'
+        output = "\n".join(results)
+        if truncated:
+            output += f"\n[Results capped at {max_results} matches; narrow the query or path]"
+        return output[:MAX_CHARS]
+    except Exception as e:
+        return f"Error: {e}"
+
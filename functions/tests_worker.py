@@ -0,0 +1,266 @@
+"""Test runner used by functions/run_tests.py.
+
+Started as `python3 tests_worker.py --workers N --pattern GLOB... [SELECTOR...]`
+inside the working directory. It imports the matching test files once,
+collects unittest TestCases plus pytest-style `test_*` functions and `Test*`
+classes, and runs them on a pool of forked processes. Tests are sharded one
+per task, except that a class with setUpClass/tearDownClass, or a module
+with setUpModule/tearDownModule, stays in one shard so its fixtures still
+run once.
+Without selectors every collected test runs; a selector is a file
+(`tests.py`), a class (`tests.py::TestCalculator`) or a single test
+(`tests.py::TestCalculator::test_addition`).
+
+The report is one JSON object written to the original stdout: a list of
+[test_id, outcome, seconds, details] with outcome one of passed, failed,
+error or skipped. Anything the tests themselves print goes to /dev/null,
+except what a failing test printed, which unittest's buffering appends to
+its traceback.
+"""
+
+import argparse
+import fnmatch
+import importlib.util
+import inspect
+import json
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+import unittest
+
+SKIP_DIRS = {"__pycache__", "node_modules", "venv"}
+DETAILS_CHARS = 4000
+
+# file -> {test_id: TestCase} or the collection traceback; filled before
+# the pool forks, so workers inherit it instead of importing again
+_collected = {}
+# test_id -> shard key; tests sharing module or class fixtures share a
+# shard, so the fixtures still run once
+_shard_keys = {}
+
+
+def find_files(patterns):
+    found = []
+    for dirpath, dirnames, filenames in os.walk("."):
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith(".") and d not in SKIP_DIRS)
+        for filename in sorted(filenames):
+            if filename.endswith(".py") and any(fnmatch.fnmatch(filename, p) for p in patterns):
+                found.append(os.path.relpath(os.path.join(dirpath, filename)))
+    return found
+
+
+def _plain_case(function, test_id):
+    case = unittest.FunctionTestCase(function, description=test_id)
+    case.id = lambda: test_id
+    return case
+
+
+def _method_runner(cls, name):
+    def run():
+        instance = cls()
+        if hasattr(instance, "setup_method"):
+            instance.setup_method(getattr(instance, name))
+        try:
+            getattr(instance, name)()
+        finally:
+            if hasattr(instance, "teardown_method"):
+                instance.teardown_method(getattr(instance, name))
+
+    return run
+
+
+def _unsupported(test_id):
+    def run():
+        raise TypeError(f"{test_id} takes arguments; pytest fixtures are not supported")
+
+    return run
+
+
+def collect(path):
+    if path in _collected:
+        return _collected[path]
+    module_name = os.path.splitext(path)[0].replace(os.sep, ".")
+    directory = os.path.dirname(os.path.abspath(path))
+    if directory not in sys.path:
+        sys.path.insert(0, directory)
+    try:
+        spec = importlib.util.spec_from_file_location(module_name, path)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[module_name] = module
+        spec.loader.exec_module(module)
+    except BaseException:
+        _collected[path] = traceback.format_exc()
+        return _collected[path]
+
+    cases = {}
+    loader = unittest.TestLoader()
+    for name, value in vars(module).items():
+        if getattr(value, "__module__", None) != module_name:
+            continue
+        if isinstance(value, type) and issubclass(value, unittest.TestCase):
+            for case in loader.loadTestsFromTestCase(value):
+                cases[f"{path}::{name}::{case._testMethodName}"] = case
+        elif isinstance(value, type) and name.startswith("Test"):
+            for method in sorted(vars(value)):
+                if method.startswith("test") and callable(getattr(value, method)):
+                    test_id = f"{path}::{name}::{method}"
+                    if len(inspect.signature(getattr(value, method)).parameters) > 1:
+                        cases[test_id] = _plain_case(_unsupported(test_id), test_id)
+                    else:
+                        cases[test_id] = _plain_case(_method_runner(value, method), test_id)
+        elif inspect.isfunction(value) and name.startswith("test"):
+            test_id = f"{path}::{name}"
+            if inspect.signature(value).parameters:
+                cases[test_id] = _plain_case(_unsupported(test_id), test_id)
+            else:
+                cases[test_id] = _plain_case(value, test_id)
+    module_fixtures = hasattr(module, "setUpModule") or hasattr(module, "tearDownModule")
+    for test_id, case in cases.items():
+        if module_fixtures:
+            _shard_keys[test_id] = path
+        elif isinstance(case, unittest.FunctionTestCase) or not _has_class_fixtures(type(case)):
+            _shard_keys[test_id] = test_id
+        else:
+            _shard_keys[test_id] = test_id.rsplit("::", 1)[0]
+    _collected[path] = cases
+    return cases
+
+
+def _has_class_fixtures(cls):
+    return (
+        cls.setUpClass.__func__ is not unittest.TestCase.setUpClass.__func__
+        or cls.tearDownClass.__func__ is not unittest.TestCase.tearDownClass.__func__
+    )
+
+
+def _trim(details):
+    if len(details) <= DETAILS_CHARS:
+        return details
+    return "...\n" + details[-DETAILS_CHARS:]
+
+
+class _Result(unittest.TestResult):
+    # Records outcomes under our test ids (test_ids maps each TestCase to
+    # its id) instead of unittest's dotted names
+    def __init__(self, test_ids):
+        super().__init__()
+        self.buffer = True
+        self.records = []
+        self._test_ids = test_ids
+        self._started = {}
+
+    def startTest(self, test):
+        self._started[test] = time.perf_counter()
+        super().startTest(test)
+
+    def _record(self, test, outcome, details=""):
+        seconds = time.perf_counter() - self._started.get(test, time.perf_counter())
+        test_id = self._test_ids.get(test, str(test))
+        self.records.append([test_id, outcome, round(seconds, 4), _trim(details)])
+
+    def addSuccess(self, test):
+        super().addSuccess(test)
+        self._record(test, "passed")
+
+    def addFailure(self, test, err):
+        super().addFailure(test, err)
+        self._record(test, "failed", self.failures[-1][1])
+
+    def addError(self, test, err):
+        super().addError(test, err)
+        # Class and module fixture errors arrive with a placeholder test
+        self._record(test, "error", self.errors[-1][1])
+
+    def addSkip(self, test, reason):
+        super().addSkip(test, reason)
+        self._record(test, "skipped", reason)
+
+    def addExpectedFailure(self, test, err):
+        super().addExpectedFailure(test, err)
+        self._record(test, "passed")
+
+    def addUnexpectedSuccess(self, test):
+        super().addUnexpectedSuccess(test)
+        self._record(test, "failed", "unexpected success")
+
+
+def run_shard(test_ids):
+    cases = {collect(test_id.split("::")[0])[test_id]: test_id for test_id in test_ids}
+    suite = unittest.TestSuite(cases)
+    result = _Result(cases)
+    suite(result)
+    return result.records
+
+
+def select(files, selectors):
+    """Return (shards, records): lists of test ids to run together, and
+    records for files that failed to import or selectors that match
+    nothing."""
+    records = []
+    selected = {}
+    if selectors:
+        wanted = {}
+        for selector in selectors:
+            wanted.setdefault(os.path.normpath(selector.split("::")[0]), []).append(selector)
+        files = list(wanted)
+    for path in files:
+        if not os.path.isfile(path):
+            records.append([path, "error", 0.0, f"no such test file: {path}"])
+            continue
+        cases = collect(path)
+        if isinstance(cases, str):
+            records.append([path, "error", 0.0, _trim(cases)])
+            continue
+        if not selectors:
+            selected.update(dict.fromkeys(cases))
+            continue
+        for selector in wanted[path]:
+            prefix = "::".join([path] + selector.split("::")[1:])
+            matches = [t for t in cases if t == prefix or t.startswith(prefix + "::")]
+            if not matches:
+                records.append([selector, "error", 0.0, f"no test matches {selector}"])
+            selected.update(dict.fromkeys(matches))
+    shards = {}
+    for test_id in selected:
+        shards.setdefault(_shard_keys[test_id], []).append(test_id)
+    return list(shards.values()), records
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--pattern", action="append", default=[])
+    parser.add_argument("selectors", nargs="*")
+    args = parser.parse_args()
+
+    # Keep the report's channel to ourselves; test output goes nowhere
+    report = os.fdopen(os.dup(1), "w")
+    devnull = os.open(os.devnull, os.O_RDWR)
+    for fd in (0, 1, 2):
+        os.dup2(devnull, fd)
+    sys.path[0] = os.getcwd()
+
+    start = time.perf_counter()
+    shards, records = select(find_files(args.pattern), args.selectors)
+    workers = max(1, min(args.workers, len(shards)))
+    if workers == 1 or not hasattr(os, "fork"):
+        for shard in shards:
+            records += run_shard(shard)
+    else:
+        # Biggest shards first, so one long class does not start last
+        shards.sort(key=len, reverse=True)
+        chunksize = max(1, len(shards) // (workers * 4))
+        with multiprocessing.get_context("fork").Pool(workers) as pool:
+            for shard_records in pool.imap_unordered(run_shard, shards, chunksize):
+                records += shard_records
+    json.dump(
+        {"records": records, "workers": workers, "seconds": round(time.perf_counter() - start, 3)},
+        report,
+    )
+    report.close()
+
+
+if __name__ == "__main__":
+    main()
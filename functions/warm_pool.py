@@ -0,0 +1,188 @@
+import atexit
+import json
+import os
+import queue
+import signal
+import socket
+import subprocess
+import threading
+import time
+from functions.config import WARM_WORKERS, WARM_MODULES
+from functions.output_capture import PipeCapture
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "warm_worker.py")
+
+# Number of warm workers per working directory; 0 runs every script cold
+pool_size = WARM_WORKERS
+
+
+def available():
+    return hasattr(os, "fork") and hasattr(socket, "send_fds")
+
+
+class WarmWorker:
+    """One pre-started interpreter that forks a child per script."""
+
+    def __init__(self, cwd):
+        parent, child = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        self.process = subprocess.Popen(
+            ["python3", WORKER_SCRIPT, str(child.fileno()), *WARM_MODULES],
+            cwd=cwd,
+            pass_fds=[child.fileno()],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        child.close()
+        self.sock = parent
+
+    def alive(self):
+        return self.process.poll() is None
+
+    def run(self, file_path, args, cwd, timeout, output_limit, kill_on_overflow=False):
+        """Run a script in a forked child.
+
+        Returns (stdout, stderr, returncode, killed_for_output) where stdout
+        and stderr are BoundedBuffers. Raises subprocess.TimeoutExpired after
+        killing the child's process group if it runs longer than timeout
+        seconds."""
+        stdout_r, stdout_w = os.pipe()
+        stderr_r, stderr_w = os.pipe()
+        try:
+            request = {"file_path": file_path, "args": list(args), "cwd": cwd}
+            socket.send_fds(self.sock, [json.dumps(request).encode()], [stdout_w, stderr_w])
+        except BaseException:
+            os.close(stdout_r)
+            os.close(stderr_r)
+            raise
+        finally:
+            os.close(stdout_w)
+            os.close(stderr_w)
+
+        child = {"pid": None, "overflowed": False}
+        lock = threading.Lock()
+
+        def kill():
+            with lock:
+                if child["pid"] is not None:
+                    try:
+                        os.killpg(child["pid"], signal.SIGKILL)
+                    except ProcessLookupError:
+                        pass
+
+        def on_overflow():
+            child["overflowed"] = True
+            kill()
+
+        capture = PipeCapture(
+            [stdout_r, stderr_r], output_limit, on_overflow if kill_on_overflow else None
+        )
+
+        deadline = time.monotonic() + timeout
+        self.sock.settimeout(timeout)
+        timed_out = False
+        try:
+            # The worker only sends the pid once the child leads its own
+            # process group, so kill() cannot miss it
+            pid = json.loads(self.sock.recv(4096))["pid"]
+            with lock:
+                child["pid"] = pid
+            if child["overflowed"]:
+                kill()
+            try:
+                self.sock.settimeout(max(0.001, deadline - time.monotonic()))
+                returncode = json.loads(self.sock.recv(4096))["returncode"]
+            except socket.timeout:
+                timed_out = True
+                kill()
+                self.sock.settimeout(None)
+                returncode = json.loads(self.sock.recv(4096))["returncode"]
+        finally:
+            self.sock.settimeout(None)
+            # Children left in the group may hold the pipes past the script's exit
+            capture.finish(max(0.0, deadline - time.monotonic()), kill)
+
+        if timed_out:
+            raise subprocess.TimeoutExpired(file_path, timeout)
+        stdout, stderr = capture.buffers
+        return stdout, stderr, returncode, child["overflowed"]
+
+    def close(self):
+        self.sock.close()
+        try:
+            self.process.wait(timeout=1)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+
+class WarmPool:
+    """Up to size warm workers for one working directory, started eagerly so
+    their imports overlap with the model's first turn."""
+
+    def __init__(self, working_directory, size):
+        self.working_directory = working_directory
+        self.idle = queue.Queue()
+        for _ in range(size):
+            self.idle.put(WarmWorker(working_directory))
+
+    def run(self, file_path, args, timeout, output_limit, kill_on_overflow=False):
+        worker = self.idle.get()
+        try:
+            if not worker.alive():
+                worker.close()
+                worker = WarmWorker(self.working_directory)
+            return worker.run(
+                file_path, args, self.working_directory, timeout, output_limit, kill_on_overflow
+            )
+        except (OSError, ValueError, KeyError):
+            # A broken worker is replaced rather than reused
+            worker.close()
+            worker = WarmWorker(self.working_directory)
+            raise
+        finally:
+            self.idle.put(worker)
+
+    def close(self):
+        while not self.idle.empty():
+            self.idle.get().close()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def pool_for(working_directory):
+    """Return the warm pool for working_directory, or None when disabled."""
+    if pool_size <= 0 or not available():
+        return None
+    working_directory = os.path.abspath(working_directory)
+    with _pools_lock:
+        pool = _pools.get(working_directory)
+        if pool is None:
+            pool = _pools[working_directory] = WarmPool(working_directory, pool_size)
+        return pool
+
+
+def close_pool(working_directory):
+    """Stop the workers of a working directory that is going away."""
+    with _pools_lock:
+        pool = _pools.pop(os.path.abspath(working_directory), None)
+    if pool is not None:
+        pool.close()
+
+
+def configure(size, working_directory=None):
+    """Set the pool size and optionally pre-start the pool for a directory."""
+    global pool_size
+    pool_size = size
+    if working_directory is not None:
+        pool_for(working_directory)
+
+
+@atexit.register
+def shutdown():
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
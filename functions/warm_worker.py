@@ -0,0 +1,91 @@
+"""Pre-warmed interpreter used by functions/warm_pool.py.
+
+Started as `python3 warm_worker.py FD MODULE...` inside the working
+directory. It imports the given modules once, then for every request on the
+socket FD forks a child that runs the requested script with the stdout and
+stderr pipes passed along with the request. Each script therefore starts
+from a clean copy of this process, with its own pid and process group.
+"""
+
+import importlib
+import json
+import os
+import runpy
+import socket
+import sys
+import traceback
+
+
+def run_script(request, stdout_fd, stderr_fd, ready_fd):
+    os.setsid()
+    os.close(ready_fd)
+    devnull = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(devnull, 0)
+    os.dup2(stdout_fd, 1)
+    os.dup2(stderr_fd, 2)
+    for fd in (devnull, stdout_fd, stderr_fd):
+        os.close(fd)
+
+    code = 0
+    try:
+        os.chdir(request["cwd"])
+        file_path = request["file_path"]
+        sys.argv = [file_path] + request["args"]
+        sys.path[0] = os.path.dirname(os.path.abspath(file_path))
+        runpy.run_path(file_path, run_name="__main__")
+    except SystemExit as e:
+        if e.code is None:
+            code = 0
+        elif isinstance(e.code, int):
+            code = e.code
+        else:
+            print(e.code, file=sys.stderr)
+            code = 1
+    except BaseException as e:
+        # Hide the worker and runpy frames, as a plain `python3 script.py` would
+        tb = e.__traceback__
+        while tb is not None and tb.tb_frame.f_code.co_filename != request["file_path"]:
+            tb = tb.tb_next
+        traceback.print_exception(type(e), e, tb or e.__traceback__)
+        code = 1
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        except Exception:
+            pass
+    os._exit(code)
+
+
+def main():
+    for module in sys.argv[2:]:
+        try:
+            importlib.import_module(module)
+        except Exception:
+            pass
+
+    sock = socket.socket(fileno=int(sys.argv[1]))
+    while True:
+        message, fds, _, _ = socket.recv_fds(sock, 65536, 2)
+        if not message:
+            break
+        request = json.loads(message)
+        ready_r, ready_w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            sock.close()
+            os.close(ready_r)
+            run_script(request, *fds, ready_w)
+        for fd in (*fds, ready_w):
+            os.close(fd)
+        # EOF once the child has called setsid(): only then can the parent
+        # kill its process group
+        os.read(ready_r, 1)
+        os.close(ready_r)
+        sock.send(json.dumps({"pid": pid}).encode())
+        _, status = os.waitpid(pid, 0)
+        sock.send(json.dumps({"returncode": os.waitstatus_to_exitcode(status)}).encode())
+
+
+if __name__ == "__main__":
+    main()
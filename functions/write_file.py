@@ -1,8 +1,57 @@
 import os
-from google.genai import types
+import tempfile
+from functions.cache import file_cache
+from functions.search_code import notify_written
+from functions.registry import tool
 
+# mkstemp creates 0600 files; new files get the usual umask-based mode instead.
+# Read once at import, since os.umask can only be read by setting it.
+_UMASK = os.umask(0)
+os.umask(_UMASK)
 
-def write_file(working_directory, file_path, content):
+
+def atomic_write(target_path_abs, content, newline=None):
+    """Write content to a temp file next to the target and rename it into
+    place, so readers never see a half-written file. Keeps the mode of an
+    existing target."""
+    directory = os.path.dirname(target_path_abs)
+    fd, temp_path = tempfile.mkstemp(
+        dir=directory, prefix=f".{os.path.basename(target_path_abs)}.", suffix=".tmp"
+    )
+    try:
+        with open(fd, "w", newline=newline) as f:
+            f.write(content)
+        if os.path.exists(target_path_abs):
+            os.chmod(temp_path, os.stat(target_path_abs).st_mode & 0o7777)
+        else:
+            os.chmod(temp_path, 0o666 & ~_UMASK)
+        os.replace(temp_path, target_path_abs)
+    except BaseException:
+        try:
+            os.unlink(temp_path)
+        except OSError:
+            pass
+        raise
+    after_write(target_path_abs)
+
+
+def after_write(target_path_abs):
+    """Bring caches and indexes up to date after a tool wrote a file."""
+    file_cache.invalidate(target_path_abs)
+    notify_written(target_path_abs)
+
+
+# Calls of any writing tool that target the same file_path run one at a
+# time, in call order.
+@tool(
+    "Writes or overwrites content to a file, constrained to the working directory.",
+    params={
+        "file_path": "The path to the file to write, relative to the working directory.",
+        "content": "The content to write to the file.",
+    },
+    parallel_safe=False,
+)
+def write_file(working_directory, file_path: str, content: str):
     try:
         working_directory_abs = os.path.abspath(working_directory)
         target_path_abs = os.path.abspath(
@@ -17,30 +66,10 @@ def write_file(working_directory, file_path, content):
         except Exception as e:
             return f"Error creating directories: {e}"
         try:
-            with open(target_path_abs, "w") as f:
-                f.write(content)
-                return f'Successfully wrote to "{file_path}" ({len(content)} characters written)'
+            atomic_write(target_path_abs, content)
+            return f'Successfully wrote to "{file_path}" ({len(content)} characters written)'
         except Exception:
             return "Error: write action unsuccessful."
     except Exception as e:
         return f"An unexpected error occurred: {e}"
 
-
-schema_write_file = types.FunctionDeclaration(
-    name="write_file",
-    description="Writes or overwrites content to a file, constrained to the working directory.",
-    parameters=types.Schema(
-        type=types.Type.OBJECT,
-        properties={
-            "file_path": types.Schema(
-                type=types.Type.STRING,
-                description="The path to the file to write, relative to the working directory.",
-            ),
-            "content": types.Schema(
-                type=types.Type.STRING,
-                description="The content to write to the file.",
-            ),
-        },
-        required=["file_path", "content"],
-    ),
-)
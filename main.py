@@ -1,11 +1,18 @@
-import os, sys, time, threading, argparse
+import os, sys, time, threading, argparse, json, shutil
+from functools import cache
 from dotenv import load_dotenv
-from google import genai
-from google.genai import types
-from functions.get_files_info import schema_get_files_info, get_files_info
-from functions.get_file_content import schema_get_file_content, get_file_content
-from functions.run_python_file import schema_run_python_file, run_python_file
-from functions.write_file import schema_write_file, write_file
+from functions.call_function import available_functions, call_functions, AsyncCallScheduler
+from functions.config import MAX_WORKERS, WARM_WORKERS, WORKING_DIRECTORY
+from functions import warm_pool
+from functions.cache import file_cache
+from functions.get_changes_since import START_CHECKPOINT, drop_manifest, manifest_for
+from functions.search_code import drop_index
+from functions.run_tests import drop_failures
+from backends import GenAIBackend, RecordingBackend, ReplayBackend
+from context import ContextManager
+from ratelimit import RateLimiter, RateLimitedBackend
+from tracing import Tracer
+from session_log import SESSIONS_DIR, SessionLog, load_session, new_session_id, session_path
 
 load_dotenv(dotenv_path="geminiapi.env")
 api_key = os.environ.get("GEMINI_API_KEY")
@@ -17,10 +24,14 @@ When a user asks a question or makes a request, you should use the available fun
 - List files and directories
 - Read file contents
 - Execute Python files with optional arguments
+- Run the tests (prefer this over executing test files), optionally only the ones that failed last time
 - Write or overwrite files
+- Edit part of a file with search/replace hunks or a unified diff (prefer this over rewriting a whole file)
+- Search the code for a string or regex
+- List the files changed since a checkpoint ("start" is taken when the session begins) instead of re-reading everything
 
 Work step by step:
-1. Gather information by listing files and reading relevant code
+1. Gather information by listing files, searching and reading relevant code
 2. Analyze what you've found
 3. Make any necessary changes
 4. Test your changes to ensure they work
@@ -30,71 +41,9 @@ All paths you provide should be relative to the working directory. You do not ne
 
 When you have completed your task and have a final answer or summary, respond with text (not a function call) to indicate you are finished. """
 
-available_functions = types.Tool(
-    function_declarations=[
-        schema_get_files_info,
-        schema_get_file_content,
-        schema_run_python_file,
-        schema_write_file,
-    ]
-)
-
-
-def call_function(function_call_part, verbose=False):
-    # Dictionary mapping function names to actual functions
-    function_map = {
-        "get_files_info": get_files_info,
-        "get_file_content": get_file_content,
-        "run_python_file": run_python_file,
-        "write_file": write_file,
-    }
-    
-    function_name = function_call_part.name
-    function_args = dict(function_call_part.args)
-    
-    # Print function call info
-    if verbose:
-        print(f"Calling function: {function_name}({function_args})")
-    else:
-        print(f" - Calling function: {function_name}")
-    
-    # Check if function name is valid
-    if function_name not in function_map:
-        return types.Content(
-            role="tool",
-            parts=[
-                types.Part.from_function_response(
-                    name=function_name,
-                    response={"error": f"Unknown function: {function_name}"},
-                )
-            ],
-        )
-    
-    # Add working_directory to the arguments
-    function_args["working_directory"] = "./calculator"
-    
-    # Call the function
-    try:
-        function_result = function_map[function_name](**function_args)
-        return types.Content(
-            role="tool",
-            parts=[
-                types.Part.from_function_response(
-                    name=function_name,
-                    response={"result": function_result},
-                )
-            ],
-        )
-    except Exception as e:
-        return types.Content(
-            role="tool",
-            parts=[
-                types.Part.from_function_response(
-                    name=function_name,
-                    response={"error": f"Error executing function: {str(e)}"},
-                )
-            ],
-        )
+MODEL = "gemini-2.5-flash"
+# Cheap tier for routine turns when --route is on; MODEL is the strong tier
+FAST_MODEL = "gemini-2.5-flash-lite"
 
 
 def spinner(message, stop_event):
@@ -110,119 +59,676 @@ def spinner(message, stop_event):
     sys.stdout.flush()
 
 
-def main():
-    print("Hello from python-ai-agent!")
+@cache
+def generate_config():
+    # Built, and the SDK imported, on the first model call rather than at startup
+    from google.genai import types
 
-    # argparse setup
-    parser = argparse.ArgumentParser(description="Python AI Agent (Gemini 2.0 Flash)")
-    parser.add_argument("prompt", nargs="*", help="User prompt for the AI")
-    parser.add_argument("--verbose", action="store_true", help="Enable verbose output")
-    args = parser.parse_args()
+    return types.GenerateContentConfig(
+        tools=[available_functions()], system_instruction=system_prompt
+    )
 
-    # prompt handling
-    if args.prompt:
-        prompt = " ".join(args.prompt)
-    else:
-        raw_input = input("Enter your prompt: ")
-        parts = raw_input.split()
-        if "--verbose" in parts:
-            args.verbose = True
-            parts.remove("--verbose")
-        prompt = " ".join(parts)
 
-    if prompt.strip() == "":
-        print("ERR: No prompt provided.")
-        sys.exit(1)
+def user_message(text):
+    from google.genai import types
+
+    return types.Content(role="user", parts=[types.Part(text=text)])
+
+
+def _silent(*args, **kwargs):
+    pass
+
+
+def _compact(context, messages, timings, verbose):
+    if context is None:
+        return messages
+    contents, saved = context.compact(messages)
+    timings["tokens_saved"] = saved
+    if verbose and saved:
+        print(f"Context compaction saved ~{saved} tokens")
+    return contents
+
+
+def _choose_model(router, messages, timings, verbose, say):
+    if router is None:
+        return MODEL, None
+    model, tier, reason = router.choose(messages)
+    timings["tier"] = tier
+    if verbose:
+        say(f"Routing to the {tier} tier ({model}): {reason}")
+    return model, tier
+
+
+def add_message(messages, content, session_log):
+    messages.append(content)
+    if session_log is not None:
+        session_log.append(content)
+
+
+def release_workspace(working_directory):
+    """Drop everything the tools keep per working directory (cached results,
+    search index, manifest, failed tests, warm workers) once a session there
+    is over."""
+    file_cache.invalidate_tree(working_directory)
+    drop_index(working_directory)
+    drop_manifest(working_directory)
+    drop_failures(working_directory)
+    warm_pool.close_pool(working_directory)
+
+
+def run_agent(backend, messages, verbose=False, max_workers=MAX_WORKERS, max_iterations=20, show_spinner=True, context=None, working_directory=WORKING_DIRECTORY, quiet=False, tracer=None, session_log=None, router=None, start_checkpoint=True):
+    """Run the agent loop on messages (extended in place) until the model
+    answers with text or max_iterations is reached. If a ContextManager is
+    given, each call sends its compacted view of messages instead.
+
+    Returns a dict with the final text (or None), the usage metadata of the
+    last response, per-iteration timings in seconds, the error that ended
+    the loop, if any, and the Tracer holding spans and cumulative token
+    counts for the run (a new one unless tracer is given). Tools run against
+    working_directory; quiet suppresses all printing. Every message added to
+    messages is also appended to session_log, if given. With a Router, each
+    iteration's model is the one it picks instead of MODEL. Without
+    start_checkpoint, the "start" checkpoint is left as it is, for callers
+    that run several turns of one session and took it when it began."""
+    tracer = tracer or Tracer()
+    result = {"text": None, "usage": None, "iterations": [], "error": None, "trace": tracer}
+    say = _silent if quiet else print
+    # "Unchanged since previous read" replies must not refer to another session
+    file_cache.invalidate_tree(working_directory)
+    if start_checkpoint:
+        manifest_for(working_directory).checkpoint(START_CHECKPOINT)
 
-    messages = [types.Content(role="user", parts=[types.Part(text=prompt)])]
-    client = genai.Client(api_key=api_key)
-    
-    # Main agent loop - up to 20 iterations
-    max_iterations = 20
-    
     for iteration in range(max_iterations):
+        iteration_start = time.perf_counter()
+        timings = {"iteration": iteration + 1, "model": 0.0, "tools": 0.0}
+        result["iterations"].append(timings)
         try:
+            contents = _compact(context, messages, timings, verbose and not quiet)
+            model, tier = _choose_model(router, messages, timings, verbose, say)
+
             # spinner
-            stop_event = threading.Event()
-            spinner_thread = threading.Thread(
-                target=spinner,
-                args=("Processing your request ", stop_event),
-            )
-            spinner_thread.start()
-            
+            if show_spinner and not quiet:
+                stop_event = threading.Event()
+                spinner_thread = threading.Thread(
+                    target=spinner,
+                    args=("Processing your request ", stop_event),
+                )
+                spinner_thread.start()
+
             # API call
-            response = client.models.generate_content(
-                model="gemini-2.5-flash",
-                contents=messages,
-                config=types.GenerateContentConfig(
-                    tools=[available_functions], system_instruction=system_prompt
-                ),
-            )
-            
-            # stop spinner
-            stop_event.set()
-            spinner_thread.join()
-            
+            try:
+                model_start = time.perf_counter()
+                response = backend.generate_content(
+                    model=model,
+                    contents=contents,
+                    config=generate_config(),
+                )
+                model_end = time.perf_counter()
+                timings["model"] = model_end - model_start
+            finally:
+                # stop spinner
+                if show_spinner and not quiet:
+                    stop_event.set()
+                    spinner_thread.join()
+            result["usage"] = response.usage_metadata
+            usage = tracer.add_usage(response.usage_metadata)
+            tracer.record("model", model, model_start, model_end, **usage)
+            if router is not None:
+                router.record(tier, model_end - model_start, usage)
+
             # Check if we have candidates
             if not response.candidates:
-                print("No response candidates received")
+                say("No response candidates received")
                 break
                 
             candidate = response.candidates[0]
             
             # Add the model's response to the conversation
-            messages.append(candidate.content)
+            add_message(messages, candidate.content, session_log)
             
-            # Check if the response contains text (final response)
-            if response.text:
-                print("Final response:")
-                print(response.text)
+            # Check if the response contains text (final response). Read the
+            # parts directly: response.text logs a warning on every tool turn.
+            text = "".join(
+                part.text for part in candidate.content.parts or [] if part.text and not part.thought
+            )
+            if text:
+                say("Final response:")
+                say(text)
+                result["text"] = text
                 break
                 
             # Process any function calls
-            has_function_calls = False
-            tool_responses = []
-            
-            if candidate.content.parts:
-                for part in candidate.content.parts:
-                    if hasattr(part, 'function_call') and part.function_call:
-                        has_function_calls = True
-                        function_call_result = call_function(part.function_call, args.verbose)
-                        
-                        # Validate the result has the expected structure
-                        if not (hasattr(function_call_result, 'parts') and 
-                               len(function_call_result.parts) > 0 and 
-                               hasattr(function_call_result.parts[0], 'function_response') and
-                               hasattr(function_call_result.parts[0].function_response, 'response')):
-                            raise Exception("Invalid function call result structure")
-                        
-                        # Print the result if verbose
-                        if args.verbose:
-                            print(f"-> {function_call_result.parts[0].function_response.response}")
-                            
-                        tool_responses.append(function_call_result)
-            
+            function_call_parts = [
+                part.function_call
+                for part in candidate.content.parts or []
+                if hasattr(part, 'function_call') and part.function_call
+            ]
+            has_function_calls = bool(function_call_parts)
+            tools_start = time.perf_counter()
+            tool_responses = call_functions(
+                function_call_parts, verbose, max_workers, working_directory, quiet, tracer
+            )
+            timings["tools"] = time.perf_counter() - tools_start
+
+            for function_call_result in tool_responses:
+                # Validate the result has the expected structure
+                if not (hasattr(function_call_result, 'parts') and 
+                       len(function_call_result.parts) > 0 and 
+                       hasattr(function_call_result.parts[0], 'function_response') and
+                       hasattr(function_call_result.parts[0].function_response, 'response')):
+                    raise Exception("Invalid function call result structure")
+
+                # Print the result if verbose
+                if verbose:
+                    say(f"-> {function_call_result.parts[0].function_response.response}")
+
             # If there were function calls, add their responses to the conversation
             if has_function_calls:
                 for tool_response in tool_responses:
-                    messages.append(tool_response)
+                    add_message(messages, tool_response, session_log)
             else:
                 # If no function calls and no text, something went wrong
-                print("No function calls or text response received")
+                say("No function calls or text response received")
                 break
                 
         except Exception as e:
-            print(f"Error during iteration {iteration + 1}: {e}")
+            result["error"] = f"Error during iteration {iteration + 1}: {e}"
+            say(result["error"])
             break
-    
-    if iteration == max_iterations - 1:
-        print(f"Reached maximum iterations ({max_iterations}) without completion")
+        finally:
+            iteration_end = time.perf_counter()
+            timings["total"] = iteration_end - iteration_start
+            tracer.record("iteration", f"iteration {iteration + 1}", iteration_start, iteration_end)
+    else:
+        say(f"Reached maximum iterations ({max_iterations}) without completion")
+
+    return result
+
+
+def _merge_text_parts(parts):
+    from google.genai import types
+
+    # Streamed text arrives in many small parts; keep one part per text run
+    merged = []
+    for part in parts:
+        if part.text is not None and merged and merged[-1].text is not None and not part.thought:
+            merged[-1] = types.Part(text=merged[-1].text + part.text)
+        else:
+            merged.append(part)
+    return merged
+
+
+async def run_agent_async(backend, messages, verbose=False, max_workers=MAX_WORKERS, max_iterations=20, context=None, working_directory=WORKING_DIRECTORY, quiet=False, tracer=None, session_log=None, router=None):
+    """Streaming variant of run_agent.
+
+    Text is printed as it streams in, and each function call is started as
+    soon as its part has arrived instead of after the whole turn. Returns the
+    same kind of dict as run_agent."""
+    from google.genai import types
+
+    tracer = tracer or Tracer()
+    result = {"text": None, "usage": None, "iterations": [], "error": None, "trace": tracer}
+    say = _silent if quiet else print
+    file_cache.invalidate_tree(working_directory)
+    manifest_for(working_directory).checkpoint(START_CHECKPOINT)
+
+    for iteration in range(max_iterations):
+        iteration_start = time.perf_counter()
+        timings = {"iteration": iteration + 1, "model": 0.0, "tools": 0.0}
+        result["iterations"].append(timings)
+        scheduler = AsyncCallScheduler(verbose, max_workers, working_directory, quiet, tracer)
+        try:
+            model_parts = []
+            text = ""
+            usage = None
+            first_chunk = None
+
+            contents = _compact(context, messages, timings, verbose and not quiet)
+            model, tier = _choose_model(router, messages, timings, verbose, say)
+            model_start = time.perf_counter()
+            async for chunk in backend.generate_content_stream(
+                model=model,
+                contents=contents,
+                config=generate_config(),
+            ):
+                if first_chunk is None:
+                    first_chunk = time.perf_counter() - model_start
+                if chunk.usage_metadata:
+                    result["usage"] = usage = chunk.usage_metadata
+                if not chunk.candidates or not chunk.candidates[0].content:
+                    continue
+                for part in chunk.candidates[0].content.parts or []:
+                    model_parts.append(part)
+                    if part.function_call:
+                        scheduler.submit(part.function_call)
+                    elif part.text and not part.thought:
+                        if not quiet:
+                            sys.stdout.write(part.text)
+                            sys.stdout.flush()
+                        text += part.text
+            model_end = time.perf_counter()
+            timings["model"] = model_end - model_start
+            # Tool calls started mid-stream overlap this span on the timeline
+            usage = tracer.add_usage(usage)
+            tracer.record(
+                "model", model, model_start, model_end,
+                first_chunk_seconds=first_chunk, **usage
+            )
+            if router is not None:
+                router.record(tier, model_end - model_start, usage)
+            if text:
+                say()
+
+            if not model_parts:
+                say("No response candidates received")
+                break
+
+            # Add the model's response to the conversation
+            add_message(
+                messages,
+                types.Content(role="model", parts=_merge_text_parts(model_parts)),
+                session_log,
+            )
+
+            tools_start = time.perf_counter()
+            tool_responses = await scheduler.results()
+            timings["tools"] = time.perf_counter() - tools_start
+            if not tool_responses:
+                if text:
+                    result["text"] = text
+                else:
+                    say("No function calls or text response received")
+                break
+
+            for function_call_result in tool_responses:
+                if verbose:
+                    say(f"-> {function_call_result.parts[0].function_response.response}")
+                add_message(messages, function_call_result, session_log)
+
+        except Exception as e:
+            result["error"] = f"Error during iteration {iteration + 1}: {e}"
+            say(result["error"])
+            break
+        finally:
+            # Calls started before the stream failed must not outlive the run
+            await scheduler.cancel()
+            iteration_end = time.perf_counter()
+            timings["total"] = iteration_end - iteration_start
+            tracer.record("iteration", f"iteration {iteration + 1}", iteration_start, iteration_end)
+    else:
+        say(f"Reached maximum iterations ({max_iterations}) without completion")
+
+    return result
+
+
+def _load_batch(path):
+    # One JSON object per line: {"prompt": ..., "id": ..., "working_directory": ...};
+    # only prompt is required.
+    tasks = []
+    with open(path) as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            task = json.loads(line)
+            if isinstance(task, str):
+                task = {"prompt": task}
+            task.setdefault("id", str(line_number))
+            tasks.append(task)
+    return tasks
+
+
+def run_batch(backend, args):
+    """Run every prompt of a JSONL file as its own agent session, up to
+    args.concurrency at a time in this process. All sessions share backend
+    (one client and connection pool); each gets its own working directory,
+    under a directory of args.batch_root new to this run, so reruns never
+    collide with what earlier ones left. Results are appended to
+    args.output as NDJSON as soon as a session ends."""
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+
+    tasks = _load_batch(args.batch)
+    output_lock = threading.Lock()
+    router = build_router(args)
+    run_root = os.path.join(args.batch_root, new_session_id())
+
+    def run_session(task):
+        working_directory = task.get("working_directory")
+        if working_directory is None:
+            working_directory = os.path.join(run_root, str(task["id"]))
+            shutil.copytree(
+                WORKING_DIRECTORY,
+                working_directory,
+                ignore=shutil.ignore_patterns("__pycache__"),
+            )
+        context = None
+        if args.token_budget is not None:
+            context = ContextManager(
+                args.token_budget,
+                keep_recent=args.keep_recent,
+                working_directory=working_directory,
+            )
+        messages = [user_message(task["prompt"])]
+        start = time.perf_counter()
+        try:
+            result = run_agent(
+                backend,
+                messages,
+                max_workers=args.max_workers,
+                context=context,
+                working_directory=working_directory,
+                quiet=True,
+                router=router,
+            )
+        finally:
+            release_workspace(working_directory)
+        tokens = result["trace"].tokens
+        return {
+            "id": task["id"],
+            "working_directory": working_directory,
+            "text": result["text"],
+            "error": result["error"],
+            "iterations": len(result["iterations"]),
+            "seconds": round(time.perf_counter() - start, 3),
+            "prompt_tokens": tokens["prompt"],
+            "response_tokens": tokens["response"],
+            "cached_tokens": tokens["cached"],
+        }
+
+    os.makedirs(run_root)
+    completed = 0
+    with open(args.output, "a") as output, ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        futures = {executor.submit(run_session, task): task for task in tasks}
+        for future in as_completed(futures):
+            try:
+                record = future.result()
+            except Exception as e:
+                record = {"id": futures[future]["id"], "error": f"Session failed: {e}"}
+            with output_lock:
+                output.write(json.dumps(record) + "\n")
+                output.flush()
+            completed += 1
+            status = "error" if record.get("error") else "ok"
+            print(f"[{completed}/{len(tasks)}] {record['id']}: {status}")
+    if router is not None:
+        print(router.summary())
+
+
+def add_backend_arguments(parser):
+    """Options read by build_backend, shared with server.py."""
+    parser.add_argument("--record", metavar="CASSETTE", help="Append every model request and response to CASSETTE")
+    parser.add_argument("--replay", metavar="CASSETTE", help="Serve model responses from CASSETTE instead of Gemini")
+    parser.add_argument(
+        "--replay-latency",
+        type=float,
+        default=0.0,
+        metavar="SECONDS",
+        help="Fake latency added to each replayed response",
+    )
+    parser.add_argument(
+        "--max-attempts",
+        type=int,
+        default=4,
+        help="Attempts per model call when Gemini fails with a retryable error (1 disables retries)",
+    )
+    parser.add_argument("--deadline", type=float, default=120.0, metavar="SECONDS", help="Time a model call may take, retries included")
+    parser.add_argument("--attempt-timeout", type=float, metavar="SECONDS", help="Time a single attempt may take before it is retried")
+    parser.add_argument(
+        "--hedge",
+        action="store_true",
+        help="Send a duplicate request when a model call is slower than the p95 of recent calls, and use whichever answers first",
+    )
+    parser.add_argument(
+        "--hedge-after",
+        type=float,
+        default=2.0,
+        metavar="SECONDS",
+        help="Hedge delay used until enough latencies are known for the p95",
+    )
+    parser.add_argument("--rpm", type=int, help="Global limit on model requests per minute")
+    parser.add_argument("--tpm", type=int, help="Global limit on model tokens per minute")
+    parser.add_argument("--cache", metavar="PATH", help="Serve repeated model requests from, and store responses in, the SQLite file PATH")
+    parser.add_argument("--cache-max-mb", type=float, default=100, help="Evict least recently used cached responses above this size")
+    parser.add_argument("--cache-ttl", type=float, default=7 * 24 * 3600, metavar="SECONDS", help="Age after which a cached response is ignored")
+
+
+def add_router_arguments(parser):
+    """Options read by build_router, shared with server.py."""
+    parser.add_argument(
+        "--route",
+        action="store_true",
+        help="Send routine turns (after listing, reading or searching) to --fast-model and the rest to --strong-model",
+    )
+    parser.add_argument("--fast-model", default=FAST_MODEL, help="Model of the fast tier used by --route")
+    parser.add_argument("--strong-model", default=MODEL, help="Model of the strong tier used by --route")
+
+
+def build_router(args):
+    if not args.route:
+        return None
+    from routing import Router
+
+    return Router(args.fast_model, args.strong_model)
+
+
+def _print_backend_counters(backend):
+    # Walk the wrapper chain build_backend made for the layers' counters
+    while backend is not None:
+        if hasattr(backend, "cache"):
+            print(f"Response cache: {backend.cache.hits} hits, {backend.cache.misses} misses")
+        if hasattr(backend, "counters"):
+            print(f"Model calls: {backend.summary()}")
+        backend = getattr(backend, "backend", None)
+
+
+def build_backend(args, workspace=None):
+    """Build the model backend the options of add_backend_arguments
+    describe. workspace is the directory --cache hits must match, if any."""
+    limiter = RateLimiter(args.rpm, args.tpm) if args.rpm or args.tpm else None
+    if args.replay:
+        backend = ReplayBackend(args.replay, latency=args.replay_latency)
+        if limiter is not None:
+            backend = RateLimitedBackend(backend, limiter)
+    else:
+        from resilience import ResilientBackend
+
+        # Takes a permit from the limiter for every request it sends,
+        # retries and hedges included
+        backend = ResilientBackend(
+            GenAIBackend(api_key=api_key),
+            max_attempts=args.max_attempts,
+            deadline=args.deadline,
+            attempt_timeout=args.attempt_timeout,
+            hedge=args.hedge,
+            hedge_after=args.hedge_after,
+            limiter=limiter,
+        )
+    if args.record:
+        # Outside the retries, so a recording holds only the answer that won
+        backend = RecordingBackend(backend, args.record)
+    if args.cache:
+        # Outermost, so hits skip the rate limiter and the recording
+        from response_cache import ResponseCache, CachedBackend
+
+        cache = ResponseCache(
+            args.cache,
+            max_bytes=int(args.cache_max_mb * 1024 * 1024),
+            ttl=args.cache_ttl,
+        )
+        backend = CachedBackend(backend, cache, workspace)
+    return backend
+
+
+def main():
+    print("Hello from python-ai-agent!")
+
+    # argparse setup
+    parser = argparse.ArgumentParser(description="Python AI Agent (Gemini 2.0 Flash)")
+    parser.add_argument("prompt", nargs="*", help="User prompt for the AI")
+    parser.add_argument("--verbose", action="store_true", help="Enable verbose output")
+    parser.add_argument(
+        "--max-workers",
+        type=int,
+        default=MAX_WORKERS,
+        help="Maximum number of function calls from one turn to run concurrently (1 runs them sequentially)",
+    )
+    parser.add_argument("--max-iterations", type=int, default=20, help="Maximum number of model turns in this run")
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Use the async streaming loop: print text as it arrives and start function calls mid-turn",
+    )
+    parser.add_argument(
+        "--token-budget",
+        type=int,
+        metavar="TOKENS",
+        help="Compact the context sent to the model: elide stale tool results and shorten old ones to fit TOKENS",
+    )
+    parser.add_argument(
+        "--keep-recent",
+        type=int,
+        default=6,
+        help="Number of most recent messages that context compaction never touches",
+    )
+    parser.add_argument(
+        "--warm-workers",
+        type=int,
+        default=WARM_WORKERS,
+        help="Run scripts by forking from N pre-warmed Python workers instead of starting python3 each time",
+    )
+    parser.add_argument("--batch", metavar="PROMPTS_JSONL", help="Run every prompt in PROMPTS_JSONL as its own concurrent session")
+    parser.add_argument("--output", default="batch_results.ndjson", help="NDJSON file batch results are appended to")
+    parser.add_argument("--concurrency", type=int, default=8, help="Number of batch sessions run at once")
+    parser.add_argument(
+        "--batch-root",
+        default="batch_runs",
+        help="Directory holding one directory per batch run, where each session without its own working_directory gets a copy of ./calculator",
+    )
+    add_backend_arguments(parser)
+    add_router_arguments(parser)
+    parser.add_argument(
+        "--cache-check-workspace",
+        action="store_true",
+        help="Only count a cache hit if the working directory's content also matches what it was when the response was stored",
+    )
+    parser.add_argument("--resume", metavar="SESSION", help="Continue a logged session (an id or a log path) with a fresh iteration budget")
+    parser.add_argument("--sessions-dir", default=SESSIONS_DIR, help="Directory holding the session logs")
+    parser.add_argument("--trace", metavar="PATH", help="Write the spans and token totals of the run to PATH as JSON")
+    parser.add_argument(
+        "--trace-format",
+        choices=["json", "chrome"],
+        default="json",
+        help="Format of --trace: our own JSON, or Chrome trace events for chrome://tracing and Perfetto",
+    )
+    parser.add_argument("--summary", action="store_true", help="Print a table of time and tokens per span kind at the end")
+    args = parser.parse_args()
+    if args.batch and args.cache_check_workspace:
+        # Batch sessions each work in their own copy of the workspace
+        parser.error("--cache-check-workspace cannot be used with --batch")
+
+    if args.batch:
+        # Batch sessions each get a warm pool for their own directory on first use
+        warm_pool.configure(args.warm_workers)
+        run_batch(build_backend(args), args)
+        return
+
+    # prompt handling
+    if args.prompt:
+        prompt = " ".join(args.prompt)
+    elif args.resume:
+        # A resumed session carries on from its log; a prompt is optional
+        prompt = ""
+    else:
+        raw_input = input("Enter your prompt: ")
+        parts = raw_input.split()
+        if "--verbose" in parts:
+            args.verbose = True
+            parts.remove("--verbose")
+        prompt = " ".join(parts)
+
+    if prompt.strip() == "" and not args.resume:
+        print("ERR: No prompt provided.")
+        sys.exit(1)
+
+    if args.resume:
+        session_id = args.resume
+        log_path = session_path(args.resume, args.sessions_dir)
+        if not os.path.isfile(log_path):
+            print(f"ERR: No session log at {log_path}.")
+            sys.exit(1)
+    else:
+        session_id = new_session_id()
+        log_path = session_path(session_id, args.sessions_dir)
+
+    # Only now, with a prompt to send, pay for the SDK and the client
+    backend = build_backend(args, WORKING_DIRECTORY if args.cache_check_workspace else None)
+    if args.resume:
+        messages, dropped = load_session(log_path)
+        if not messages:
+            print(f"ERR: Session log at {log_path} holds no readable messages.")
+            sys.exit(1)
+        print(f"Resuming session {session_id}: {len(messages)} messages restored")
+        if dropped:
+            print(f"Dropped {dropped} messages of an unfinished turn; the model will be asked again")
+        session_log = SessionLog(log_path, messages)
+        last = messages[-1]
+        finished = last.role == "model" and not any(part.function_call for part in last.parts or [])
+        if prompt.strip():
+            add_message(messages, user_message(prompt), session_log)
+        elif finished:
+            print("ERR: Session already finished; give a prompt to continue it.")
+            sys.exit(1)
+    else:
+        session_log = SessionLog(log_path)
+        messages = []
+        add_message(messages, user_message(prompt), session_log)
+    if args.verbose:
+        print(f"Session log: {log_path}")
+
+    if args.warm_workers > 0:
+        # Start the workers now so their imports overlap the first model call
+        warm_pool.configure(args.warm_workers, WORKING_DIRECTORY)
+
+    context = None
+    if args.token_budget is not None:
+        context = ContextManager(args.token_budget, keep_recent=args.keep_recent)
+
+    router = build_router(args)
+
+    # Main agent loop - a fresh budget of --max-iterations, also when resuming
+    options = dict(
+        context=context,
+        max_iterations=args.max_iterations,
+        session_log=session_log,
+        router=router,
+    )
+    if args.stream:
+        import asyncio
+
+        result = asyncio.run(
+            run_agent_async(backend, messages, args.verbose, args.max_workers, **options)
+        )
+    else:
+        result = run_agent(backend, messages, args.verbose, args.max_workers, **options)
+    session_log.close()
+    if result["text"] is None:
+        print(f"Session {session_id} ended without a final answer; continue it with --resume {session_id}")
 
-    usage = response.usage_metadata
-    if args.verbose and usage:
+    tracer = result["trace"]
+    if args.verbose:
         print(f"User prompt: {prompt}")
-        print(f"Prompt tokens: {usage.prompt_token_count}")
-        print(f"Response tokens: {usage.candidates_token_count}")
+        print(f"Prompt tokens: {tracer.tokens['prompt']}")
+        print(f"Response tokens: {tracer.tokens['response']}")
+        print(f"Cached tokens: {tracer.tokens['cached']}")
+    if args.verbose and context is not None:
+        print(f"Tokens saved by compaction: {sum(context.history)}")
+    if args.verbose:
+        _print_backend_counters(backend)
+    if (args.verbose or args.summary) and router is not None:
+        print(router.summary())
+    if args.summary:
+        print(tracer.summary())
+    if args.trace:
+        tracer.write(args.trace, args.trace_format)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,116 @@
+import threading
+import time
+from backends import ModelBackend
+from context import estimate_tokens
+
+
+class RateLimiter:
+    """Thread-safe token buckets for requests and tokens per minute.
+
+    acquire() blocks until one request and the estimated number of tokens
+    are available, and try_acquire() takes them only if they are available
+    now; settle() corrects the token bucket once the real usage of that
+    request is known. A limit of None disables that bucket."""
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._requests = float(requests_per_minute or 0)
+        self._tokens = float(tokens_per_minute or 0)
+        self._updated = time.monotonic()
+        self._condition = threading.Condition()
+        self.waited = 0.0
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._updated
+        self._updated = now
+        if self.requests_per_minute:
+            self._requests = min(
+                self.requests_per_minute,
+                self._requests + elapsed * self.requests_per_minute / 60,
+            )
+        if self.tokens_per_minute:
+            self._tokens = min(
+                self.tokens_per_minute,
+                self._tokens + elapsed * self.tokens_per_minute / 60,
+            )
+
+    def _wait_time(self, tokens):
+        wait = 0.0
+        if self.requests_per_minute and self._requests < 1:
+            wait = (1 - self._requests) * 60 / self.requests_per_minute
+        if self.tokens_per_minute:
+            # A single request larger than the whole bucket waits for a full one
+            needed = min(tokens, self.tokens_per_minute)
+            if self._tokens < needed:
+                wait = max(wait, (needed - self._tokens) * 60 / self.tokens_per_minute)
+        return wait
+
+    def _take(self, tokens):
+        if self.requests_per_minute:
+            self._requests -= 1
+        if self.tokens_per_minute:
+            self._tokens -= tokens
+
+    def acquire(self, tokens=0):
+        """Take a request and tokens, waiting as needed; returns the seconds
+        spent waiting."""
+        start = time.monotonic()
+        with self._condition:
+            while True:
+                self._refill()
+                wait = self._wait_time(tokens)
+                if wait <= 0:
+                    break
+                self._condition.wait(wait)
+            self._take(tokens)
+            waited = time.monotonic() - start
+            self.waited += waited
+        return waited
+
+    def try_acquire(self, tokens=0):
+        with self._condition:
+            self._refill()
+            if self._wait_time(tokens) > 0:
+                return False
+            self._take(tokens)
+            return True
+
+    def settle(self, estimated, actual):
+        if not self.tokens_per_minute or actual is None:
+            return
+        with self._condition:
+            self._tokens += estimated - actual
+            self._condition.notify_all()
+
+
+class RateLimitedBackend(ModelBackend):
+    """Routes every call of a shared backend through one RateLimiter."""
+
+    def __init__(self, backend, limiter):
+        self.backend = backend
+        self.limiter = limiter
+
+    def generate_content(self, *, model, contents, config=None):
+        estimated = sum(estimate_tokens(content) for content in contents)
+        self.limiter.acquire(estimated)
+        response = self.backend.generate_content(
+            model=model, contents=contents, config=config
+        )
+        usage = response.usage_metadata
+        self.limiter.settle(estimated, usage.total_token_count if usage else None)
+        return response
+
+    async def generate_content_stream(self, *, model, contents, config=None):
+        import asyncio
+
+        estimated = sum(estimate_tokens(content) for content in contents)
+        await asyncio.to_thread(self.limiter.acquire, estimated)
+        usage = None
+        async for chunk in self.backend.generate_content_stream(
+            model=model, contents=contents, config=config
+        ):
+            usage = chunk.usage_metadata or usage
+            yield chunk
+        self.limiter.settle(estimated, usage.total_token_count if usage else None)
@@ -0,0 +1,238 @@
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from backends import ModelBackend
+from context import estimate_tokens
+
+# HTTP statuses worth another attempt: timeouts, rate limits, server errors
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+# Number of recent successful latencies the hedge delay is taken from
+LATENCY_WINDOW = 200
+# Until this many latencies are known, hedges wait hedge_after seconds
+MIN_LATENCY_SAMPLES = 20
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+def is_retryable(error):
+    """True for errors another attempt may not hit: retryable HTTP statuses,
+    connection failures and timeouts. Client errors such as a bad request
+    or a rejected key fail the same way every time."""
+    code = getattr(error, "code", None)
+    if isinstance(code, int):
+        return code in RETRYABLE_STATUS
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    try:
+        import httpx
+    except ImportError:
+        return False
+    return isinstance(error, httpx.TransportError)
+
+
+class ResilientBackend(ModelBackend):
+    """Retries, deadlines and hedging around another backend.
+
+    Each call must finish within deadline seconds, and each attempt within
+    attempt_timeout (default: what is left of the deadline). Retryable
+    failures (see is_retryable) are retried up to max_attempts in total,
+    after full-jitter exponential backoff: a random sleep of up to
+    backoff * 2**n seconds, capped at max_backoff.
+
+    With hedge, an attempt that has not answered after the p95 of recent
+    latencies (hedge_after until enough are known) gets a duplicate request,
+    and whichever answers first wins. An abandoned attempt cannot be
+    cancelled; it finishes in the background and its result is dropped.
+
+    With a RateLimiter, every request, retries and hedges included, takes
+    a permit from it. An attempt's permit is taken before its clock starts,
+    and time spent waiting for permits counts against neither the deadline
+    nor attempt_timeout. A hedge is only sent if a permit is free at once;
+    otherwise the attempt goes unhedged, so a throttled duplicate never
+    reaches the API after the race is decided.
+
+    Streams are retried only until their first chunk arrives, and are not
+    hedged. counters holds calls, retries, hedges, hedge_wins (the
+    duplicate answered first), hedges_skipped (no permit was free),
+    timeouts and failures."""
+
+    def __init__(
+        self,
+        backend,
+        max_attempts=4,
+        deadline=120.0,
+        attempt_timeout=None,
+        backoff=0.5,
+        max_backoff=8.0,
+        hedge=False,
+        hedge_after=2.0,
+        max_threads=32,
+        limiter=None,
+    ):
+        self.backend = backend
+        self.limiter = limiter
+        self.max_attempts = max_attempts
+        self.deadline = deadline
+        self.attempt_timeout = attempt_timeout
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.hedge = hedge
+        self.hedge_after = hedge_after
+        self.counters = {
+            "calls": 0,
+            "retries": 0,
+            "hedges": 0,
+            "hedge_wins": 0,
+            "hedges_skipped": 0,
+            "timeouts": 0,
+            "failures": 0,
+        }
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_threads, thread_name_prefix="model-call")
+        self._random = random.Random()
+
+    def _count(self, counter):
+        with self._lock:
+            self.counters[counter] += 1
+
+    def hedge_delay(self):
+        with self._lock:
+            latencies = sorted(self.latencies)
+        if len(latencies) < MIN_LATENCY_SAMPLES:
+            return self.hedge_after
+        return latencies[int(0.95 * (len(latencies) - 1))]
+
+    def _estimate(self, contents):
+        if self.limiter is None:
+            return 0
+        return sum(estimate_tokens(content) for content in contents)
+
+    def _acquire(self, estimated):
+        # Seconds spent waiting for a permit
+        return 0.0 if self.limiter is None else self.limiter.acquire(estimated)
+
+    def _settle(self, estimated, usage):
+        if self.limiter is not None:
+            self.limiter.settle(estimated, usage.total_token_count if usage else None)
+
+    def _backoff_delay(self, retry):
+        return self._random.uniform(0, min(self.max_backoff, self.backoff * 2**retry))
+
+    def _attempt(self, call, timeout, estimated=0):
+        # One attempt, hedged if enabled: returns the first successful
+        # answer, or raises the last error once every request has failed.
+        # The caller holds the permit for the first request.
+        start = time.monotonic()
+        pending = {self._executor.submit(call)}
+        hedge = None
+        error = None
+        while pending:
+            elapsed = time.monotonic() - start
+            if elapsed >= timeout:
+                self._count("timeouts")
+                raise DeadlineExceeded(f"model call took longer than {timeout:.1f}s")
+            wait_for = timeout - elapsed
+            hedge_due = self.hedge and hedge is None
+            if hedge_due:
+                wait_for = min(wait_for, max(0.0, self.hedge_delay() - elapsed))
+            done, pending = wait(pending, timeout=wait_for, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    with self._lock:
+                        self.latencies.append(time.monotonic() - start)
+                        if future is hedge:
+                            self.counters["hedge_wins"] += 1
+                    return future.result()
+                error = future.exception()
+            if not done and hedge_due and time.monotonic() - start < timeout:
+                if self.limiter is None or self.limiter.try_acquire(estimated):
+                    hedge = self._executor.submit(call)
+                    pending.add(hedge)
+                    self._count("hedges")
+                else:
+                    hedge = False
+                    self._count("hedges_skipped")
+        raise error
+
+    def generate_content(self, *, model, contents, config=None):
+        self._count("calls")
+        estimated = self._estimate(contents)
+
+        def call():
+            response = self.backend.generate_content(model=model, contents=contents, config=config)
+            self._settle(estimated, response.usage_metadata)
+            return response
+
+        start = time.monotonic()
+        waited = 0.0
+        attempt = 0
+        while True:
+            waited += self._acquire(estimated)
+            remaining = self.deadline - (time.monotonic() - start - waited)
+            timeout = min(remaining, self.attempt_timeout or remaining)
+            try:
+                return self._attempt(call, timeout, estimated)
+            except Exception as e:
+                attempt += 1
+                remaining = self.deadline - (time.monotonic() - start - waited)
+                delay = self._backoff_delay(attempt - 1)
+                if attempt >= self.max_attempts or not is_retryable(e) or delay >= remaining:
+                    self._count("failures")
+                    raise
+                self._count("retries")
+                time.sleep(delay)
+
+    async def generate_content_stream(self, *, model, contents, config=None):
+        import asyncio
+
+        self._count("calls")
+        estimated = self._estimate(contents)
+        start = time.monotonic()
+        waited = 0.0
+        attempt = 0
+        while True:
+            if self.limiter is not None:
+                waited += await asyncio.to_thread(self.limiter.acquire, estimated)
+            remaining = self.deadline - (time.monotonic() - start - waited)
+            timeout = min(remaining, self.attempt_timeout or remaining)
+            attempt_start = time.monotonic()
+            stream = self.backend.generate_content_stream(
+                model=model, contents=contents, config=config
+            )
+            try:
+                first = await asyncio.wait_for(anext(stream), timeout)
+                break
+            except StopAsyncIteration:
+                return
+            except Exception as e:
+                await stream.aclose()
+                if isinstance(e, asyncio.TimeoutError):
+                    self._count("timeouts")
+                attempt += 1
+                remaining = self.deadline - (time.monotonic() - start - waited)
+                delay = self._backoff_delay(attempt - 1)
+                if attempt >= self.max_attempts or not is_retryable(e) or delay >= remaining:
+                    self._count("failures")
+                    raise
+                self._count("retries")
+                await asyncio.sleep(delay)
+        with self._lock:
+            self.latencies.append(time.monotonic() - attempt_start)
+        usage = first.usage_metadata
+        yield first
+        async for chunk in stream:
+            usage = chunk.usage_metadata or usage
+            yield chunk
+        self._settle(estimated, usage)
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.counters)
+
+    def summary(self):
+        return ", ".join(f"{name} {value}" for name, value in self.snapshot().items())
@@ -0,0 +1,140 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from backends import ModelBackend, dump_model, load_responses, merge_chunks
+from functions.get_changes_since import WorkspaceManifest
+
+
+def request_key(model, contents, config=None):
+    """Stable hash of everything that determines a response: the model, the
+    config (system prompt, tool schemas, generation settings) and the
+    conversation so far."""
+    request = {
+        "model": model,
+        "config": dump_model(config) if config is not None else None,
+        "contents": [dump_model(content) for content in contents],
+    }
+    encoded = json.dumps(request, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+class ResponseCache:
+    """SQLite store of model responses keyed on request_key.
+
+    Entries older than ttl seconds are treated as missing. Once the stored
+    responses exceed max_bytes, the least recently used entries are evicted.
+    If an entry was stored with a workspace digest, a lookup only hits when
+    it is given the same digest."""
+
+    def __init__(self, path, max_bytes=100 * 1024 * 1024, ttl=7 * 24 * 3600):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY,"
+            " workspace TEXT,"
+            " created REAL NOT NULL,"
+            " accessed REAL NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " response TEXT NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+
+    def get(self, key, workspace=None):
+        """Return the stored list of dumped chunks, or None."""
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT workspace, created, response FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and self.ttl is not None and now - row[1] > self.ttl:
+                self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                row = None
+            if row is None or (workspace is not None and row[0] != workspace):
+                self.misses += 1
+                return None
+            self._db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self.hits += 1
+        return json.loads(row[2])
+
+    def put(self, key, chunks, workspace=None):
+        response = json.dumps(chunks)
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                (key, workspace, now, now, len(response), response),
+            )
+            self._evict()
+
+    def _evict(self):
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        evicted = []
+        for key, size in self._db.execute("SELECT key, size FROM responses ORDER BY accessed"):
+            if total <= self.max_bytes:
+                break
+            evicted.append((key,))
+            total -= size
+        self._db.executemany("DELETE FROM responses WHERE key = ?", evicted)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class CachedBackend(ModelBackend):
+    """Serves repeated requests from a ResponseCache and stores the
+    responses of the rest. With workspace, a directory, a hit also requires
+    the directory's content to match what it was when the entry was stored.
+
+    Only complete turns with at least one candidate are stored."""
+
+    def __init__(self, backend, cache, workspace=None):
+        self.backend = backend
+        self.cache = cache
+        # A private manifest: its checkpoints are not the model's
+        self.manifest = WorkspaceManifest(os.path.abspath(workspace)) if workspace is not None else None
+
+    def _lookup(self, model, contents, config):
+        key = request_key(model, contents, config)
+        workspace = self.manifest.digest() if self.manifest is not None else None
+        return key, workspace, self.cache.get(key, workspace)
+
+    def _store(self, key, workspace, chunks):
+        if any(chunk.candidates for chunk in chunks):
+            self.cache.put(key, [dump_model(chunk) for chunk in chunks], workspace)
+
+    def generate_content(self, *, model, contents, config=None):
+        key, workspace, cached = self._lookup(model, contents, config)
+        if cached is not None:
+            return merge_chunks(load_responses(cached))
+        response = self.backend.generate_content(
+            model=model, contents=contents, config=config
+        )
+        self._store(key, workspace, [response])
+        return response
+
+    async def generate_content_stream(self, *, model, contents, config=None):
+        key, workspace, cached = self._lookup(model, contents, config)
+        if cached is not None:
+            for chunk in load_responses(cached):
+                yield chunk
+            return
+        chunks = []
+        async for chunk in self.backend.generate_content_stream(
+            model=model, contents=contents, config=config
+        ):
+            chunks.append(chunk)
+            yield chunk
+        self._store(key, workspace, chunks)
@@ -0,0 +1,116 @@
+import json
+import re
+import threading
+
+FAST = "fast"
+STRONG = "strong"
+
+# Tools whose calls are mechanical navigation: what to call next after them
+# rarely needs the strong tier
+NAVIGATION_TOOLS = {"get_files_info", "get_file_content", "search_code", "get_changes_since"}
+
+# Tool results that mean the task is not going to plan
+FAILURE = re.compile(r"^Error:|Process exited with code [1-9]|\b[1-9]\d* (?:failed|errors)\b")
+
+
+def _call_key(call):
+    return call.name, json.dumps(call.args or {}, sort_keys=True, default=str)
+
+
+def _failed(function_response):
+    response = function_response.response or {}
+    if "error" in response:
+        return True
+    return bool(FAILURE.search(str(response.get("result", ""))))
+
+
+class Router:
+    """Picks the model tier for each iteration from the conversation so far.
+
+    The strong tier gets the first turn after a user prompt (reading the
+    request and planning),
+    any turn within escalation_window tool turns of a failed tool call (an
+    error result, a script that exited non-zero, failing tests), and any
+    turn after the model repeated an earlier call. Turns that follow pure
+    navigation (listing, reading, searching) go to the fast tier; anything
+    else goes to default_tier.
+
+    The decision only depends on messages, so one Router can be shared by
+    concurrent sessions. record() keeps per-tier call counts, latency and
+    tokens."""
+
+    def __init__(self, fast_model, strong_model, default_tier=STRONG, escalation_window=2):
+        self.models = {FAST: fast_model, STRONG: strong_model}
+        self.default_tier = default_tier
+        self.escalation_window = escalation_window
+        self.stats = {
+            tier: {"calls": 0, "seconds": 0.0, "prompt": 0, "response": 0} for tier in self.models
+        }
+        self.decisions = {}
+        self._lock = threading.Lock()
+
+    def choose(self, messages):
+        """Return (model, tier, reason) for the next model call."""
+        tier, reason = self._tier(messages)
+        with self._lock:
+            self.decisions[reason] = self.decisions.get(reason, 0) + 1
+        return self.models[tier], tier, reason
+
+    def _tier(self, messages):
+        last = messages[-1] if messages else None
+        if last is None or not any(part.function_response for part in last.parts or []):
+            return STRONG, "new request"
+        model_turns = [index for index, content in enumerate(messages) if content.role == "model"]
+
+        # Each model turn with calls is followed by its responses
+        calls_by_turn = []
+        for index in model_turns:
+            calls = [part.function_call for part in messages[index].parts or [] if part.function_call]
+            if calls:
+                calls_by_turn.append((index, calls))
+        if not calls_by_turn:
+            return self.default_tier, "no tool calls"
+
+        window_start = calls_by_turn[-self.escalation_window :][0][0]
+        for content in messages[window_start:]:
+            for part in content.parts or []:
+                if part.function_response and _failed(part.function_response):
+                    return STRONG, "tool failed"
+
+        last_calls = calls_by_turn[-1][1]
+        earlier = {_call_key(call) for _, calls in calls_by_turn[:-1] for call in calls}
+        if any(_call_key(call) in earlier for call in last_calls):
+            return STRONG, "repeated call"
+
+        if all(call.name in NAVIGATION_TOOLS for call in last_calls):
+            return FAST, "after navigation"
+        return self.default_tier, "after " + ", ".join(sorted({call.name for call in last_calls}))
+
+    def record(self, tier, seconds, usage):
+        """Add one call's latency and token counts (as from Tracer.add_usage)."""
+        with self._lock:
+            stats = self.stats[tier]
+            stats["calls"] += 1
+            stats["seconds"] += seconds
+            stats["prompt"] += usage.get("prompt", 0)
+            stats["response"] += usage.get("response", 0)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "tiers": {tier: dict(values) for tier, values in self.stats.items()},
+                "decisions": dict(self.decisions),
+            }
+
+    def summary(self):
+        snapshot = self.snapshot()
+        stats, decisions = snapshot["tiers"], snapshot["decisions"]
+        lines = [f"{'tier':<8}{'model':<28}{'calls':>6}{'avg s':>9}{'prompt':>10}{'response':>10}"]
+        for tier, values in stats.items():
+            average = values["seconds"] / values["calls"] if values["calls"] else 0.0
+            lines.append(
+                f"{tier:<8}{self.models[tier]:<28}{values['calls']:>6}{average:>9.3f}"
+                f"{values['prompt']:>10}{values['response']:>10}"
+            )
+        lines.append("decisions: " + ", ".join(f"{reason} {count}" for reason, count in sorted(decisions.items())))
+        return "\n".join(lines)
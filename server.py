@@ -0,0 +1,431 @@
+"""Long-running agent server: many concurrent sessions in one process.
+
+Every session gets its own sandbox, a copy of --template, and its own
+message history and session log. All sessions share one model backend (one
+client and connection pool, behind the same --rpm/--tpm limiter and --cache
+as the CLI), the tool caches and indexes, and a Scheduler that caps how
+many agent turns run at once.
+
+    POST   /sessions                 {} -> {"session", "working_directory"}
+    POST   /sessions/ID/messages     {"prompt", "max_iterations"?} -> result of the turn
+    GET    /sessions/ID              session info
+    DELETE /sessions/ID              end the session and delete its sandbox (the log is kept)
+    GET    /metrics                  queue depth, latencies, tokens
+    GET    /health
+"""
+
+import argparse
+import json
+import os
+import shutil
+import socketserver
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from functions import warm_pool
+from functions.config import MAX_WORKERS, WARM_WORKERS, WORKING_DIRECTORY
+from functions.get_changes_since import START_CHECKPOINT, manifest_for
+from context import ContextManager
+from main import (
+    add_backend_arguments,
+    add_message,
+    add_router_arguments,
+    build_backend,
+    build_router,
+    release_workspace,
+    run_agent,
+    user_message,
+)
+from session_log import SESSIONS_DIR, SessionLog, new_session_id, session_path
+
+MAX_BODY_BYTES = 1024 * 1024
+# Number of recent turns the latency percentiles are computed over
+LATENCY_WINDOW = 1000
+
+
+def _percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(fraction * len(ordered)))], 4)
+
+
+class Scheduler:
+    """Caps the number of agent turns running at once across all sessions.
+
+    Turns over the cap wait for a slot; queued and running are the current
+    counts, and waits/durations keep the last LATENCY_WINDOW queue waits and
+    turn times in seconds."""
+
+    def __init__(self, max_running):
+        self.max_running = max_running
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.waits = deque(maxlen=LATENCY_WINDOW)
+        self.durations = deque(maxlen=LATENCY_WINDOW)
+        self._slots = threading.Semaphore(max_running)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def slot(self):
+        """Block until a turn may run; yields the seconds spent waiting."""
+        with self._lock:
+            self.queued += 1
+        start = time.perf_counter()
+        self._slots.acquire()
+        waited = time.perf_counter() - start
+        with self._lock:
+            self.queued -= 1
+            self.running += 1
+            self.waits.append(waited)
+        ok = False
+        try:
+            yield waited
+            ok = True
+        finally:
+            with self._lock:
+                self.running -= 1
+                self.durations.append(time.perf_counter() - start - waited)
+                if ok:
+                    self.completed += 1
+                else:
+                    self.failed += 1
+            self._slots.release()
+
+    def snapshot(self):
+        with self._lock:
+            waits = list(self.waits)
+            durations = list(self.durations)
+            counts = {
+                "queued": self.queued,
+                "running": self.running,
+                "max_running": self.max_running,
+                "completed": self.completed,
+                "failed": self.failed,
+            }
+        return counts | {
+            "queue_wait_p50": _percentile(waits, 0.5),
+            "queue_wait_p95": _percentile(waits, 0.95),
+            "turn_seconds_p50": _percentile(durations, 0.5),
+            "turn_seconds_p95": _percentile(durations, 0.95),
+        }
+
+
+class Session:
+    def __init__(self, session_id, working_directory, log_path, context=None):
+        self.id = session_id
+        self.working_directory = working_directory
+        self.messages = []
+        self.log = SessionLog(log_path)
+        self.log_path = log_path
+        self.context = context
+        self.created = time.time()
+        self.turns = 0
+        # Held while a turn runs; a session takes one message at a time
+        self.busy = threading.Lock()
+
+    def info(self):
+        return {
+            "session": self.id,
+            "working_directory": self.working_directory,
+            "log": self.log_path,
+            "messages": len(self.messages),
+            "turns": self.turns,
+            "busy": self.busy.locked(),
+        }
+
+
+class SessionBusy(Exception):
+    pass
+
+
+class AgentServer:
+    """Sessions, the shared backend and the scheduler; the HTTP handler only
+    translates requests into calls on this object."""
+
+    def __init__(self, backend, args, router=None):
+        self.backend = backend
+        self.args = args
+        self.router = router
+        self.scheduler = Scheduler(args.max_running)
+        self.sessions = {}
+        self.tokens = {"prompt": 0, "response": 0, "cached": 0}
+        self._lock = threading.Lock()
+
+    def create_session(self):
+        session_id = new_session_id()
+        working_directory = os.path.abspath(os.path.join(self.args.sandbox_root, session_id))
+        shutil.copytree(
+            self.args.template, working_directory, ignore=shutil.ignore_patterns("__pycache__")
+        )
+        # Taken once, so "start" means the start of the session, not the turn
+        manifest_for(working_directory).checkpoint(START_CHECKPOINT)
+        context = None
+        if self.args.token_budget is not None:
+            context = ContextManager(
+                self.args.token_budget,
+                keep_recent=self.args.keep_recent,
+                working_directory=working_directory,
+            )
+        session = Session(
+            session_id,
+            working_directory,
+            session_path(session_id, self.args.sessions_dir),
+            context,
+        )
+        with self._lock:
+            self.sessions[session_id] = session
+        return session
+
+    def get_session(self, session_id):
+        with self._lock:
+            return self.sessions.get(session_id)
+
+    def run_turn(self, session, prompt, max_iterations=None):
+        if not session.busy.acquire(blocking=False):
+            raise SessionBusy(session.id)
+        try:
+            add_message(session.messages, user_message(prompt), session.log)
+            with self.scheduler.slot() as waited:
+                start = time.perf_counter()
+                result = run_agent(
+                    self.backend,
+                    session.messages,
+                    max_workers=self.args.max_workers,
+                    max_iterations=max_iterations or self.args.max_iterations,
+                    context=session.context,
+                    working_directory=session.working_directory,
+                    quiet=True,
+                    session_log=session.log,
+                    router=self.router,
+                    start_checkpoint=False,
+                )
+                seconds = time.perf_counter() - start
+            session.turns += 1
+        finally:
+            session.busy.release()
+        tokens = result["trace"].tokens
+        with self._lock:
+            for kind in self.tokens:
+                self.tokens[kind] += tokens[kind]
+        return {
+            "session": session.id,
+            "text": result["text"],
+            "error": result["error"],
+            "iterations": len(result["iterations"]),
+            "seconds": round(seconds, 3),
+            "queued_seconds": round(waited, 3),
+            "prompt_tokens": tokens["prompt"],
+            "response_tokens": tokens["response"],
+            "cached_tokens": tokens["cached"],
+        }
+
+    def delete_session(self, session_id):
+        with self._lock:
+            session = self.sessions.get(session_id)
+            if session is None:
+                return None
+            if not session.busy.acquire(blocking=False):
+                raise SessionBusy(session_id)
+            del self.sessions[session_id]
+        # Only the log stays behind, as a transcript: the sandbox the tools
+        # worked in is deleted, so the session cannot be picked up again
+        session.log.close()
+        release_workspace(session.working_directory)
+        shutil.rmtree(session.working_directory, ignore_errors=True)
+        return session
+
+    def metrics(self):
+        with self._lock:
+            sessions = len(self.sessions)
+            busy = sum(session.busy.locked() for session in self.sessions.values())
+            tokens = dict(self.tokens)
+        metrics = {"sessions": sessions, "busy_sessions": busy, "tokens": tokens}
+        metrics |= self.scheduler.snapshot()
+        # Walk the wrapper chain build_backend made for the layers' counters
+        backend = self.backend
+        while backend is not None:
+            if hasattr(backend, "cache"):
+                metrics["cache_hits"] = backend.cache.hits
+                metrics["cache_misses"] = backend.cache.misses
+            if getattr(backend, "limiter", None) is not None:
+                metrics["rate_limit_waited_seconds"] = round(backend.limiter.waited, 3)
+            if hasattr(backend, "counters"):
+                metrics["model_calls"] = backend.snapshot()
+            backend = getattr(backend, "backend", None)
+        if self.router is not None:
+            metrics["routing"] = self.router.snapshot()
+        return metrics
+
+    def close(self):
+        with self._lock:
+            sessions = list(self.sessions.values())
+        for session in sessions:
+            session.log.close()
+
+
+class Handler(BaseHTTPRequestHandler):
+    server_version = "python-ai-agent"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def address_string(self):
+        # Unix-socket clients have no (host, port) address
+        return self.client_address[0] if isinstance(self.client_address, tuple) else "unix"
+
+    def _send(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > MAX_BODY_BYTES:
+            raise ValueError(f"request body over {MAX_BODY_BYTES} bytes")
+        body = json.loads(self.rfile.read(length) or b"{}")
+        if not isinstance(body, dict):
+            raise ValueError("request body must be a JSON object")
+        return body
+
+    def _route(self):
+        # Path segments, and the session the path names, if it exists
+        parts = [part for part in self.path.split("?")[0].split("/") if part]
+        session = None
+        if len(parts) >= 2 and parts[0] == "sessions":
+            session = self.server.agent.get_session(parts[1])
+        return parts, session
+
+    def do_GET(self):
+        parts, session = self._route()
+        if parts == ["health"]:
+            self._send(200, {"ok": True})
+        elif parts == ["metrics"]:
+            self._send(200, self.server.agent.metrics())
+        elif len(parts) == 2 and session is not None:
+            self._send(200, session.info())
+        else:
+            self._send(404, {"error": f"not found: {self.path}"})
+
+    def do_POST(self):
+        agent = self.server.agent
+        try:
+            body = self._read_json()
+        except ValueError as e:
+            self._send(400, {"error": str(e)})
+            return
+        parts, session = self._route()
+        if parts == ["sessions"]:
+            try:
+                session = agent.create_session()
+            except OSError as e:
+                self._send(500, {"error": f"could not create sandbox: {e}"})
+                return
+            self._send(201, session.info())
+        elif len(parts) == 3 and parts[0] == "sessions" and parts[2] == "messages":
+            if session is None:
+                self._send(404, {"error": f"no session {parts[1]}"})
+                return
+            prompt = body.get("prompt")
+            if not isinstance(prompt, str) or not prompt.strip():
+                self._send(400, {"error": "prompt is required"})
+                return
+            max_iterations = body.get("max_iterations")
+            if max_iterations is not None and (
+                not isinstance(max_iterations, int) or isinstance(max_iterations, bool) or max_iterations <= 0
+            ):
+                self._send(400, {"error": "max_iterations must be a positive integer"})
+                return
+            try:
+                result = agent.run_turn(session, prompt, max_iterations)
+            except SessionBusy:
+                self._send(409, {"error": f"session {session.id} is already running a turn"})
+                return
+            except Exception as e:
+                self._send(500, {"error": f"turn failed: {e}"})
+                return
+            self._send(200, result)
+        else:
+            self._send(404, {"error": f"not found: {self.path}"})
+
+    def do_DELETE(self):
+        parts, _ = self._route()
+        if len(parts) != 2 or parts[0] != "sessions":
+            self._send(404, {"error": f"not found: {self.path}"})
+            return
+        try:
+            session = self.server.agent.delete_session(parts[1])
+        except SessionBusy:
+            self._send(409, {"error": f"session {parts[1]} is running a turn"})
+            return
+        if session is None:
+            self._send(404, {"error": f"no session {parts[1]}"})
+            return
+        self._send(200, {"session": session.id, "deleted": True, "log": session.log_path})
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def make_server(agent, host="127.0.0.1", port=8765, socket_path=None, verbose=False):
+    if socket_path is not None:
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        httpd = ThreadingUnixHTTPServer(socket_path, Handler)
+    else:
+        httpd = ThreadingHTTPServer((host, port), Handler)
+    httpd.agent = agent
+    httpd.verbose = verbose
+    return httpd
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve concurrent agent sessions over HTTP")
+    parser.add_argument("--host", default="127.0.0.1", help="Interface to listen on")
+    parser.add_argument("--port", type=int, default=8765, help="TCP port to listen on")
+    parser.add_argument("--socket", metavar="PATH", help="Listen on the Unix socket PATH instead of TCP")
+    parser.add_argument("--template", default=WORKING_DIRECTORY, help="Directory copied into every new session's sandbox")
+    parser.add_argument("--sandbox-root", default="server_sessions", help="Directory holding the per-session sandboxes")
+    parser.add_argument("--sessions-dir", default=SESSIONS_DIR, help="Directory holding the session logs")
+    parser.add_argument("--max-running", type=int, default=8, help="Number of agent turns run at once across all sessions")
+    parser.add_argument("--max-iterations", type=int, default=20, help="Default maximum number of model turns per message")
+    parser.add_argument(
+        "--max-workers",
+        type=int,
+        default=MAX_WORKERS,
+        help="Maximum number of function calls from one turn to run concurrently",
+    )
+    parser.add_argument("--token-budget", type=int, metavar="TOKENS", help="Compact each session's context to fit TOKENS")
+    parser.add_argument("--keep-recent", type=int, default=6, help="Number of most recent messages that context compaction never touches")
+    parser.add_argument("--warm-workers", type=int, default=WARM_WORKERS, help="Warm Python workers per session sandbox")
+    parser.add_argument("--verbose", action="store_true", help="Log every request")
+    add_backend_arguments(parser)
+    add_router_arguments(parser)
+    args = parser.parse_args()
+
+    os.makedirs(args.sandbox_root, exist_ok=True)
+    warm_pool.configure(args.warm_workers)
+    agent = AgentServer(build_backend(args), args, build_router(args))
+    httpd = make_server(agent, args.host, args.port, args.socket, args.verbose)
+    address = args.socket or f"http://{args.host}:{httpd.server_address[1]}"
+    print(f"Serving agent sessions on {address}")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        agent.close()
+
+
+if __name__ == "__main__":
+    main()
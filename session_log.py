@@ -0,0 +1,95 @@
+import json
+import os
+import time
+from backends import dump_model
+
+SESSIONS_DIR = "sessions"
+
+
+def new_session_id():
+    return time.strftime("%Y%m%d-%H%M%S") + "-" + os.urandom(3).hex()
+
+
+def session_path(session, sessions_dir=SESSIONS_DIR):
+    """Resolve a session id, or a path to a log file, to the log's path."""
+    if session.endswith(".jsonl") or os.sep in session:
+        return session
+    return os.path.join(sessions_dir, f"{session}.jsonl")
+
+
+def _line(content):
+    return json.dumps(dump_model(content), separators=(",", ":")) + "\n"
+
+
+class SessionLog:
+    """Append-only log of one conversation, one types.Content per line.
+
+    Each message is written and flushed as soon as it joins the
+    conversation, so a session that stops at the iteration limit, raises,
+    or is killed can be rebuilt with load_session.
+
+    Given messages (those load_session kept), the log is first rewritten to
+    hold exactly them, so an unfinished turn or a torn last line is not left
+    in front of what gets appended next."""
+
+    def __init__(self, path, messages=None):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        if messages is not None:
+            temp_path = path + ".tmp"
+            with open(temp_path, "w") as f:
+                f.writelines(_line(content) for content in messages)
+            os.replace(temp_path, path)
+        self._file = open(path, "a")
+
+    def append(self, content):
+        self._file.write(_line(content))
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+def _unanswered_tail(messages):
+    # Index of the last model turn whose function calls did not all get a
+    # response, or None. Responses are logged one per call, so a run that
+    # stopped partway through a turn leaves fewer responses than calls.
+    for index in range(len(messages) - 1, -1, -1):
+        content = messages[index]
+        calls = [part for part in content.parts or [] if part.function_call]
+        if content.role == "model":
+            if not calls:
+                return None
+            answered = sum(
+                1
+                for later in messages[index + 1 :]
+                for part in later.parts or []
+                if part.function_response
+            )
+            return index if answered < len(calls) else None
+    return None
+
+
+def load_session(path):
+    """Rebuild the messages of a logged session.
+
+    Returns (messages, dropped): a trailing model turn whose function calls
+    were not all answered is dropped, together with any partial responses,
+    so resuming asks the model again instead of running tools twice or
+    sending calls without responses. A torn last line left by a killed
+    process ends the log."""
+    from google.genai import types
+
+    messages = []
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                messages.append(types.Content.model_validate_json(line))
+            except ValueError:
+                break
+    cut = _unanswered_tail(messages)
+    if cut is None:
+        return messages, 0
+    return messages[:cut], len(messages) - cut
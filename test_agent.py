@@ -0,0 +1,1618 @@
+# test_agent.py
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import unittest
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from google import genai
+from google.genai import errors, types
+from backends import GenAIBackend, ModelBackend, RecordingBackend, ReplayBackend, dump_model, load_cassette
+from context import ContextManager, estimate_tokens
+from functions.cache import UNCHANGED_SUFFIX
+from functions.call_function import available_functions, call_functions, serial_key
+from functions.edit_file import EditError, _apply_unified_diff, _parse_hunks
+from functions.get_file_content import get_file_content
+from functions.get_changes_since import WorkspaceManifest
+from functions.get_files_info import get_files_info
+from functions.output_capture import BoundedBuffer
+from functions.registry import TOOLS, declaration
+from functions.run_python_file import _run_cold
+from functions.run_tests import _last_failed, run_tests
+from functions.search_code import notify_tree_changed, search_code
+from functions.warm_pool import WarmPool, WarmWorker, available, pool_for
+from functions.write_file import write_file
+from functions import get_changes_since, warm_pool
+from main import MODEL, release_workspace, run_agent, run_agent_async, run_batch, user_message
+from ratelimit import RateLimiter
+from resilience import ResilientBackend
+from response_cache import CachedBackend, ResponseCache, request_key
+from routing import FAST, STRONG, Router
+from server import AgentServer, make_server
+from session_log import SessionLog, _unanswered_tail, load_session
+from tracing import Tracer
+
+
+def call(name, **args):
+    return types.Part(function_call=types.FunctionCall(name=name, args=args))
+
+
+def model_turn(*parts):
+    return types.Content(role="model", parts=list(parts))
+
+
+def tool_turn(name, result):
+    return types.Content(
+        role="tool",
+        parts=[types.Part.from_function_response(name=name, response={"result": result})],
+    )
+
+
+# The hand-written declarations the @tool registry replaced, as they were
+HAND_WRITTEN_DECLARATIONS = [
+    types.FunctionDeclaration(
+        name="get_files_info",
+        description="Lists files in the specified directory along with their sizes, constrained to the working directory. Set recursive to map a whole tree in one call; long listings are paginated.",
+        parameters=types.Schema(
+            type=types.Type.OBJECT,
+            properties={
+                "directory": types.Schema(
+                    type=types.Type.STRING,
+                    description="The directory to list files from, relative to the working directory. If not provided, lists files in the working directory itself.",
+                ),
+                "recursive": types.Schema(
+                    type=types.Type.BOOLEAN,
+                    description="List subdirectories recursively, with paths relative to the listed directory. Defaults to false.",
+                ),
+                "max_depth": types.Schema(
+                    type=types.Type.INTEGER,
+                    description="With recursive, the maximum depth to descend (1 lists only the directory itself).",
+                ),
+                "include": types.Schema(
+                    type=types.Type.ARRAY,
+                    description="Glob patterns (e.g. '*.py'); only files whose path or name matches one are listed.",
+                    items=types.Schema(type=types.Type.STRING),
+                ),
+                "exclude": types.Schema(
+                    type=types.Type.ARRAY,
+                    description="Glob patterns for files and directories to skip; excluded directories are not descended into.",
+                    items=types.Schema(type=types.Type.STRING),
+                ),
+                "respect_gitignore": types.Schema(
+                    type=types.Type.BOOLEAN,
+                    description="Skip paths ignored by .gitignore files inside the listed directory. Defaults to true.",
+                ),
+                "page_token": types.Schema(
+                    type=types.Type.STRING,
+                    description="Continuation token returned by a previous listing, to fetch the next page.",
+                ),
+                "page_size": types.Schema(
+                    type=types.Type.INTEGER,
+                    description="Maximum number of entries per page. Defaults to 1000.",
+                ),
+            },
+        ),
+    ),
+    types.FunctionDeclaration(
+        name="get_file_content",
+        description="Reads and returns the contents of a file, constrained to the working directory. Without offset/limit the file is truncated at 10000 characters; pass them to page through large files.",
+        parameters=types.Schema(
+            type=types.Type.OBJECT,
+            properties={
+                "file_path": types.Schema(
+                    type=types.Type.STRING,
+                    description="The path to the file to read, relative to the working directory.",
+                ),
+                "offset": types.Schema(
+                    type=types.Type.INTEGER,
+                    description="Number of lines (or bytes, see unit) to skip before the page starts. Defaults to 0.",
+                ),
+                "limit": types.Schema(
+                    type=types.Type.INTEGER,
+                    description="Maximum number of lines (or bytes) in the page. Defaults to 200 lines or 10000 bytes.",
+                ),
+                "unit": types.Schema(
+                    type=types.Type.STRING,
+                    description='Whether offset and limit count "lines" (default) or "bytes".',
+                    enum=["lines", "bytes"],
+                ),
+            },
+            required=["file_path"],
+        ),
+    ),
+    types.FunctionDeclaration(
+        name="run_python_file",
+        description="Executes a Python file with optional command-line arguments, constrained to the working directory.",
+        parameters=types.Schema(
+            type=types.Type.OBJECT,
+            properties={
+                "file_path": types.Schema(
+                    type=types.Type.STRING,
+                    description="The path to the Python file to execute, relative to the working directory.",
+                ),
+                "args": types.Schema(
+                    type=types.Type.ARRAY,
+                    description="Optional command-line arguments to pass to the Python file.",
+                    items=types.Schema(type=types.Type.STRING),
+                ),
+                "kill_on_overflow": types.Schema(
+                    type=types.Type.BOOLEAN,
+                    description="Kill the process as soon as stdout or stderr exceeds the output limit, instead of letting it finish and keeping only the head and tail.",
+                ),
+            },
+            required=["file_path"],
+        ),
+    ),
+    types.FunctionDeclaration(
+        name="write_file",
+        description="Writes or overwrites content to a file, constrained to the working directory.",
+        parameters=types.Schema(
+            type=types.Type.OBJECT,
+            properties={
+                "file_path": types.Schema(
+                    type=types.Type.STRING,
+                    description="The path to the file to write, relative to the working directory.",
+                ),
+                "content": types.Schema(
+                    type=types.Type.STRING,
+                    description="The content to write to the file.",
+                ),
+            },
+            required=["file_path", "content"],
+        ),
+    ),
+    types.FunctionDeclaration(
+        name="edit_file",
+        description="Edits part of an existing file, constrained to the working directory, without resending the whole file. Give either search/replace edits, each of whose search text must match exactly once, or a unified diff. Nothing is written unless every edit applies.",
+        parameters=types.Schema(
+            type=types.Type.OBJECT,
+            properties={
+                "file_path": types.Schema(
+                    type=types.Type.STRING,
+                    description="The path to the file to edit, relative to the working directory.",
+                ),
+                "edits": types.Schema(
+                    type=types.Type.ARRAY,
+                    description="Search/replace edits applied in order.",
+                    items=types.Schema(
+                        type=types.Type.OBJECT,
+                        properties={
+                            "search": types.Schema(
+                                type=types.Type.STRING,
+                                description="Exact text to find, including whitespace; include enough lines to be unique.",
+                            ),
+                            "replace": types.Schema(
+                                type=types.Type.STRING,
+                                description="Text to put in its place.",
+                            ),
+                            "replace_all": types.Schema(
+                                type=types.Type.BOOLEAN,
+                                description="Replace every occurrence instead of requiring a unique match.",
+                            ),
+                        },
+                        required=["search", "replace"],
+                    ),
+                ),
+                "diff": types.Schema(
+                    type=types.Type.STRING,
+                    description="A unified diff (with @@ hunk headers) to apply to this file.",
+                ),
+            },
+            required=["file_path"],
+        ),
+    ),
+    types.FunctionDeclaration(
+        name="search_code",
+        description="Searches the text files of the working directory for a literal string or regex and returns matching lines as path:line: snippet. Much cheaper than listing and reading files to find code.",
+        parameters=types.Schema(
+            type=types.Type.OBJECT,
+            properties={
+                "query": types.Schema(
+                    type=types.Type.STRING,
+                    description="The text to search for, or a Python regular expression if regex is true.",
+                ),
+                "regex": types.Schema(
+                    type=types.Type.BOOLEAN,
+                    description="Treat query as a regular expression. Defaults to false.",
+                ),
+                "case_sensitive": types.Schema(
+                    type=types.Type.BOOLEAN,
+                    description="Match case exactly. Defaults to true.",
+                ),
+                "path": types.Schema(
+                    type=types.Type.STRING,
+                    description="Limit the search to this directory, relative to the working directory.",
+                ),
+                "max_results": types.Schema(
+                    type=types.Type.INTEGER,
+                    description="Maximum number of matching lines to return. Defaults to 50.",
+                ),
+            },
+            required=["query"],
+        ),
+    ),
+]
+
+
+class ScriptedBackend(ModelBackend):
+    """Stand-in for Gemini: answers with the given model turns in order and
+    records the model each call asked for."""
+
+    def __init__(self, *turns):
+        self.turns = list(turns)
+        self.models = []
+
+    def generate_content(self, *, model, contents, config=None):
+        self.models.append(model)
+        return types.GenerateContentResponse(
+            candidates=[types.Candidate(content=self.turns.pop(0))],
+            usage_metadata=types.GenerateContentResponseUsageMetadata(
+                prompt_token_count=100, candidates_token_count=10, total_token_count=110
+            ),
+        )
+
+
+class TestToolSchemas(unittest.TestCase):
+    def test_generated_declarations_match_hand_written_ones(self):
+        for expected in HAND_WRITTEN_DECLARATIONS:
+            with self.subTest(expected.name):
+                self.assertEqual(
+                    declaration(expected.name).model_dump(exclude_none=True),
+                    expected.model_dump(exclude_none=True),
+                )
+
+    def test_every_tool_is_declared(self):
+        names = [item.name for item in available_functions().function_declarations]
+        self.assertEqual(names, list(TOOLS))
+        for name in names:
+            parameters = declaration(name).parameters
+            self.assertLessEqual(set(parameters.required or ()), set(parameters.properties))
+
+
+class TestRouter(unittest.TestCase):
+    def setUp(self):
+        self.router = Router("fast-model", "strong-model")
+
+    def tier(self, messages):
+        return self.router.choose(messages)[1]
+
+    def test_new_request_goes_to_strong_tier(self):
+        self.assertEqual(self.tier([user_message("fix the bug")]), STRONG)
+
+    def test_navigation_goes_to_fast_tier(self):
+        messages = [
+            user_message("fix the bug"),
+            model_turn(call("get_files_info", directory=".")),
+            tool_turn("get_files_info", "- main.py: file_size=100 bytes, is_dir=False"),
+        ]
+        self.assertEqual(self.router.choose(messages), ("fast-model", FAST, "after navigation"))
+
+    def test_tool_error_escalates_for_the_window(self):
+        messages = [
+            user_message("fix the bug"),
+            model_turn(call("get_file_content", file_path="missing.py")),
+            tool_turn("get_file_content", 'Error: File not found or is not a regular file: "missing.py"'),
+        ]
+        self.assertEqual(self.tier(messages), STRONG)
+        messages += [
+            model_turn(call("get_files_info", directory=".")),
+            tool_turn("get_files_info", "- main.py: file_size=100 bytes, is_dir=False"),
+        ]
+        self.assertEqual(self.tier(messages), STRONG)
+        messages += [
+            model_turn(call("get_file_content", file_path="main.py")),
+            tool_turn("get_file_content", "print('hi')"),
+        ]
+        self.assertEqual(self.tier(messages), FAST)
+
+    def test_failing_tests_escalate(self):
+        messages = [
+            user_message("fix the bug"),
+            model_turn(call("run_tests")),
+            tool_turn("run_tests", "Ran 3 tests in 0.1s on 1 workers: 2 passed, 1 failed, 0 errors, 0 skipped"),
+        ]
+        self.assertEqual(self.tier(messages), STRONG)
+
+    def test_repeated_call_escalates(self):
+        messages = [
+            user_message("fix the bug"),
+            model_turn(call("get_file_content", file_path="main.py")),
+            tool_turn("get_file_content", "print('hi')"),
+            model_turn(call("get_file_content", file_path="main.py")),
+            tool_turn("get_file_content", "print('hi')"),
+        ]
+        self.assertEqual(self.router.choose(messages)[2], "repeated call")
+
+    def test_other_tools_use_default_tier(self):
+        messages = [
+            user_message("fix the bug"),
+            model_turn(call("write_file", file_path="a.py", content="x = 1")),
+            tool_turn("write_file", 'Successfully wrote to "a.py" (5 characters written)'),
+        ]
+        self.assertEqual(self.tier(messages), STRONG)
+        self.assertEqual(Router("f", "s", default_tier=FAST).choose(messages)[1], FAST)
+
+
+class TestRunAgentRouting(unittest.TestCase):
+    def setUp(self):
+        self.working_directory = tempfile.mkdtemp()
+        with open(f"{self.working_directory}/main.py", "w") as f:
+            f.write("print('hi')\n")
+        self.addCleanup(shutil.rmtree, self.working_directory)
+
+    def run_script(self, backend, router=None):
+        return run_agent(
+            backend,
+            [user_message("what does main.py do?")],
+            working_directory=self.working_directory,
+            quiet=True,
+            router=router,
+        )
+
+    def script(self):
+        return ScriptedBackend(
+            model_turn(call("get_files_info", directory=".")),
+            model_turn(call("get_file_content", file_path="missing.py")),
+            model_turn(call("get_file_content", file_path="main.py")),
+            model_turn(types.Part(text="It prints hi.")),
+        )
+
+    def test_iterations_are_routed_by_tier(self):
+        backend = self.script()
+        router = Router("fast-model", "strong-model")
+        result = self.run_script(backend, router)
+
+        self.assertEqual(result["text"], "It prints hi.")
+        # planning, after a listing, after an error, still within its window
+        self.assertEqual(backend.models, ["strong-model", "fast-model", "strong-model", "strong-model"])
+        self.assertEqual([timings["tier"] for timings in result["iterations"]], [STRONG, FAST, STRONG, STRONG])
+        stats = router.snapshot()["tiers"]
+        self.assertEqual((stats[FAST]["calls"], stats[STRONG]["calls"]), (1, 3))
+        self.assertEqual(stats[STRONG]["prompt"], 300)
+        spans = [span["name"] for span in result["trace"].spans if span["category"] == "model"]
+        self.assertEqual(spans, backend.models)
+
+    def test_without_router_every_iteration_uses_model(self):
+        backend = self.script()
+        self.run_script(backend)
+        self.assertEqual(backend.models, [MODEL] * 4)
+
+    def test_batch_sessions_release_their_workspace(self):
+        backend = ScriptedBackend(
+            model_turn(call("get_changes_since", checkpoint="start")),
+            model_turn(types.Part(text="Nothing changed.")),
+        )
+        with open(f"{self.working_directory}/prompts.jsonl", "w") as f:
+            f.write(json.dumps({"prompt": "what changed?", "working_directory": self.working_directory}) + "\n")
+        args = argparse.Namespace(
+            batch=f"{self.working_directory}/prompts.jsonl",
+            batch_root=f"{self.working_directory}/sessions",
+            output=f"{self.working_directory}/results.ndjson",
+            concurrency=1,
+            token_budget=None,
+            keep_recent=6,
+            max_workers=1,
+            route=False,
+        )
+        run_batch(backend, args)
+        with open(args.output) as f:
+            self.assertEqual(json.loads(f.read())["text"], "Nothing changed.")
+        self.assertNotIn(self.working_directory, get_changes_since._manifests)
+
+    def test_batch_can_be_rerun_with_the_same_root(self):
+        with open(f"{self.working_directory}/prompts.jsonl", "w") as f:
+            f.write(json.dumps({"prompt": "what does main.py do?"}) + "\n")
+        args = argparse.Namespace(
+            batch=f"{self.working_directory}/prompts.jsonl",
+            batch_root=f"{self.working_directory}/sessions",
+            output=f"{self.working_directory}/results.ndjson",
+            concurrency=1,
+            token_budget=None,
+            keep_recent=6,
+            max_workers=1,
+            route=False,
+        )
+        for _ in range(2):
+            run_batch(ScriptedBackend(model_turn(types.Part(text="It prints hi."))), args)
+        with open(args.output) as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual([record["error"] for record in records], [None, None])
+        self.assertNotEqual(records[0]["working_directory"], records[1]["working_directory"])
+
+
+def chunk(*parts, usage=None):
+    return types.GenerateContentResponse(
+        candidates=[types.Candidate(content=model_turn(*parts))] if parts else None,
+        usage_metadata=usage,
+    )
+
+
+class FailingStream(ModelBackend):
+    """Streams the given chunks, then fails as a dropped connection would."""
+
+    def __init__(self, *chunks):
+        self.chunks = chunks
+
+    async def generate_content_stream(self, *, model, contents, config=None):
+        for item in self.chunks:
+            yield item
+        await asyncio.sleep(0.1)
+        raise ConnectionError("stream dropped")
+
+
+class TestRunAgentAsync(unittest.TestCase):
+    def setUp(self):
+        self.working_directory = tempfile.mkdtemp()
+        with open(f"{self.working_directory}/main.py", "w") as f:
+            f.write("print('hi')\n")
+        self.addCleanup(shutil.rmtree, self.working_directory)
+        self.addCleanup(release_workspace, self.working_directory)
+
+    def run_async(self, backend):
+        return asyncio.run(run_agent_async(
+            backend,
+            [user_message("what does main.py do?")],
+            working_directory=self.working_directory,
+            quiet=True,
+        ))
+
+    def test_replayed_session(self):
+        usage = types.GenerateContentResponseUsageMetadata(
+            prompt_token_count=100, candidates_token_count=10, total_token_count=110
+        )
+        turns = [
+            [chunk(call("get_file_content", file_path="main.py")), chunk(usage=usage)],
+            [chunk(types.Part(text="It prints ")), chunk(types.Part(text="hi.")), chunk(usage=usage)],
+        ]
+        cassette = f"{self.working_directory}/session.jsonl"
+        with open(cassette, "w") as f:
+            for turn in turns:
+                f.write(json.dumps({"request": {}, "response": [dump_model(item) for item in turn]}) + "\n")
+
+        result = self.run_async(ReplayBackend(cassette, latency=0.05))
+
+        self.assertIsNone(result["error"])
+        self.assertEqual(result["text"], "It prints hi.")
+        self.assertEqual(result["trace"].tokens["prompt"], 200)
+        spans = [span for span in result["trace"].spans if span["category"] == "model"]
+        # Same measure as the synchronous loop: the model call alone
+        self.assertEqual(
+            [timings["model"] for timings in result["iterations"]],
+            [span["duration"] for span in spans],
+        )
+
+    def test_stream_error_waits_for_started_calls(self):
+        with open(f"{self.working_directory}/slow.py", "w") as f:
+            f.write("import time\ntime.sleep(0.5)\nopen('done', 'w').close()\n")
+        backend = FailingStream(chunk(call("run_python_file", file_path="slow.py")))
+
+        result = self.run_async(backend)
+
+        self.assertIn("stream dropped", result["error"])
+        self.assertTrue(os.path.exists(f"{self.working_directory}/done"))
+
+
+class TestTracer(unittest.TestCase):
+    def setUp(self):
+        self.working_directory = tempfile.mkdtemp()
+        with open(f"{self.working_directory}/main.py", "w") as f:
+            f.write("print('hi')\n")
+        self.addCleanup(shutil.rmtree, self.working_directory)
+        self.addCleanup(release_workspace, self.working_directory)
+
+    def run_traced(self):
+        backend = ScriptedBackend(
+            model_turn(call("get_file_content", file_path="main.py"), call("get_file_content", file_path="missing.py")),
+            model_turn(call("get_files_info", directory=".")),
+            model_turn(types.Part(text="It prints hi.")),
+        )
+        return run_agent(
+            backend, [user_message("what does main.py do?")], working_directory=self.working_directory, quiet=True
+        )["trace"]
+
+    def test_spans_and_token_totals(self):
+        tracer = self.run_traced()
+        self.assertEqual(tracer.model_calls, 3)
+        self.assertEqual(tracer.tokens, {"prompt": 300, "response": 30, "cached": 0, "thoughts": 0, "total": 330})
+
+        spans = tracer.to_json()["spans"]
+        self.assertEqual([span["start"] for span in spans], sorted(span["start"] for span in spans))
+        by_category = {}
+        for span in spans:
+            by_category.setdefault(span["category"], []).append(span)
+        self.assertEqual(len(by_category["iteration"]), 3)
+        self.assertEqual(len(by_category["model"]), 3)
+        self.assertEqual(by_category["model"][0]["args"]["prompt"], 100)
+        tools = sorted(by_category["tool"], key=lambda span: span["name"])
+        self.assertEqual([span["name"] for span in tools], ["get_file_content", "get_file_content", "get_files_info"])
+        self.assertEqual(sorted(span["args"]["error"] for span in tools[:2]), [False, True])
+        self.assertTrue(all(span["args"]["result_chars"] > 0 for span in tools))
+        # Model and tool spans fall inside an iteration span
+        for span in by_category["model"] + tools:
+            self.assertTrue(any(
+                outer["start"] <= span["start"] and span["start"] + span["duration"] <= outer["start"] + outer["duration"]
+                for outer in by_category["iteration"]
+            ))
+
+        summary = tracer.summary()
+        self.assertIn("tool:get_file_content", summary)
+        self.assertIn("Tokens over 3 model calls: prompt 300, response 30, cached 0, thoughts 0, total 330", summary)
+
+    def test_usage_without_metadata(self):
+        tracer = Tracer()
+        self.assertEqual(tracer.add_usage(None), {"prompt": 0, "response": 0, "cached": 0, "thoughts": 0, "total": 0})
+        partial = types.GenerateContentResponseUsageMetadata(prompt_token_count=7)
+        self.assertEqual(tracer.add_usage(partial)["prompt"], 7)
+        self.assertEqual((tracer.model_calls, tracer.tokens["prompt"], tracer.tokens["total"]), (2, 7, 0))
+
+    def test_chrome_trace_format(self):
+        tracer = self.run_traced()
+        path = f"{self.working_directory}/trace.json"
+        tracer.write(path, format="chrome")
+        with open(path) as f:
+            trace = json.load(f)
+
+        self.assertEqual(trace["displayTimeUnit"], "ms")
+        metadata = [event for event in trace["traceEvents"] if event["ph"] == "M"]
+        complete = [event for event in trace["traceEvents"] if event["ph"] == "X"]
+        self.assertEqual({event["name"] for event in metadata}, {"thread_name"})
+        threads = {event["tid"] for event in metadata}
+        self.assertEqual(len(threads), len(metadata))
+        self.assertEqual(len(complete), len(tracer.spans))
+        for event, span in zip(complete, tracer.to_json()["spans"]):
+            self.assertEqual((event["name"], event["cat"]), (span["name"], span["category"]))
+            self.assertEqual(event["ts"], round(span["start"] * 1e6, 1))
+            self.assertEqual(event["dur"], round(span["duration"] * 1e6, 1))
+            self.assertIn(event["tid"], threads)
+            self.assertEqual(event["pid"], os.getpid())
+
+        tracer.write(path)
+        with open(path) as f:
+            self.assertEqual(set(json.load(f)), {"tokens", "model_calls", "spans"})
+
+
+class TestContextManager(unittest.TestCase):
+    def setUp(self):
+        self.working_directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.working_directory)
+        self.addCleanup(release_workspace, self.working_directory)
+
+    def conversation(self, reads=8, size=4000):
+        messages = [user_message("summarize the package")]
+        for index in range(reads):
+            messages.append(model_turn(call("get_file_content", file_path=f"file{index}.py")))
+            messages.append(tool_turn("get_file_content", f"# file {index}\n" + "x" * size))
+        messages.append(model_turn(types.Part(text="Done.")))
+        return messages
+
+    def test_view_fits_the_budget_and_keeps_the_newest_turns(self):
+        messages = self.conversation()
+        before = [dump_model(message) for message in messages]
+        context = ContextManager(token_budget=3000, keep_recent=4, working_directory=self.working_directory)
+
+        view, saved = context.compact(messages)
+
+        total = sum(estimate_tokens(content) for content in view)
+        self.assertLessEqual(total, 3000)
+        self.assertEqual(saved, sum(estimate_tokens(content) for content in messages) - total)
+        self.assertEqual(context.history, [saved])
+        self.assertEqual(view[0], messages[0])
+        for recent, original in zip(view[-4:], messages[-4:]):
+            self.assertIs(recent, original)
+        # Oldest responses are cut first, and only as many as needed
+        cut = [
+            index for index, content in enumerate(view)
+            if "elided to fit the context budget" in str(dump_model(content))
+        ]
+        self.assertEqual(cut, list(range(2, 2 + 2 * len(cut), 2)))
+        self.assertLess(len(cut), 8)
+        self.assertEqual([dump_model(message) for message in messages], before)
+
+    def test_without_budget_only_stale_responses_are_elided(self):
+        messages = [
+            user_message("fix a.py"),
+            model_turn(call("get_file_content", file_path="a.py")),
+            tool_turn("get_file_content", "x = 1\n" * 100),
+            model_turn(call("get_files_info", directory=".")),
+            tool_turn("get_files_info", "- a.py"),
+            model_turn(call("write_file", file_path="a.py", content="x = 2\n")),
+            tool_turn("write_file", "Successfully wrote to a.py"),
+            model_turn(call("get_files_info", directory=".")),
+            tool_turn("get_files_info", "- a.py"),
+            model_turn(types.Part(text="Fixed.")),
+        ]
+        view, saved = ContextManager(keep_recent=2).compact(messages)
+
+        responses = [view[index].parts[0].function_response.response for index in (2, 4, 6, 8)]
+        self.assertEqual(responses[0], {"result": "[Elided: superseded by a later write_file to a.py]"})
+        self.assertEqual(responses[1], {"result": "[Elided: superseded by a later identical get_files_info call]"})
+        self.assertEqual(responses[2:], [{"result": "Successfully wrote to a.py"}, {"result": "- a.py"}])
+        self.assertGreater(saved, 0)
+
+    def test_cut_read_is_sent_again_in_full(self):
+        with open(f"{self.working_directory}/big.py", "w") as f:
+            f.write("x = 1\n" * 2000)
+        first = get_file_content(self.working_directory, "big.py")
+        self.assertIn(UNCHANGED_SUFFIX, get_file_content(self.working_directory, "big.py"))
+        messages = [
+            user_message("read big.py"),
+            model_turn(call("get_file_content", file_path="big.py")),
+            tool_turn("get_file_content", first),
+            model_turn(types.Part(text="Read it.")),
+            user_message("and again?"),
+        ]
+        ContextManager(token_budget=500, keep_recent=2, working_directory=self.working_directory).compact(messages)
+
+        self.assertEqual(get_file_content(self.working_directory, "big.py"), first)
+
+
+class TestRecordReplay(unittest.TestCase):
+    def setUp(self):
+        self.working_directory = tempfile.mkdtemp()
+        with open(f"{self.working_directory}/main.py", "w") as f:
+            f.write("print('hi')\n")
+        self.addCleanup(shutil.rmtree, self.working_directory)
+        self.addCleanup(release_workspace, self.working_directory)
+        self.cassette = f"{self.working_directory}/session.jsonl"
+
+    def script(self):
+        return ScriptedBackend(
+            model_turn(call("get_file_content", file_path="main.py")),
+            model_turn(types.Part(text="It prints hi.")),
+        )
+
+    def run_session(self, backend):
+        messages = [user_message("what does main.py do?")]
+        result = run_agent(backend, messages, working_directory=self.working_directory, quiet=True)
+        return result, [dump_model(message) for message in messages]
+
+    def test_round_trip(self):
+        recorded, recorded_messages = self.run_session(RecordingBackend(self.script(), self.cassette))
+        interactions = load_cassette(self.cassette)
+        self.assertEqual(len(interactions), 2)
+        self.assertEqual(interactions[0]["request"]["model"], MODEL)
+        # The second request carries the tool response to the first
+        self.assertEqual(len(interactions[1]["request"]["contents"]), 3)
+
+        replay = ReplayBackend(self.cassette)
+        replayed, replayed_messages = self.run_session(replay)
+        self.assertEqual(replayed["text"], recorded["text"])
+        self.assertEqual(replayed_messages, recorded_messages)
+        self.assertEqual(replayed["trace"].tokens, recorded["trace"].tokens)
+        with self.assertRaisesRegex(RuntimeError, "exhausted after 2 interactions"):
+            replay.generate_content(model=MODEL, contents=[])
+
+        replay.rewind()
+        self.assertEqual(self.run_session(replay)[1], recorded_messages)
+
+    def test_streamed_recording_replays_both_ways(self):
+        usage = types.GenerateContentResponseUsageMetadata(
+            prompt_token_count=100, candidates_token_count=10, total_token_count=110
+        )
+        source = f"{self.working_directory}/source.jsonl"
+        with open(source, "w") as f:
+            turn = [chunk(types.Part(text="It prints ")), chunk(types.Part(text="hi.")), chunk(usage=usage)]
+            f.write(json.dumps({"request": {}, "response": [dump_model(item) for item in turn]}) + "\n")
+        recorder = RecordingBackend(ReplayBackend(source), self.cassette)
+
+        async def collect(backend):
+            return [item async for item in backend.generate_content_stream(model=MODEL, contents=[])]
+
+        recorded = asyncio.run(collect(recorder))
+        self.assertEqual(len(recorded), 3)
+
+        replayed = asyncio.run(collect(ReplayBackend(self.cassette)))
+        self.assertEqual([dump_model(item) for item in replayed], [dump_model(item) for item in recorded])
+
+        merged = ReplayBackend(self.cassette).generate_content(model=MODEL, contents=[])
+        self.assertEqual(merged.text, "It prints hi.")
+        self.assertEqual(merged.usage_metadata.total_token_count, 110)
+
+
+class TestResponseCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.cache = ResponseCache(f"{self.directory}/cache.db")
+        self.addCleanup(self.cache.close)
+
+    def generate(self, backend, prompt="hello", model=MODEL, config=None):
+        response = backend.generate_content(model=model, contents=[user_message(prompt)], config=config)
+        return response.candidates[0].content.parts[0].text
+
+    def test_key_covers_model_config_and_contents(self):
+        contents = [user_message("hello")]
+        config = types.GenerateContentConfig(system_instruction="be brief")
+        key = request_key(MODEL, contents, config)
+        self.assertEqual(key, request_key(MODEL, [user_message("hello")], types.GenerateContentConfig(system_instruction="be brief")))
+        self.assertNotEqual(key, request_key("other-model", contents, config))
+        self.assertNotEqual(key, request_key(MODEL, [user_message("hello!")], config))
+        self.assertNotEqual(key, request_key(MODEL, contents + [model_turn(types.Part(text="hi"))], config))
+        self.assertNotEqual(key, request_key(MODEL, contents, types.GenerateContentConfig(system_instruction="be long")))
+        self.assertNotEqual(key, request_key(MODEL, contents))
+
+    def test_hits_and_misses(self):
+        scripted = ScriptedBackend(*[model_turn(types.Part(text=f"answer {n}")) for n in range(3)])
+        backend = CachedBackend(scripted, self.cache)
+        self.assertEqual(self.generate(backend), "answer 0")
+        self.assertEqual(self.generate(backend), "answer 0")
+        self.assertEqual(self.generate(backend, "goodbye"), "answer 1")
+        self.assertEqual(self.generate(backend, model="other-model"), "answer 2")
+        self.assertEqual(len(scripted.models), 3)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 3))
+
+        # Entries outlive the process that stored them
+        self.cache.close()
+        self.cache = ResponseCache(f"{self.directory}/cache.db")
+        self.assertEqual(self.generate(CachedBackend(ScriptedBackend(), self.cache), "goodbye"), "answer 1")
+
+    def test_turns_without_candidates_are_not_stored(self):
+        empty = ModelBackend()
+        empty.generate_content = lambda **kwargs: types.GenerateContentResponse()
+        CachedBackend(empty, self.cache).generate_content(model=MODEL, contents=[user_message("hello")])
+        self.assertIsNone(self.cache.get(request_key(MODEL, [user_message("hello")])))
+
+    def test_workspace_change_is_a_miss(self):
+        workspace = f"{self.directory}/workspace"
+        os.mkdir(workspace)
+        with open(f"{workspace}/main.py", "w") as f:
+            f.write("print('hi')\n")
+        scripted = ScriptedBackend(*[model_turn(types.Part(text=f"answer {n}")) for n in range(2)])
+        backend = CachedBackend(scripted, self.cache, workspace=workspace)
+        self.assertEqual(self.generate(backend), "answer 0")
+        self.assertEqual(self.generate(backend), "answer 0")
+        with open(f"{workspace}/main.py", "w") as f:
+            f.write("print('bye')\n")
+        self.assertEqual(self.generate(backend), "answer 1")
+        # Only the digest given at lookup decides; another one misses
+        self.assertIsNone(self.cache.get(request_key(MODEL, [user_message("hello")]), "other"))
+
+    def test_expiry_and_eviction(self):
+        self.cache.ttl = 0.05
+        self.cache.put("old", [{"text": "x"}])
+        time.sleep(0.1)
+        self.assertIsNone(self.cache.get("old"))
+
+        self.cache.ttl = None
+        self.cache.max_bytes = 2 * len(json.dumps([{"text": "x" * 100}]))
+        for key in ("a", "b"):
+            self.cache.put(key, [{"text": "x" * 100}])
+            time.sleep(0.01)
+        self.assertIsNotNone(self.cache.get("a"))
+        self.cache.put("c", [{"text": "x" * 100}])
+        # b was used least recently
+        self.assertIsNone(self.cache.get("b"))
+        self.assertIsNotNone(self.cache.get("a"))
+        self.assertIsNotNone(self.cache.get("c"))
+
+    def test_streamed_hit_replays_the_chunks(self):
+        source = f"{self.directory}/source.jsonl"
+        with open(source, "w") as f:
+            turn = [chunk(types.Part(text="It prints ")), chunk(types.Part(text="hi."))]
+            f.write(json.dumps({"request": {}, "response": [dump_model(item) for item in turn]}) + "\n")
+
+        async def collect(backend):
+            stream = backend.generate_content_stream(model=MODEL, contents=[user_message("hello")])
+            return [item.text async for item in stream]
+
+        self.assertEqual(asyncio.run(collect(CachedBackend(ReplayBackend(source), self.cache))), ["It prints ", "hi."])
+        # An empty cassette would raise if the cache missed
+        empty = f"{self.directory}/empty.jsonl"
+        open(empty, "w").close()
+        backend = CachedBackend(ReplayBackend(empty), self.cache)
+        self.assertEqual(asyncio.run(collect(backend)), ["It prints ", "hi."])
+        self.assertEqual(backend.generate_content(model=MODEL, contents=[user_message("hello")]).text, "It prints hi.")
+
+
+class FakeGemini:
+    """Local stand-in for the Gemini REST API. Each generateContent request
+    takes the next (delay, status) from script, or (0, 200) once it runs
+    out: it sleeps delay seconds, then answers with status, a text reply
+    for 200 and an error body otherwise."""
+
+    def __init__(self, *script):
+        self.script = list(script)
+        self.requests = 0
+        lock = threading.Lock()
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers["Content-Length"]))
+                with lock:
+                    fake.requests += 1
+                    delay, status = fake.script.pop(0) if fake.script else (0, 200)
+                time.sleep(delay)
+                if status == 200:
+                    body = {
+                        "candidates": [
+                            {"content": {"role": "model", "parts": [{"text": "hi"}]}, "finishReason": "STOP"}
+                        ],
+                        "usageMetadata": {"promptTokenCount": 5, "candidatesTokenCount": 1, "totalTokenCount": 6},
+                    }
+                else:
+                    body = {"error": {"code": status, "message": "injected failure", "status": "UNAVAILABLE"}}
+                data = json.dumps(body).encode()
+                try:
+                    self.send_response(status)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                except OSError:
+                    # A hedged or timed-out client may have gone away
+                    pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def backend(self):
+        client = genai.Client(
+            api_key="test",
+            http_options=types.HttpOptions(base_url=f"http://127.0.0.1:{self.httpd.server_address[1]}"),
+        )
+        return GenAIBackend(client)
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class TestResilientBackend(unittest.TestCase):
+    def resilient(self, *script, **options):
+        fake = FakeGemini(*script)
+        self.addCleanup(fake.close)
+        options.setdefault("backoff", 0.01)
+        return fake, ResilientBackend(fake.backend(), **options)
+
+    def generate(self, backend):
+        response = backend.generate_content(model=MODEL, contents=[user_message("hello")])
+        return response.candidates[0].content.parts[0].text
+
+    def test_retries_server_errors(self):
+        fake, backend = self.resilient((0, 503), (0, 500))
+        self.assertEqual(self.generate(backend), "hi")
+        self.assertEqual(fake.requests, 3)
+        self.assertEqual(backend.counters["retries"], 2)
+
+    def test_client_errors_are_not_retried(self):
+        fake, backend = self.resilient((0, 400))
+        with self.assertRaises(errors.ClientError):
+            self.generate(backend)
+        self.assertEqual(fake.requests, 1)
+        self.assertEqual(backend.counters["failures"], 1)
+
+    def test_gives_up_after_max_attempts(self):
+        fake, backend = self.resilient(*[(0, 503)] * 5, max_attempts=3)
+        with self.assertRaises(errors.ServerError):
+            self.generate(backend)
+        self.assertEqual(fake.requests, 3)
+
+    def test_slow_attempt_is_retried_after_attempt_timeout(self):
+        fake, backend = self.resilient((2, 200), attempt_timeout=0.3)
+        start = time.monotonic()
+        self.assertEqual(self.generate(backend), "hi")
+        self.assertLess(time.monotonic() - start, 1.5)
+        self.assertEqual(backend.counters["timeouts"], 1)
+
+    def test_deadline_bounds_the_whole_call(self):
+        fake, backend = self.resilient((2, 200), deadline=0.3)
+        start = time.monotonic()
+        with self.assertRaises(TimeoutError):
+            self.generate(backend)
+        self.assertLess(time.monotonic() - start, 1.5)
+
+    def test_hedge_answers_before_slow_request(self):
+        fake, backend = self.resilient((2, 200), hedge=True, hedge_after=0.1)
+        start = time.monotonic()
+        self.assertEqual(self.generate(backend), "hi")
+        self.assertLess(time.monotonic() - start, 1.5)
+        self.assertEqual((backend.counters["hedges"], backend.counters["hedge_wins"]), (1, 1))
+
+    def test_fast_answers_are_not_hedged(self):
+        fake, backend = self.resilient(hedge=True, hedge_after=1.0)
+        self.assertEqual(self.generate(backend), "hi")
+        self.assertEqual((fake.requests, backend.counters["hedges"]), (1, 0))
+
+    def test_retries_and_hedges_go_through_rate_limiter(self):
+        class CountingLimiter(RateLimiter):
+            acquired = 0
+
+            def acquire(self, tokens=0):
+                self.acquired += 1
+                return super().acquire(tokens)
+
+            def try_acquire(self, tokens=0):
+                taken = super().try_acquire(tokens)
+                self.acquired += taken
+                return taken
+
+        fake = FakeGemini((0, 503), (2, 200))
+        self.addCleanup(fake.close)
+        limiter = CountingLimiter(requests_per_minute=600)
+        backend = ResilientBackend(
+            fake.backend(), backoff=0.01, hedge=True, hedge_after=0.1, limiter=limiter
+        )
+        self.assertEqual(self.generate(backend), "hi")
+        self.assertEqual(fake.requests, 3)
+        self.assertEqual(limiter.acquired, 3)
+
+    def test_no_hedging_under_a_drained_limiter(self):
+        fake = FakeGemini(*[(0.3, 200)] * 2)
+        self.addCleanup(fake.close)
+        limiter = RateLimiter(requests_per_minute=60)
+        while limiter.try_acquire():
+            pass
+        # One permit a second: waiting for one must not start the hedge or
+        # timeout clock, and no hedge may queue for a permit
+        backend = ResilientBackend(
+            fake.backend(), hedge=True, hedge_after=0.1, attempt_timeout=0.8, limiter=limiter
+        )
+        for _ in range(2):
+            self.assertEqual(self.generate(backend), "hi")
+        time.sleep(0.5)
+        self.assertEqual(fake.requests, 2)
+        self.assertEqual(backend.counters["hedges"], 0)
+        self.assertEqual(backend.counters["hedges_skipped"], 2)
+        self.assertEqual(backend.counters["timeouts"], 0)
+
+
+class TestFileTools(unittest.TestCase):
+    def setUp(self):
+        self.working_directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.working_directory)
+
+    def test_writers_to_one_file_share_a_chain(self):
+        write = types.FunctionCall(name="write_file", args={"file_path": "a.py", "content": "x = 1\n"})
+        edit = types.FunctionCall(
+            name="edit_file", args={"file_path": "./a.py", "edits": [{"search": "x = 1", "replace": "x = 2"}]}
+        )
+        self.assertEqual(serial_key(write), serial_key(edit))
+        self.assertIsNone(serial_key(types.FunctionCall(name="get_file_content", args={"file_path": "a.py"})))
+
+        for _ in range(20):
+            responses = call_functions(
+                [write, edit], max_workers=4, working_directory=self.working_directory, quiet=True
+            )
+            results = [response.parts[0].function_response.response["result"] for response in responses]
+            self.assertTrue(results[1].startswith("Successfully edited"), results[1])
+            with open(f"{self.working_directory}/a.py") as f:
+                self.assertEqual(f.read(), "x = 2\n")
+
+    def test_listing_shows_new_sizes(self):
+        with open(f"{self.working_directory}/a.py", "w") as f:
+            f.write("x = 1\n")
+        self.assertIn("a.py: file_size=6 bytes", get_files_info(self.working_directory))
+        self.assertIn("unchanged", get_files_info(self.working_directory))
+        # Rewriting a file in place leaves the directory's own stat as it was
+        with open(f"{self.working_directory}/a.py", "w") as f:
+            f.write("x = 100\n")
+        self.assertIn("a.py: file_size=8 bytes", get_files_info(self.working_directory))
+
+    def make_tree(self):
+        files = {
+            ".gitignore": "build/\n*.log\n!keep.log\n",
+            ".git/config": "",
+            "a.py": "",
+            "app.log": "",
+            "b.txt": "",
+            "build/out.py": "",
+            "keep.log": "",
+            "pkg/.gitignore": "secret.py\n",
+            "pkg/__init__.py": "",
+            "pkg/secret.py": "",
+            "pkg/sub/deep.py": "",
+        }
+        for path, text in files.items():
+            os.makedirs(os.path.dirname(f"{self.working_directory}/{path}"), exist_ok=True)
+            with open(f"{self.working_directory}/{path}", "w") as f:
+                f.write(text)
+
+    def listed(self, **options):
+        listing = get_files_info(self.working_directory, **options)
+        return [line[2:].split(":")[0] for line in listing.splitlines() if line.startswith("- ")]
+
+    def test_recursive_listing(self):
+        self.make_tree()
+        self.assertEqual(
+            self.listed(recursive=True),
+            [".gitignore", "a.py", "b.txt", "keep.log", "pkg", "pkg/.gitignore", "pkg/__init__.py", "pkg/sub", "pkg/sub/deep.py"],
+        )
+        self.assertEqual(self.listed(), [".gitignore", "a.py", "b.txt", "keep.log", "pkg"])
+        self.assertEqual(
+            self.listed(recursive=True, max_depth=2),
+            [".gitignore", "a.py", "b.txt", "keep.log", "pkg", "pkg/.gitignore", "pkg/__init__.py", "pkg/sub"],
+        )
+        self.assertIn("build/out.py", self.listed(recursive=True, respect_gitignore=False))
+        self.assertIn("pkg/secret.py", self.listed(recursive=True, respect_gitignore=False))
+        self.assertNotIn(".git", self.listed(recursive=True, respect_gitignore=False))
+
+    def test_filtered_listing(self):
+        self.make_tree()
+        self.assertEqual(self.listed(recursive=True, include=["*.py"]), ["a.py", "pkg/__init__.py", "pkg/sub/deep.py"])
+        self.assertEqual(self.listed(recursive=True, include=["pkg/sub/*"]), ["pkg/sub/deep.py"])
+        self.assertEqual(
+            self.listed(recursive=True, exclude=["sub", ".*"]),
+            ["a.py", "b.txt", "keep.log", "pkg", "pkg/__init__.py"],
+        )
+
+    def test_paged_listing(self):
+        self.make_tree()
+        everything = self.listed(recursive=True)
+        pages, token = [], None
+        while True:
+            listing = get_files_info(self.working_directory, recursive=True, page_size=4, page_token=token)
+            pages.append([line[2:].split(":")[0] for line in listing.splitlines() if line.startswith("- ")])
+            if "[More entries" not in listing:
+                break
+            token = listing.rsplit('page_token="', 1)[1].split('"')[0]
+        self.assertEqual([len(page) for page in pages], [4, 4, 1])
+        self.assertEqual(sum(pages, []), everything)
+        self.assertIn("Error", get_files_info(self.working_directory, page_token="next"))
+        self.assertIn("Error", get_files_info(self.working_directory, page_size=0))
+
+    def read_pages(self, file_path, **options):
+        # Follows the next-page hints; returns the headers and the joined text
+        headers, text, offset = [], "", 0
+        while offset is not None:
+            page = get_file_content(self.working_directory, file_path, offset=offset, **options)
+            header, _, body = page.partition("\n")
+            headers.append(header)
+            offset = None
+            for line in body.splitlines(keepends=True):
+                if line.startswith("[Next page: offset="):
+                    offset = int(line[len("[Next page: offset=") :].split(",")[0])
+                elif not line.startswith("[Page cut"):
+                    text += line
+        return headers, text
+
+    def test_paging_by_lines(self):
+        lines = [f"{number:05d} " + "x" * 93 + "\n" for number in range(1000)]
+        with open(f"{self.working_directory}/big.txt", "w") as f:
+            f.writelines(lines)
+        headers, text = self.read_pages("big.txt", limit=300)
+        self.assertEqual(text, "".join(lines))
+        self.assertEqual(headers[1], '[File "big.txt": lines 101-200 of 1000; 100000 bytes, 1000 lines total]')
+
+    def test_page_over_max_chars_is_cut_at_a_line(self):
+        lines = [f"{number:05d} " + "x" * 93 + "\n" for number in range(1000)]
+        with open(f"{self.working_directory}/big.txt", "w") as f:
+            f.writelines(lines)
+        page = get_file_content(self.working_directory, "big.txt", offset=0)
+        self.assertTrue(page.startswith('[File "big.txt": lines 1-100 of 1000;'), page[:80])
+        self.assertIn(lines[99], page)
+        self.assertNotIn(lines[100], page)
+        self.assertTrue(page.endswith('[Next page: offset=100, unit="lines"]'))
+
+    def test_paging_by_bytes(self):
+        content = "é" * 7000 + "\n"
+        with open(f"{self.working_directory}/wide.txt", "w", encoding="utf-8") as f:
+            f.write(content)
+        headers, text = self.read_pages("wide.txt", unit="bytes", limit=20000)
+        # Pages end between characters; the hints after them start a new line
+        self.assertEqual(text.replace("\n", ""), content[:-1])
+        self.assertEqual(headers[0], '[File "wide.txt": bytes 0-10000 of 14001; 14001 bytes, 1 lines total]')
+        self.assertEqual(headers[1], '[File "wide.txt": bytes 10000-14001 of 14001; 14001 bytes, 1 lines total]')
+
+    def test_parse_hunks(self):
+        diff = (
+            "--- a/f.py\n+++ b/f.py\n"
+            "@@ -2,3 +2,3 @@\n b\n-c\n+C\n\n"
+            "@@ -9 +9 @@\n-i\n\\ No newline at end of file\n+I\n\\ No newline at end of file\n"
+        )
+        self.assertEqual(
+            _parse_hunks(diff),
+            [(2, ["b\n", "c\n", "\n"], ["b\n", "C\n", "\n"]), (9, ["i"], ["I"])],
+        )
+        with self.assertRaisesRegex(EditError, "no hunks"):
+            _parse_hunks("--- a/f.py\n+++ b/f.py\n")
+        with self.assertRaisesRegex(EditError, "unexpected line"):
+            _parse_hunks("@@ -1 +1 @@\n*x\n")
+
+    def test_apply_unified_diff(self):
+        content = "a\nb\nc\nd\n"
+        self.assertEqual(_apply_unified_diff(content, "@@ -2,2 +2,2 @@\n b\n-c\n+C\n"), "a\nb\nC\nd\n")
+        # Stale line numbers: the unique exact match elsewhere is used
+        self.assertEqual(_apply_unified_diff(content, "@@ -7,2 +7,2 @@\n b\n-c\n+C\n"), "a\nb\nC\nd\n")
+        # Line offsets from earlier hunks carry over to later ones
+        self.assertEqual(
+            _apply_unified_diff(content, "@@ -1 +1,2 @@\n a\n+a2\n@@ -4 +5 @@\n-d\n+D\n"),
+            "a\na2\nb\nc\nD\n",
+        )
+
+    def test_no_newline_markers(self):
+        # git's diff for adding the final newline: the marker follows the old side only
+        diff = "@@ -1,2 +1,2 @@\n ctx\n-old\n\\ No newline at end of file\n+old\n"
+        self.assertEqual(_apply_unified_diff("ctx\nold", diff), "ctx\nold\n")
+        # ...and for removing it: the marker follows the new side only
+        diff = "@@ -1,2 +1,2 @@\n ctx\n-old\n+old\n\\ No newline at end of file\n"
+        self.assertEqual(_apply_unified_diff("ctx\nold\n", diff), "ctx\nold")
+        # A context line without a newline on either side
+        diff = "@@ -1,2 +1,2 @@\n-a\n+A\n b\n\\ No newline at end of file\n"
+        self.assertEqual(_apply_unified_diff("a\nb", diff), "A\nb")
+
+    def test_diff_without_final_newline(self):
+        self.assertEqual(_apply_unified_diff("a\nb\nc\n", "@@ -2 +2 @@\n-b\n+B"), "a\nB\nc\n")
+        self.assertEqual(_apply_unified_diff("a\nb\nc\n", "@@ -2,2 +2,2 @@\n-b\n+B\n c"), "a\nB\nc\n")
+
+    def test_stale_hunk_must_match_once(self):
+        content = "x\ny\nx\ny\n"
+        with self.assertRaisesRegex(EditError, "hunk 1 matches 2 places"):
+            _apply_unified_diff(content, "@@ -9,2 +9,2 @@\n x\n-y\n+Y\n")
+        with self.assertRaisesRegex(EditError, "hunk 1 was not found"):
+            _apply_unified_diff(content, "@@ -1 +1 @@\n-z\n+Z\n")
+
+
+class TestRunTests(unittest.TestCase):
+    def setUp(self):
+        self.working_directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.working_directory)
+        self.addCleanup(release_workspace, self.working_directory)
+
+    def write(self, name, source):
+        with open(f"{self.working_directory}/{name}", "w") as f:
+            f.write(source)
+
+    def test_tests_are_sharded_but_class_fixtures_run_once(self):
+        self.write("test_shards.py", (
+            "import os, unittest\n"
+            "def test_plain():\n    pass\n"
+            "class TestIndependent(unittest.TestCase):\n"
+            "    def test_a(self):\n        pass\n"
+            "    def test_b(self):\n        pass\n"
+            "class TestFixture(unittest.TestCase):\n"
+            "    @classmethod\n"
+            "    def setUpClass(cls):\n"
+            "        with open('setups.log', 'a') as f:\n"
+            "            f.write(f'{os.getpid()}\\n')\n"
+            "    def test_c(self):\n        pass\n"
+            "    def test_d(self):\n        pass\n"
+        ))
+        report = run_tests(self.working_directory)
+        self.assertIn("Ran 5 tests", report)
+        self.assertIn("on 4 workers: 5 passed, 0 failed", report)
+        with open(f"{self.working_directory}/setups.log") as f:
+            self.assertEqual(len(f.readlines()), 1)
+
+    def test_failed_only_reruns_the_failures(self):
+        self.write("test_mixed.py", (
+            "import unittest\n"
+            "class TestMixed(unittest.TestCase):\n"
+            "    def test_passes(self):\n        pass\n"
+            "    def test_fails(self):\n        self.assertEqual(1, 2)\n"
+            "    def test_errors(self):\n        raise KeyError('boom')\n"
+        ))
+        report = run_tests(self.working_directory)
+        self.assertIn("1 passed, 1 failed, 1 errors", report)
+
+        report = run_tests(self.working_directory, failed_only=True)
+        self.assertIn("Ran 2 tests", report)
+        self.assertIn("FAILED test_mixed.py::TestMixed::test_fails", report)
+        self.assertIn("ERROR test_mixed.py::TestMixed::test_errors", report)
+
+        self.write("test_mixed.py", (
+            "import unittest\n"
+            "class TestMixed(unittest.TestCase):\n"
+            "    def test_fails(self):\n        pass\n"
+            "    def test_errors(self):\n        pass\n"
+        ))
+        self.assertIn("2 passed, 0 failed", run_tests(self.working_directory, failed_only=True))
+        self.assertEqual(run_tests(self.working_directory, failed_only=True), "No failed tests to rerun")
+
+    def test_release_forgets_failures(self):
+        self.write("test_fail.py", "def test_fails():\n    assert False\n")
+        run_tests(self.working_directory)
+        self.assertIn(os.path.abspath(self.working_directory), _last_failed)
+        release_workspace(self.working_directory)
+        self.assertNotIn(os.path.abspath(self.working_directory), _last_failed)
+        self.assertEqual(run_tests(self.working_directory, failed_only=True), "No failed tests to rerun")
+
+
+class TestSearchCode(unittest.TestCase):
+    WORDS = ["alpha", "Beta", "gamma", "delta_fn", "return", "x = 1", "def ", "import os", "Alphabet"]
+    QUERIES = [
+        ("alpha", {}),
+        ("alpha", {"case_sensitive": False}),
+        ("delta_fn", {}),
+        ("def \\w+", {"regex": True}),
+        ("import os|return", {"regex": True}),
+        ("x", {}),
+        ("zzz", {}),
+        ("gamma", {"path": "pkg"}),
+    ]
+
+    def setUp(self):
+        self.working_directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.working_directory)
+        self.addCleanup(release_workspace, self.working_directory)
+        self.random = random.Random(8)
+        for index in range(30):
+            self.write(f"{'pkg/' if index % 3 else ''}m{index}.py", self.text())
+        with open(f"{self.working_directory}/blob.bin", "wb") as f:
+            f.write(b"alpha\0" * 10)
+
+    def text(self):
+        return "".join(
+            " ".join(self.random.choices(self.WORDS, k=3)) + "\n" for _ in range(self.random.randint(1, 20))
+        )
+
+    def write(self, rel_path, text):
+        os.makedirs(os.path.dirname(f"{self.working_directory}/{rel_path}"), exist_ok=True)
+        with open(f"{self.working_directory}/{rel_path}", "w") as f:
+            f.write(text)
+
+    def scan(self, query, regex=False, case_sensitive=True, path="."):
+        # What search_code must return, found without the index
+        pattern = re.compile(query if regex else re.escape(query), 0 if case_sensitive else re.IGNORECASE)
+        results = []
+        for dirpath, _, filenames in os.walk(self.working_directory):
+            for filename in filenames:
+                rel_path = os.path.relpath(os.path.join(dirpath, filename), self.working_directory)
+                if not rel_path.startswith("" if path == "." else path + "/"):
+                    continue
+                with open(os.path.join(dirpath, filename), "rb") as f:
+                    data = f.read()
+                if b"\0" in data:
+                    continue
+                for line_number, line in enumerate(data.decode().splitlines(), 1):
+                    if pattern.search(line):
+                        results.append(f"{rel_path}:{line_number}: {line.strip()}")
+        return sorted(results, key=lambda result: (result.split(":")[0], int(result.split(":")[1])))
+
+    def assert_matches_scan(self):
+        for query, options in self.QUERIES:
+            expected = self.scan(query, **options)
+            found = search_code(self.working_directory, query, max_results=10000, **options)
+            self.assertEqual(found.splitlines() if expected else found, expected or f'No matches for "{query}"', (query, options))
+
+    def test_matches_a_plain_scan(self):
+        self.assert_matches_scan()
+
+    def test_matches_a_plain_scan_after_changes(self):
+        self.assert_matches_scan()
+        # Written through the tool: the index is updated in place
+        write_file(self.working_directory, "m0.py", "def alpha_new():\n    return gamma\n")
+        write_file(self.working_directory, "pkg/new.py", "import os\nAlphabet\n")
+        self.assert_matches_scan()
+        # Changed behind its back, then reported as a run would
+        self.write("pkg/m1.py", "zzz delta_fn\n")
+        os.remove(f"{self.working_directory}/pkg/m2.py")
+        notify_tree_changed(self.working_directory)
+        self.assert_matches_scan()
+
+
+class TestWorkspaceManifest(unittest.TestCase):
+    def setUp(self):
+        self.working_directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.working_directory)
+        self.addCleanup(release_workspace, self.working_directory)
+        for path, text in {"a.py": "x = 1\n", "b.py": "y = 2\n", "c.py": "z = 3\n", ".gitignore": "*.log\n"}.items():
+            self.write(path, text)
+
+    def write(self, rel_path, text):
+        os.makedirs(os.path.dirname(f"{self.working_directory}/{rel_path}"), exist_ok=True)
+        with open(f"{self.working_directory}/{rel_path}", "w") as f:
+            f.write(text)
+
+    def test_changes_after_writes_and_deletes(self):
+        manifest = WorkspaceManifest(self.working_directory)
+        manifest.checkpoint("before")
+        write_file(self.working_directory, "pkg/new.py", "print('new')\n")
+        # Same size, new content
+        write_file(self.working_directory, "a.py", "x = 9\n")
+        os.remove(f"{self.working_directory}/b.py")
+        # Touched but unchanged, and files that are never tracked
+        os.utime(f"{self.working_directory}/c.py", ns=(1, 1))
+        self.write("run.log", "ignored\n")
+        self.write("__pycache__/a.cpython-312.pyc", "ignored")
+
+        added, removed, modified, files = manifest.changes_since("before")
+        self.assertEqual((added, removed, modified), (["pkg/new.py"], ["b.py"], ["a.py"]))
+        self.assertEqual(files["pkg/new.py"][0], len("print('new')\n"))
+        self.assertIsNone(manifest.changes_since("missing"))
+
+        # Without advance the checkpoint stays put; with it, it moves
+        self.assertEqual(manifest.changes_since("before", advance=True)[:3], (["pkg/new.py"], ["b.py"], ["a.py"]))
+        self.assertEqual(manifest.changes_since("before")[:3], ([], [], []))
+
+    def test_same_size_rewrite_within_a_timestamp_tick(self):
+        manifest = WorkspaceManifest(self.working_directory)
+        manifest.checkpoint("before")
+        mtime_ns = os.stat(f"{self.working_directory}/a.py").st_mtime_ns
+        self.write("a.py", "x = 7\n")
+        # As a filesystem with coarse timestamps would leave it
+        os.utime(f"{self.working_directory}/a.py", ns=(mtime_ns, mtime_ns))
+        self.assertEqual(manifest.changes_since("before")[2], ["a.py"])
+
+    def test_digest_follows_content(self):
+        manifest = WorkspaceManifest(self.working_directory)
+        original = manifest.digest()
+        self.assertEqual(WorkspaceManifest(self.working_directory).digest(), original)
+        self.write("a.py", "x = 2\n")
+        changed = manifest.digest()
+        self.assertNotEqual(changed, original)
+        self.write("a.py", "x = 1\n")
+        self.assertEqual(manifest.digest(), original)
+        self.write("notes.log", "ignored\n")
+        self.assertEqual(manifest.digest(), original)
+
+    def test_tool_checkpoints(self):
+        tool = get_changes_since.get_changes_since
+        get_changes_since.manifest_for(self.working_directory).checkpoint(get_changes_since.START_CHECKPOINT)
+        self.assertEqual(tool(self.working_directory, "start"), 'No changes since checkpoint "start"')
+        self.assertIn('Created checkpoint "step"', tool(self.working_directory, "step"))
+
+        write_file(self.working_directory, "d.py", "w = 4\n")
+        os.remove(f"{self.working_directory}/c.py")
+        expected = "added: d.py (6 bytes)\nremoved: c.py"
+        self.assertEqual(tool(self.working_directory, "step"), 'Changes since checkpoint "step":\n' + expected)
+        self.assertEqual(tool(self.working_directory, "step"), 'No changes since checkpoint "step"')
+        # "start" never advances
+        for _ in range(2):
+            self.assertEqual(tool(self.working_directory, "start"), 'Changes since checkpoint "start":\n' + expected)
+
+
+class TestServer(unittest.TestCase):
+    def setUp(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        template = f"{root}/template"
+        os.makedirs(template)
+        with open(f"{template}/main.py", "w") as f:
+            f.write("print('hi')\n")
+        self.args = argparse.Namespace(
+            template=template,
+            sandbox_root=f"{root}/sandboxes",
+            sessions_dir=f"{root}/sessions",
+            max_running=2,
+            max_iterations=5,
+            max_workers=1,
+            token_budget=None,
+            keep_recent=6,
+        )
+
+    def serve(self, backend):
+        agent = AgentServer(backend, self.args)
+        httpd = make_server(agent, port=0)
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        self.addCleanup(agent.close)
+        self.addCleanup(httpd.server_close)
+        self.addCleanup(httpd.shutdown)
+        return agent, f"http://127.0.0.1:{httpd.server_address[1]}"
+
+    def post(self, url, body=None):
+        request = urllib.request.Request(url, data=json.dumps(body or {}).encode(), method="POST")
+        try:
+            with urllib.request.urlopen(request) as response:
+                return response.status, json.load(response)
+        except urllib.error.HTTPError as e:
+            return e.code, json.load(e)
+
+    def test_start_checkpoint_spans_every_turn(self):
+        agent, url = self.serve(
+            ScriptedBackend(
+                model_turn(call("write_file", file_path="new.py", content="x = 1\n")),
+                model_turn(types.Part(text="Wrote it.")),
+                model_turn(call("get_changes_since", checkpoint="start")),
+                model_turn(types.Part(text="new.py was added.")),
+            )
+        )
+        status, info = self.post(f"{url}/sessions")
+        self.assertEqual(status, 201)
+        self.assertEqual(self.post(f"{url}/sessions/{info['session']}/messages", {"prompt": "add new.py"})[0], 200)
+        self.assertEqual(self.post(f"{url}/sessions/{info['session']}/messages", {"prompt": "what changed?"})[0], 200)
+        session = agent.get_session(info["session"])
+        changes = session.messages[-2].parts[0].function_response.response["result"]
+        self.assertIn("added: new.py", changes)
+
+    def test_invalid_max_iterations_is_rejected(self):
+        agent, url = self.serve(ScriptedBackend())
+        _, info = self.post(f"{url}/sessions")
+        for value in (0, -1, "5", 2.5, True):
+            status, body = self.post(
+                f"{url}/sessions/{info['session']}/messages", {"prompt": "hi", "max_iterations": value}
+            )
+            self.assertEqual(status, 400, value)
+            self.assertIn("max_iterations", body["error"])
+        self.assertEqual(agent.get_session(info["session"]).messages, [])
+
+
+class TestOutputCapture(unittest.TestCase):
+    def setUp(self):
+        self.working_directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.working_directory)
+
+    def script(self, source):
+        with open(f"{self.working_directory}/script.py", "w") as f:
+            f.write(source)
+        return "script.py"
+
+    def test_bounded_buffer_keeps_head_and_tail(self):
+        buffer = BoundedBuffer(10)
+        for chunk in (b"abc", b"defgh", b"ijklmnop", b"qr"):
+            buffer.write(chunk)
+        self.assertEqual((bytes(buffer.head), bytes(buffer.tail)), (b"abcde", b"nopqr"))
+        self.assertEqual((buffer.total, buffer.dropped), (18, 8))
+        self.assertEqual(buffer.text(), "abcde\n[... 8 bytes dropped ...]\nnopqr")
+
+        small = BoundedBuffer(10)
+        small.write(b"abcdefg")
+        self.assertEqual((small.dropped, small.text()), (0, "abcdefg"))
+
+    def test_cold_run_is_killed_on_overflow(self):
+        file_path = self.script("import sys, time\nwhile True:\n    sys.stdout.write('x' * 4096)\n")
+        start = time.monotonic()
+        stdout, _, returncode, killed = _run_cold(
+            ["python3", file_path], self.working_directory, 10, 1000, True
+        )
+        self.assertLess(time.monotonic() - start, 5)
+        self.assertTrue(killed)
+        self.assertEqual(len(stdout.head) + len(stdout.tail), 1000)
+        self.assertGreater(stdout.dropped, 0)
+
+    def test_cold_run_timeout(self):
+        file_path = self.script("import time\ntime.sleep(60)\n")
+        start = time.monotonic()
+        with self.assertRaises(subprocess.TimeoutExpired):
+            _run_cold(["python3", file_path], self.working_directory, 0.5, 1000, False)
+        self.assertLess(time.monotonic() - start, 5)
+
+    def test_background_child_does_not_outlive_the_timeout(self):
+        file_path = self.script("import subprocess\nsubprocess.Popen(['sleep', '60'])\nprint('started')\n")
+        start = time.monotonic()
+        stdout, _, returncode, _ = _run_cold(["python3", file_path], self.working_directory, 1, 1000, False)
+        self.assertLess(time.monotonic() - start, 5)
+        self.assertEqual((stdout.text(), returncode), ("started\n", 0))
+
+    @unittest.skipUnless(available(), "warm workers need fork and fd passing")
+    def test_warm_background_child_does_not_outlive_the_timeout(self):
+        file_path = self.script("import subprocess\nsubprocess.Popen(['sleep', '60'])\nprint('started')\n")
+        worker = WarmWorker(self.working_directory)
+        self.addCleanup(worker.close)
+        start = time.monotonic()
+        stdout, _, returncode, _ = worker.run(file_path, [], self.working_directory, 1, 1000)
+        self.assertLess(time.monotonic() - start, 5)
+        self.assertEqual((stdout.text(), returncode), ("started\n", 0))
+
+
+@unittest.skipUnless(available(), "warm workers need fork and fd passing")
+class TestWarmPool(unittest.TestCase):
+    def setUp(self):
+        self.working_directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.working_directory)
+        self.pool = WarmPool(self.working_directory, 1)
+        self.addCleanup(self.pool.close)
+
+    def run_script(self, source, *args):
+        with open(f"{self.working_directory}/script.py", "w") as f:
+            f.write(source)
+        stdout, stderr, returncode, _ = self.pool.run("script.py", args, 5, 10000)
+        return stdout.text(), stderr.text(), returncode
+
+    def test_worker_is_reused(self):
+        source = "import os\nprint(os.getppid(), os.getpid())\n"
+        runs = [self.run_script(source)[0].split() for _ in range(3)]
+        worker = self.pool.idle.get()
+        self.pool.idle.put(worker)
+        # Every run is a fresh child of the same warm worker
+        self.assertEqual({parent for parent, _ in runs}, {str(worker.process.pid)})
+        self.assertEqual(len({child for _, child in runs}), 3)
+
+    def test_runs_are_isolated(self):
+        stdout, _, returncode = self.run_script(
+            "import json, os, sys\n"
+            "json.leaked = True\n"
+            "os.environ['LEAKED'] = '1'\n"
+            "sys.path.append('/leaked')\n"
+            "os.makedirs('sub', exist_ok=True)\n"
+            "os.chdir('sub')\n"
+            "print(sys.argv[1:], __name__)\n",
+            "first", "--flag",
+        )
+        self.assertEqual((stdout, returncode), ("['first', '--flag'] __main__\n", 0))
+
+        stdout, _, _ = self.run_script(
+            "import json, os, sys\n"
+            "print(hasattr(json, 'leaked'), 'LEAKED' in os.environ, '/leaked' in sys.path)\n"
+            "print(os.getcwd() == os.path.realpath(sys.argv[1]), sys.argv[2:])\n",
+            self.working_directory,
+        )
+        self.assertEqual(stdout, "False False False\nTrue []\n")
+
+    def test_exit_codes_and_tracebacks(self):
+        self.assertEqual(self.run_script("import sys\nsys.exit(3)\n")[2], 3)
+        self.assertEqual(self.run_script("import sys\nsys.exit('bad input')\n")[1:], ("bad input\n", 1))
+        _, stderr, returncode = self.run_script("def f():\n    raise KeyError('boom')\nf()\n")
+        self.assertEqual(returncode, 1)
+        self.assertIn('File "script.py", line 3', stderr)
+        self.assertNotIn("warm_worker", stderr)
+        self.assertNotIn("runpy", stderr)
+
+    def test_dead_worker_is_replaced(self):
+        worker = self.pool.idle.get()
+        self.pool.idle.put(worker)
+        worker.process.kill()
+        worker.process.wait()
+        self.assertEqual(self.run_script("print('ok')\n"), ("ok\n", "", 0))
+
+    def test_release_stops_the_workers(self):
+        original_size = warm_pool.pool_size
+        warm_pool.pool_size = 1
+        self.addCleanup(setattr, warm_pool, "pool_size", original_size)
+        pool = pool_for(self.working_directory)
+        worker = pool.idle.get()
+        pool.idle.put(worker)
+        self.assertIs(pool_for(self.working_directory), pool)
+
+        release_workspace(self.working_directory)
+        self.assertEqual(worker.process.wait(timeout=5), 0)
+        self.assertIsNot(pool_for(self.working_directory), pool)
+        release_workspace(self.working_directory)
+
+
+class TestSessionLog(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = f"{directory}/session.jsonl"
+
+    def write(self, *messages, tail=""):
+        log = SessionLog(self.path)
+        for content in messages:
+            log.append(content)
+        log.close()
+        with open(self.path, "a") as f:
+            f.write(tail)
+
+    def test_round_trip(self):
+        messages = [
+            user_message("fix the bug"),
+            model_turn(call("get_files_info", directory=".")),
+            tool_turn("get_files_info", "- main.py: file_size=100 bytes, is_dir=False"),
+            model_turn(types.Part(text="Done.")),
+        ]
+        self.write(*messages)
+        self.assertEqual(load_session(self.path), (messages, 0))
+
+    def test_torn_last_line_ends_the_log(self):
+        self.write(user_message("fix the bug"), tail='{"role":"model","parts":[{"te')
+        messages, dropped = load_session(self.path)
+        self.assertEqual((len(messages), dropped), (1, 0))
+
+    def test_unanswered_calls_are_dropped(self):
+        messages = [
+            user_message("fix the bug"),
+            model_turn(call("get_file_content", file_path="a.py"), call("get_file_content", file_path="b.py")),
+            tool_turn("get_file_content", "a"),
+        ]
+        self.assertEqual(_unanswered_tail(messages), 1)
+        self.write(*messages)
+        self.assertEqual(load_session(self.path), (messages[:1], 2))
+
+        messages.append(tool_turn("get_file_content", "b"))
+        self.assertIsNone(_unanswered_tail(messages))
+        self.assertIsNone(_unanswered_tail(messages[:1]))
+        self.assertIsNone(_unanswered_tail([]))
+
+    def test_empty_or_torn_first_line(self):
+        self.write()
+        self.assertEqual(load_session(self.path), ([], 0))
+        self.write(tail='{"role":"us')
+        self.assertEqual(load_session(self.path), ([], 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
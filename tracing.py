@@ -0,0 +1,137 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# usage_metadata fields summed across every model response of a run
+USAGE_FIELDS = {
+    "prompt": "prompt_token_count",
+    "response": "candidates_token_count",
+    "cached": "cached_content_token_count",
+    "thoughts": "thoughts_token_count",
+    "total": "total_token_count",
+}
+
+
+class Tracer:
+    """Collects timed spans and cumulative token usage for one agent run.
+
+    Spans are (category, name, start, duration, thread, args) records taken
+    with time.perf_counter, so the model call, each tool call and the
+    iteration around them can be laid out on one timeline. Safe to use from
+    the worker threads that run tool calls."""
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.spans = []
+        self.tokens = {key: 0 for key in USAGE_FIELDS}
+        self.model_calls = 0
+        self._threads = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, category, name, **args):
+        """Time the body of a with block. The yielded dict can be filled
+        with extra args while the span is open."""
+        start = time.perf_counter()
+        try:
+            yield args
+        finally:
+            self.record(category, name, start, time.perf_counter(), **args)
+
+    def record(self, category, name, start, end, **args):
+        """Add a span measured elsewhere from two perf_counter readings."""
+        with self._lock:
+            thread = self._threads.setdefault(
+                threading.get_ident(),
+                (len(self._threads), threading.current_thread().name),
+            )[0]
+            self.spans.append(
+                {
+                    "category": category,
+                    "name": name,
+                    "start": start - self.origin,
+                    "duration": end - start,
+                    "thread": thread,
+                    "args": args,
+                }
+            )
+
+    def add_usage(self, usage):
+        """Add one response's usage_metadata to the running totals and
+        return that response's counts."""
+        counts = {
+            key: (getattr(usage, field, None) or 0) if usage else 0
+            for key, field in USAGE_FIELDS.items()
+        }
+        with self._lock:
+            self.model_calls += 1
+            for key, value in counts.items():
+                self.tokens[key] += value
+        return counts
+
+    def to_json(self):
+        return {
+            "tokens": dict(self.tokens),
+            "model_calls": self.model_calls,
+            "spans": sorted(self.spans, key=lambda span: span["start"]),
+        }
+
+    def to_chrome_trace(self):
+        """Events in the Chrome trace-event format, for chrome://tracing
+        or https://ui.perfetto.dev."""
+        pid = os.getpid()
+        events = [
+            {"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}
+            for tid, name in self._threads.values()
+        ]
+        for span in self.to_json()["spans"]:
+            events.append(
+                {
+                    "name": span["name"],
+                    "cat": span["category"],
+                    "ph": "X",
+                    "ts": round(span["start"] * 1e6, 1),
+                    "dur": round(span["duration"] * 1e6, 1),
+                    "pid": pid,
+                    "tid": span["thread"],
+                    "args": span["args"],
+                }
+            )
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def write(self, path, format="json"):
+        data = self.to_chrome_trace() if format == "chrome" else self.to_json()
+        with open(path, "w") as f:
+            json.dump(data, f, indent=1, default=str)
+
+    def summary(self):
+        """A plain-text table of time per span kind, token totals and tool
+        result sizes."""
+        rows = {}
+        for span in self.spans:
+            key = f"tool:{span['name']}" if span["category"] == "tool" else span["category"]
+            row = rows.setdefault(key, {"count": 0, "total": 0.0, "max": 0.0, "chars": 0})
+            row["count"] += 1
+            row["total"] += span["duration"]
+            row["max"] = max(row["max"], span["duration"])
+            row["chars"] += span["args"].get("result_chars", 0)
+
+        width = max([len(key) for key in rows] + [4])
+        lines = [
+            f"{'Span':<{width}}  {'Count':>5}  {'Total s':>8}  {'Mean ms':>8}  {'Max ms':>8}  {'Result chars':>12}"
+        ]
+        for key, row in sorted(rows.items(), key=lambda item: -item[1]["total"]):
+            lines.append(
+                f"{key:<{width}}  {row['count']:>5}  {row['total']:>8.3f}  "
+                f"{row['total'] / row['count'] * 1000:>8.1f}  {row['max'] * 1000:>8.1f}  "
+                f"{row['chars'] if key.startswith('tool:') else '':>12}"
+            )
+        tokens = self.tokens
+        lines.append(
+            f"Tokens over {self.model_calls} model calls: prompt {tokens['prompt']}, "
+            f"response {tokens['response']}, cached {tokens['cached']}, "
+            f"thoughts {tokens['thoughts']}, total {tokens['total']}"
+        )
+        return "\n".join(lines)